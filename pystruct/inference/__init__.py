@@ -1,8 +1,12 @@
 from .inference_methods import (inference_qpbo, inference_dai, inference_lp,
                                 inference_ad3, inference_ogm,
-                                inference_dispatch, get_installed,
-                                compute_energy)
+                                inference_max_product,
+                                inference_dispatch, batch_inference_dispatch,
+                                get_installed, uses_init,
+                                compute_energy, batch_compute_energy)
 
 __all__ = ["inference_qpbo", "inference_dai", "inference_lp", "inference_ad3",
-           "inference_dispatch", "get_installed", "compute_energy",
-           "inference_ogm"]
+           "inference_dispatch", "batch_inference_dispatch",
+           "get_installed", "uses_init", "compute_energy",
+           "batch_compute_energy",
+           "inference_ogm", "inference_max_product"]
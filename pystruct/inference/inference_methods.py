@@ -1,11 +1,16 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
 
 from .linear_programming import lp_general_graph
+from .maxprod import (is_chain, is_forest, chain_viterbi, tree_max_product,
+                      iterative_max_product)
 
 
 def get_installed(method_filter=None):
     if method_filter is None:
-        method_filter = ['ad3', 'qpbo', 'dai', 'ogm', 'lp']
+        method_filter = ['max-product', 'ad3', 'qpbo', 'dai', 'ogm', 'lp']
 
     installed = []
     unary = np.zeros((1, 1))
@@ -20,6 +25,30 @@ def get_installed(method_filter=None):
     return installed
 
 
+def uses_init(inference_method):
+    """Whether an inference method makes use of a warm-start labeling.
+
+    Only 'ogm' and 'max-product', on graphs with cycles, make use of the
+    ``init`` argument of ``inference_dispatch``. Learners only keep the
+    last loss-augmented prediction of each sample for them.
+
+    Parameters
+    ----------
+    inference_method : string, tuple or None
+        Inference method, see ``inference_dispatch``.
+
+    Returns
+    -------
+    uses_init : bool
+    """
+    if isinstance(inference_method, tuple):
+        inference_method, options = inference_method
+        if (inference_method == 'max-product'
+                and options.get('fallback') is not None):
+            return uses_init(options['fallback'])
+    return inference_method in ['ogm', 'max-product']
+
+
 def compute_energy(unary_potentials, pairwise_potentials, edges, labels):
     """Compute energy of labels for given energy function.
 
@@ -45,13 +74,43 @@ def compute_energy(unary_potentials, pairwise_potentials, edges, labels):
     energy : float
         Energy of assignment.
     """
+    return batch_compute_energy(unary_potentials, pairwise_potentials, edges,
+                                np.asarray(labels)[np.newaxis])[0]
+
+
+def batch_compute_energy(unary_potentials, pairwise_potentials, edges,
+                         labelings):
+    """Compute energies of several labelings of the same graph.
+
+    Parameters
+    ----------
+    unary_potentials : nd-array
+        Unary potentials of energy function.
+
+    pairwise_potentials : nd-array
+        Pairwise potentials of energy function.
+
+    edges : nd-array
+        Edges of energy function.
+
+    labelings : nd-array, shape (n_labelings, n_nodes)
+        Variable assignments to evaluate.
 
+    Returns
+    -------
+    energies : nd-array, shape (n_labelings,)
+        Energy of each assignment.
+    """
     n_states, pairwise_potentials = \
         _validate_params(unary_potentials, pairwise_potentials, edges)
-    energy = np.sum(unary_potentials[np.arange(len(labels)), labels])
-    for edge, pw in zip(edges, pairwise_potentials):
-        energy += pw[labels[edge[0]], labels[edge[1]]]
-    return energy
+    labelings = np.asarray(labelings)
+    edges = np.asarray(edges, dtype=np.intp)
+    energies = np.sum(unary_potentials[np.arange(labelings.shape[1]),
+                                       labelings], axis=1)
+    energies += np.sum(pairwise_potentials[np.arange(len(edges)),
+                                           labelings[:, edges[:, 0]],
+                                           labelings[:, edges[:, 1]]], axis=1)
+    return energies
 
 
 def inference_dispatch(unary_potentials, pairwise_potentials, edges,
@@ -76,6 +135,8 @@ def inference_dispatch(unary_potentials, pairwise_potentials, edges,
             * 'lp' for build-in lp relaxation via GLPK (slow).
             * 'ad3' for AD^3 subgradient based dual solution of LP.
             * 'ogm' for OpenGM wrappers.
+            * 'max-product' for build-in max-product message passing
+              (exact on chains and trees, TRW-S or loopy BP otherwise).
             * 'unary' for using unary potentials only.
 
         It is also possible to pass a tuple (string, dict) where the dict
@@ -91,6 +152,12 @@ def inference_dispatch(unary_potentials, pairwise_potentials, edges,
         the solver).  If relaxed=False, this is the energy of the relaxed, not
         the rounded solution.
 
+    init : nd-array or None (default=None)
+        Initial labeling to warm-start inference, for example the result of
+        the last call during learning. Used as starting point by 'ogm', and
+        by 'max-product' on graphs with cycles, see ``uses_init``. Ignored
+        by the other methods.
+
     Returns
     -------
     labels : nd-array
@@ -119,20 +186,126 @@ def inference_dispatch(unary_potentials, pairwise_potentials, edges,
     elif inference_method == "ogm":
         return inference_ogm(unary_potentials, pairwise_potentials, edges,
                              return_energy=return_energy, **kwargs)
+    elif inference_method == "max-product":
+        return inference_max_product(unary_potentials, pairwise_potentials,
+                                     edges, return_energy=return_energy,
+                                     **kwargs)
     elif inference_method == "unary":
         return inference_unaries(unary_potentials, pairwise_potentials, edges,
                                  **kwargs)
     else:
-        raise ValueError("inference_method must be 'lp', 'ad3', 'qpbo', 'ogm'"
-                         " or 'dai', got %s" % inference_method)
+        raise ValueError("inference_method must be 'max-product', 'lp', 'ad3',"
+                         " 'qpbo', 'ogm' or 'dai', got %s" % inference_method)
+
+
+def batch_inference_dispatch(unary_potentials, pairwise_potentials, edges,
+                             inference_method, init=None, **kwargs):
+    """Solve several independent problems with few calls to the solver.
+
+    For ``max-product``, the problems without cycles, which are solved
+    exactly, are packed into one graph with several connected components.
+    This graph is handed to ``inference_dispatch``, and the result is split
+    up again. All other problems are solved one by one: on graphs with
+    cycles the result of message passing and of alpha expansion depends on
+    the schedule and the stopping test, which would be shared by all
+    problems in a pack. For the other solvers, packing does not pay off
+    either: the interior point LP gets superlinearly slower and AD3
+    iterates until all components have converged.
+
+    Parameters
+    ----------
+    unary_potentials : list of nd-array
+        Unary potentials of each problem, of shape (n_nodes, n_states).
+
+    pairwise_potentials : list of nd-array
+        Pairwise potentials of each problem, either of shape
+        (n_states, n_states) or (n_edges, n_states, n_states).
+
+    edges : list of nd-array
+        Edges of each problem.
+
+    inference_method : string or tuple
+        Inference method, see ``inference_dispatch``.
+
+    init : list of nd-array or None (default=None)
+        Initial labeling of each problem, for warm-starting the solver.
+
+    Additional keyword arguments are passed to ``inference_dispatch``.
+
+    Returns
+    -------
+    labels : list
+        One result of ``inference_dispatch`` per problem. If the solver
+        returns relaxed solutions, each entry is a tuple of unary and pairwise
+        marginals. If ``return_energy=True``, each entry is a tuple of the
+        result and its energy.
+    """
+    method = inference_method
+    if isinstance(method, tuple):
+        method = method[0]
+    n_problems = len(unary_potentials)
+    if init is None:
+        init = [None] * n_problems
+    forest = np.zeros(n_problems, dtype=np.bool)
+    if method == 'max-product':
+        forest = np.array([is_forest(e, len(unary)) for unary, e
+                           in zip(unary_potentials, edges)], dtype=np.bool)
+
+    results = [None] * n_problems
+    for i in np.where(~forest)[0]:
+        results[i] = inference_dispatch(
+            unary_potentials[i], pairwise_potentials[i], edges[i],
+            inference_method, init=init[i], **kwargs)
+    pack = np.where(forest)[0]
+    if len(pack):
+        return_energy = kwargs.pop('return_energy', False)
+        labels = _packed_dispatch([unary_potentials[i] for i in pack],
+                                  [pairwise_potentials[i] for i in pack],
+                                  [edges[i] for i in pack], inference_method,
+                                  **kwargs)
+        for i, y in zip(pack, labels):
+            if return_energy:
+                y = y, compute_energy(unary_potentials[i],
+                                      pairwise_potentials[i], edges[i], y)
+            results[i] = y
+    return results
+
+
+def _packed_dispatch(unary_potentials, pairwise_potentials, edges,
+                     inference_method, **kwargs):
+    # solve the problems as connected components of a single graph
+    n_nodes = [len(unary) for unary in unary_potentials]
+    node_splits = np.cumsum(n_nodes)[:-1]
+
+    unaries = np.vstack(unary_potentials)
+    all_edges = np.vstack([e + offset for e, offset in
+                           zip(edges, np.hstack([0, node_splits]))])
+    first = pairwise_potentials[0]
+    if all(pairwise.shape == first.shape and first.ndim == 2
+           and np.all(pairwise == first)
+           for pairwise in pairwise_potentials):
+        # the same matrix for all edges in all problems
+        pairwise = first
+    else:
+        pairwise = np.concatenate([
+            _validate_params(unary, pairwise, e)[1] for unary, pairwise, e
+            in zip(unary_potentials, pairwise_potentials, edges)])
+
+    y = inference_dispatch(unaries, pairwise, all_edges, inference_method,
+                           **kwargs)
+    return np.split(y, node_splits)
 
 
 def _validate_params(unary_potentials, pairwise_params, edges):
     n_states = unary_potentials.shape[-1]
     if pairwise_params.shape == (n_states, n_states):
-        # only one matrix given
-        pairwise_potentials = np.repeat(pairwise_params[np.newaxis, :, :],
-                                        edges.shape[0], axis=0)
+        # only one matrix given, share it between all edges without copying.
+        # writing to one edge would write to all of them, so the view is
+        # read-only.
+        pairwise_potentials = as_strided(
+            pairwise_params, shape=(edges.shape[0], n_states, n_states),
+            strides=(0,) + pairwise_params.strides)
+        pairwise_potentials.flags.writeable = False
     else:
         if pairwise_params.shape != (edges.shape[0], n_states, n_states):
             raise ValueError("Expected pairwise_params either to "
@@ -145,6 +318,35 @@ def _validate_params(unary_potentials, pairwise_params, edges):
     return n_states, pairwise_potentials
 
 
+def _best_of(unary_potentials, pairwise_potentials, edges, y, init):
+    """Replace y by init on the connected components where init is better.
+
+    Message passing on graphs with cycles can end up with a worse labeling
+    than the one it was started from. Comparing per component keeps the
+    better labeling of each independent part of the graph.
+    """
+    if init is None:
+        return y
+    init = np.asarray(init).reshape(y.shape)
+    n_nodes = len(unary_potentials)
+    graph = sparse.coo_matrix((np.ones(len(edges)), edges.T),
+                              shape=(n_nodes, n_nodes))
+    n_components, component = connected_components(graph, directed=False)
+    n_states, pairwise_potentials = \
+        _validate_params(unary_potentials, pairwise_potentials, edges)
+    energies = []
+    for labels in [y, init]:
+        unary_energy = unary_potentials[np.arange(n_nodes), labels]
+        pairwise_energy = pairwise_potentials[np.arange(len(edges)),
+                                              labels[edges[:, 0]],
+                                              labels[edges[:, 1]]]
+        energies.append(
+            np.bincount(component, unary_energy, minlength=n_components)
+            + np.bincount(component[edges[:, 0]], pairwise_energy,
+                          minlength=n_components))
+    return np.where((energies[1] > energies[0])[component], init, y)
+
+
 def inference_ogm(unary_potentials, pairwise_potentials, edges,
                   return_energy=False, alg='dd', init=None,
                   reserveNumFactorsPerVariable=2, **kwargs):
@@ -401,7 +603,8 @@ def inference_lp(unary_potentials, pairwise_potentials, edges, relaxed=False,
 
 
 def inference_ad3(unary_potentials, pairwise_potentials, edges, relaxed=False,
-                  verbose=0, return_energy=False, branch_and_bound=False):
+                  verbose=0, return_energy=False, branch_and_bound=False,
+                  **kwargs):
     """Inference with AD3 dual decomposition subgradient solver.
 
     Parameters
@@ -442,6 +645,9 @@ def inference_ad3(unary_potentials, pairwise_potentials, edges, relaxed=False,
         _validate_params(unary_potentials, pairwise_potentials, edges)
 
     unaries = unary_potentials.reshape(-1, n_states)
+    # a shared pairwise matrix is a read-only zero-stride view, give ad3
+    # a contiguous copy instead of relying on how it handles strides
+    pairwise_potentials = np.ascontiguousarray(pairwise_potentials)
     res = ad3.general_graph(unaries, edges, pairwise_potentials, verbose=1,
                             n_iterations=4000, exact=branch_and_bound)
     unary_marginals, pairwise_marginals, energy, solver_status = res
@@ -458,6 +664,94 @@ def inference_ad3(unary_potentials, pairwise_potentials, edges, relaxed=False,
     return y
 
 
+def inference_max_product(unary_potentials, pairwise_potentials, edges,
+                          return_energy=False, fallback=None, alg='trw',
+                          max_iter=30, damping=0.5, tol=1e-5, init=None,
+                          **kwargs):
+    """Max-product inference.
+
+    Build-in message passing that does not need any external solver.
+    Chains with edges ``(i, i + 1)`` in order, as produced by ``ChainCRF``,
+    use Viterbi decoding, other trees and forests use message passing from
+    the leaves to the roots. Both are exact. On graphs with cycles, TRW-S or
+    loopy belief propagation is used, unless a ``fallback`` is given.
+
+    Parameters
+    ----------
+    unary_potentials : nd-array
+        Unary potentials of energy function.
+
+    pairwise_potentials : nd-array
+        Pairwise potentials of energy function.
+
+    edges : nd-array
+        Edges of energy function.
+
+    return_energy : bool (default=False)
+        Additionally return the energy of the returned solution, as given by
+        ``compute_energy``. If ``fallback`` is used, the energy is the one
+        returned by the fallback.
+
+    fallback : string, tuple or None (default=None)
+        Inference method to use if the graph contains a cycle, anything that
+        is accepted by ``inference_dispatch``. Additional keyword arguments,
+        like ``relaxed``, are passed on. None means using ``alg``.
+
+    alg : string (default='trw')
+        Message passing on graphs with cycles.
+        'trw' for sequential tree-reweighted message passing (TRW-S),
+        'bp' for damped loopy belief propagation.
+
+    max_iter : int (default=30)
+        Maximum number of passes over all messages, if the graph has cycles.
+
+    damping : float (default=0.5)
+        Weight of the old message in loopy belief propagation.
+
+    tol : float (default=1e-5)
+        Convergence tolerance for the change of messages.
+
+    init : nd-array or None (default=None)
+        Initial labeling, for example from a previous call. On graphs with
+        cycles, message passing starts from the messages sent by the
+        vertices fixed to their label in init, and init is returned on the
+        connected components where message passing does not find a labeling
+        with higher energy. Passed on to ``fallback``. Not used on trees.
+
+    Returns
+    -------
+    labels : nd-array
+        Approximate (exact for trees) MAP variable assignment.
+    """
+    shape_org = unary_potentials.shape[:-1]
+    n_states, pairwise_potentials = \
+        _validate_params(unary_potentials, pairwise_potentials, edges)
+    if len(edges) and pairwise_potentials.strides[0] == 0:
+        # the message passing code handles a shared matrix directly
+        pairwise_potentials = pairwise_potentials[0]
+    unaries = unary_potentials.reshape(-1, n_states)
+    n_vertices = unaries.shape[0]
+    if is_chain(edges, n_vertices):
+        y = chain_viterbi(unaries, pairwise_potentials)
+    elif is_forest(edges, n_vertices):
+        y = tree_max_product(unaries, pairwise_potentials, edges)
+    elif fallback is not None:
+        return inference_dispatch(unary_potentials, pairwise_potentials,
+                                  edges, fallback,
+                                  return_energy=return_energy, init=init,
+                                  **kwargs)
+    else:
+        y = iterative_max_product(unaries, pairwise_potentials, edges,
+                                  alg=alg, max_iter=max_iter,
+                                  damping=damping, tol=tol, init=init)
+        y = _best_of(unaries, pairwise_potentials, edges, y, init)
+    if return_energy:
+        return y.reshape(shape_org), compute_energy(unaries,
+                                                    pairwise_potentials,
+                                                    edges, y)
+    return y.reshape(shape_org)
+
+
 def inference_unaries(unary_potentials, pairwise_potentials, edges, verbose=0,
                       **kwargs):
     """Inference that only uses unary potentials.
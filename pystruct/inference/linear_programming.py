@@ -1,21 +1,19 @@
+from collections import OrderedDict
+from hashlib import sha1
+
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import cvxopt
 import cvxopt.solvers
 
 
-def lp_general_graph(unaries, edges, edge_weights):
-    if unaries.shape[1] != edge_weights.shape[1]:
-        raise ValueError("incompatible shapes of unaries"
-                         " and edge_weights.")
-    if edge_weights.shape[1] != edge_weights.shape[2]:
-        raise ValueError("Edge weights not square!")
-    if edge_weights.shape[0] != edges.shape[0]:
-        raise ValueError("Number of edge weights different from number of"
-                         "edges")
+# constraint matrices of recently seen graphs, in least recently used order
+_constraint_cache = OrderedDict()
+_constraint_cache_size = 128
 
-    n_nodes, n_states = unaries.shape
-    n_edges = len(edges)
 
+def _build_constraints(edges, n_nodes, n_states):
+    n_edges = len(edges)
     # variables: n_nodes * n_states for nodes,
     # n_edges * n_states ** 2 for edges
     n_variables = n_nodes * n_states + n_edges * n_states ** 2
@@ -26,64 +24,83 @@ def lp_general_graph(unaries, edges, edge_weights):
 
     # offset to get to the edge variables in columns
     edges_offset = n_nodes * n_states
-    # store constraints as triple (data, I, J)
-    data, I, J = [], [], []
 
     # summation constraints
-    for i in xrange(n_nodes):
-        for j in xrange(n_states):
-            data.append(1)
-            I.append(i)
-            J.append(i * n_states + j)
-            #constraints[i, i * n_states + j] = 1
-    # we row_idx tracks constraints = rows in constraint matrix
-    row_idx = n_nodes
-    # edge marginalization constraint
-    for i in xrange(2 * n_edges * n_states):
-        edge = i // (2 * n_states)
-        state = (i % n_states)
-        vertex_in_edge = i % (2 * n_states) // n_states
-        vertex = edges[edge][vertex_in_edge]
-        if vertex_in_edge == 1 and state == n_states - 1:
-            # the last summation constraint is redundant.
-            continue
-        # for one vertex iterate over all states of the other vertex
-        #[row_idx, int(vertex) * n_states + state] = -1
-        data.append(-1)
-        I.append(row_idx)
-        J.append(int(vertex) * n_states + state)
-        edge_var_index = edges_offset + edge * n_states ** 2
-        if vertex_in_edge == 0:
-            # first vertex in edge
-            for j in xrange(n_states):
-                data.append(1)
-                I.append(row_idx)
-                J.append(edge_var_index + state * n_states + j)
-                #[row_idx, edge_var_index + state * n_states + j] = 1
-        else:
-            # second vertex in edge
-            for j in xrange(n_states):
-                data.append(1)
-                I.append(row_idx)
-                J.append(edge_var_index + j * n_states + state)
-                #[row_idx, edge_var_index + j * n_states + state] = 1
-        row_idx += 1
+    I_sum = np.repeat(np.arange(n_nodes), n_states)
+    J_sum = np.arange(n_nodes * n_states)
+
+    # edge marginalization constraints: one per state of the first vertex
+    # in the edge, one per state of the second vertex, apart from the last,
+    # which is redundant.
+    n_rows = 2 * n_states - 1
+    rows = n_nodes + np.arange(n_edges * n_rows)
+    edge = np.repeat(np.arange(n_edges), n_rows)
+    vertex_in_edge = np.tile(np.repeat([0, 1], [n_states, n_states - 1]),
+                             n_edges)
+    state = np.tile(np.hstack([np.arange(n_states),
+                               np.arange(n_states - 1)]), n_edges)
+    vertex = np.asarray(edges, dtype=np.int64)[edge, vertex_in_edge]
+    # the vertex marginal
+    J_vertex = vertex * n_states + state
+    # sum over all states of the other vertex
+    j = np.arange(n_states)
+    J_edge = np.where(vertex_in_edge[:, np.newaxis] == 0,
+                      state[:, np.newaxis] * n_states + j,
+                      j * n_states + state[:, np.newaxis])
+    J_edge += (edges_offset + edge * n_states ** 2)[:, np.newaxis]
+
+    data = np.hstack([np.ones(n_nodes * n_states), -np.ones(len(rows)),
+                      np.ones(J_edge.size)])
+    I = np.hstack([I_sum, rows, np.repeat(rows, n_states)])
+    J = np.hstack([J_sum, J_vertex, J_edge.ravel()])
+
+    # unary and pairwise summation constratints
+    A = cvxopt.spmatrix(data.tolist(), I.tolist(), J.tolist(),
+                        (n_constraints, n_variables))
+    b_ = np.zeros(n_constraints)  # zeros for pairwise summation constraints
+    b_[:n_nodes] = 1    # ones for unary summation constraints
+    b = cvxopt.matrix(b_)
+    # for positivity inequalities
+    G = cvxopt.spdiag(cvxopt.matrix(-np.ones(n_variables)))
+    h = cvxopt.matrix(np.zeros(n_variables))  # for positivity inequalities
+    return A, b, G, h
+
+
+def _get_constraints(edges, n_nodes, n_states):
+    # the constraints only depend on the graph, so they are cached
+    # for graphs that are solved repeatedly, for example during learning.
+    edges = np.ascontiguousarray(edges)
+    key = (sha1(edges).hexdigest(), edges.shape, edges.dtype.str, n_nodes,
+           n_states)
+    try:
+        constraints = _constraint_cache.pop(key)
+    except KeyError:
+        constraints = _build_constraints(edges, n_nodes, n_states)
+        if len(_constraint_cache) >= _constraint_cache_size:
+            _constraint_cache.popitem(last=False)
+    _constraint_cache[key] = constraints
+    return constraints
+
+
+def lp_general_graph(unaries, edges, edge_weights):
+    if unaries.shape[1] != edge_weights.shape[1]:
+        raise ValueError("incompatible shapes of unaries"
+                         " and edge_weights.")
+    if edge_weights.shape[1] != edge_weights.shape[2]:
+        raise ValueError("Edge weights not square!")
+    if edge_weights.shape[0] != edges.shape[0]:
+        raise ValueError("Number of edge weights different from number of"
+                         "edges")
+
+    n_nodes, n_states = unaries.shape
+    n_edges = len(edges)
+    A, b, G, h = _get_constraints(edges, n_nodes, n_states)
 
     coef = np.ravel(unaries)
     # pairwise:
     repeated_pairwise = edge_weights.ravel()
     coef = np.hstack([coef, repeated_pairwise])
     c = cvxopt.matrix(coef, tc='d')
-    # for positivity inequalities
-    G = cvxopt.spdiag(cvxopt.matrix(-np.ones(n_variables)))
-    #G = cvxopt.matrix(-np.eye(n_variables))
-    h = cvxopt.matrix(np.zeros(n_variables))  # for positivity inequalities
-    # unary and pairwise summation constratints
-    A = cvxopt.spmatrix(data, I, J)
-    assert(n_constraints == A.size[0])
-    b_ = np.zeros(A.size[0])  # zeros for pairwise summation constraints
-    b_[:n_nodes] = 1    # ones for unary summation constraints
-    b = cvxopt.matrix(b_)
 
     # don't be verbose.
     show_progress_backup = cvxopt.solvers.options.get('show_progress', False)
@@ -105,7 +122,9 @@ def solve_lp(unaries, edges, pairwise):
                          " and pairwise potentials.")
 
     n_edges = len(edges)
-    edge_weights = np.repeat(pairwise[np.newaxis, :, :], n_edges, axis=0)
+    # share the matrix between all edges without copying
+    edge_weights = as_strided(pairwise, shape=(n_edges,) + pairwise.shape,
+                              strides=(0,) + pairwise.strides)
     return lp_general_graph(unaries, edges, edge_weights)
 
 
@@ -0,0 +1,354 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, shortest_path
+
+
+def is_chain(edges, n_vertices):
+    """Check if edges specify a chain and are in order."""
+    return (edges.shape[0] == n_vertices - 1
+            and np.all(edges[:, 0] == np.arange(0, n_vertices - 1))
+            and np.all(edges[:, 1] == np.arange(1, n_vertices)))
+
+
+def is_forest(edges, n_vertices):
+    """Check if edges specify a forest (an acyclic, undirected graph)."""
+    if n_vertices == 0:
+        return True
+    if np.any(edges[:, 0] == edges[:, 1]):
+        # self loops
+        return False
+    n_edges = edges.shape[0]
+    if n_edges > n_vertices - 1:
+        return False
+    graph = sparse.coo_matrix((np.ones(n_edges), edges.T),
+                              shape=(n_vertices, n_vertices))
+    n_components, _ = connected_components(graph, directed=False)
+    # a graph is a forest iff each component is a tree,
+    # duplicate edges are caught as they don't reduce the number of components
+    return n_edges == n_vertices - n_components
+
+
+def chain_viterbi(unary_potentials, pairwise_potentials):
+    """Exact max-product (Viterbi) decoding on an ordered chain.
+
+    Node ``i`` is connected to node ``i + 1``, as checked by ``is_chain``.
+    Runs in O(n_vertices * n_states ** 2).
+
+    Parameters
+    ----------
+    unary_potentials : nd-array, shape (n_vertices, n_states)
+        Unary potentials of energy function.
+
+    pairwise_potentials : nd-array
+        Either a single matrix of shape (n_states, n_states) shared by all
+        edges, or one matrix per edge, shape (n_vertices - 1, n_states,
+        n_states).
+
+    Returns
+    -------
+    labels : nd-array, shape (n_vertices,)
+        MAP variable assignment.
+    """
+    n_vertices, n_states = unary_potentials.shape
+    shared = pairwise_potentials.ndim == 2
+    states = np.arange(n_states)
+    backpointers = np.empty((n_vertices, n_states), dtype=np.intp)
+
+    # forward pass: best score of all chains ending in each state
+    score = unary_potentials[0]
+    for i in xrange(1, n_vertices):
+        pairwise = pairwise_potentials if shared else pairwise_potentials[i - 1]
+        candidates = score[:, np.newaxis] + pairwise
+        backpointers[i] = np.argmax(candidates, axis=0)
+        score = candidates[backpointers[i], states] + unary_potentials[i]
+
+    # backward pass: follow the pointers from the best final state
+    labels = np.empty(n_vertices, dtype=np.int)
+    labels[-1] = np.argmax(score)
+    for i in xrange(n_vertices - 1, 0, -1):
+        labels[i - 1] = backpointers[i, labels[i]]
+    return labels
+
+
+def tree_max_product(unary_potentials, pairwise_potentials, edges):
+    """Exact max-product message passing on a tree or forest.
+
+    Messages are sent from the leaves to the roots and the MAP assignment is
+    recovered on the way back. All nodes at the same depth are processed at
+    once, so there are as many vectorized steps as the forest is deep.
+
+    Parameters
+    ----------
+    unary_potentials : nd-array, shape (n_vertices, n_states)
+        Unary potentials of energy function.
+
+    pairwise_potentials : nd-array
+        Either a single matrix of shape (n_states, n_states) shared by all
+        edges, or one matrix per edge, shape (n_edges, n_states, n_states).
+
+    edges : nd-array, shape (n_edges, 2)
+        Edges of an acyclic graph, as checked by ``is_forest``.
+
+    Returns
+    -------
+    labels : nd-array, shape (n_vertices,)
+        MAP variable assignment.
+    """
+    n_vertices, n_states = unary_potentials.shape
+    n_edges = edges.shape[0]
+    edges = edges.astype(np.intp)
+    # add a virtual root connected to the first node of every component,
+    # so all trees are traversed in one breadth first search
+    _, component = connected_components(
+        sparse.coo_matrix((np.ones(n_edges), edges.T),
+                          shape=(n_vertices, n_vertices)), directed=False)
+    _, roots = np.unique(component, return_index=True)
+    root_edges = np.c_[np.repeat(n_vertices, len(roots)), roots]
+    all_edges = np.vstack([edges, root_edges])
+    graph = sparse.coo_matrix((np.ones(len(all_edges)), all_edges.T),
+                              shape=(n_vertices + 1, n_vertices + 1)).tocsr()
+    depth, parent = shortest_path(graph, directed=False, unweighted=True,
+                                  indices=n_vertices,
+                                  return_predecessors=True)
+    depth = depth[:n_vertices].astype(np.intp)
+    parent = parent[:n_vertices]
+
+    # orient every edge from parent to child:
+    # pairwise_potentials[e][parent_state, child_state]
+    flip = depth[edges[:, 0]] > depth[edges[:, 1]]
+    child = np.where(flip, edges[:, 0], edges[:, 1])
+    edge_of_node = np.empty(n_vertices, dtype=np.intp)
+    edge_of_node[child] = np.arange(n_edges)
+
+    def oriented_pairwise(nodes):
+        edge_inds = edge_of_node[nodes]
+        if pairwise_potentials.ndim == 2:
+            pairwise = np.repeat(pairwise_potentials[np.newaxis], len(nodes),
+                                 axis=0)
+        else:
+            pairwise = pairwise_potentials[edge_inds]
+        transpose = flip[edge_inds]
+        pairwise[transpose] = pairwise[transpose].transpose(0, 2, 1)
+        return pairwise
+
+    # group nodes by depth, roots of the trees have depth one
+    by_depth = np.argsort(depth, kind='mergesort')
+    boundaries = np.searchsorted(depth[by_depth],
+                                 np.arange(2, depth.max() + 1))
+    levels = np.split(by_depth, boundaries)
+
+    beliefs = np.array(unary_potentials, dtype=np.float)
+    backpointers = np.empty((n_vertices, n_states), dtype=np.intp)
+    # upward pass: children send messages to their parents
+    for nodes in levels[:0:-1]:
+        candidates = (oriented_pairwise(nodes)
+                      + beliefs[nodes][:, np.newaxis, :])
+        backpointers[nodes] = np.argmax(candidates, axis=2)
+        messages = np.max(candidates, axis=2)
+        np.add.at(beliefs, parent[nodes], messages)
+
+    # downward pass: roots pick their best state, children follow
+    labels = np.empty(n_vertices, dtype=np.int)
+    labels[levels[0]] = np.argmax(beliefs[levels[0]], axis=1)
+    for nodes in levels[1:]:
+        labels[nodes] = backpointers[nodes, labels[parent[nodes]]]
+    return labels
+
+
+def color_graph(edges, n_vertices, random_state=0):
+    """Color the vertices so that no edge connects two vertices of one color.
+
+    Each round takes the uncolored vertices with a larger random priority
+    than all of their uncolored neighbors, which form an independent set.
+
+    Returns
+    -------
+    colors : nd-array, shape (n_vertices,)
+        Color of each vertex, in range(n_colors).
+    """
+    rng = np.random.RandomState(random_state)
+    priority = rng.permutation(n_vertices)
+    colors = -np.ones(n_vertices, dtype=np.intp)
+    # consider both directions of every edge
+    source = np.hstack([edges[:, 0], edges[:, 1]])
+    target = np.hstack([edges[:, 1], edges[:, 0]])
+    color = 0
+    while np.any(colors < 0):
+        uncolored = colors < 0
+        active = uncolored[source] & uncolored[target]
+        max_neighbor = -np.ones(n_vertices, dtype=np.intp)
+        np.maximum.at(max_neighbor, target[active], priority[source[active]])
+        colors[uncolored & (priority > max_neighbor)] = color
+        color += 1
+    return colors
+
+
+class _MessageGraph(object):
+    """Bookkeeping for messages in both directions of every edge.
+
+    Message ``d < n_edges`` is sent along ``edges[d]``, message
+    ``d + n_edges`` in the opposite direction. All messages are stored in
+    one array of shape (2 * n_edges, n_states).
+    """
+    def __init__(self, unary_potentials, pairwise_potentials, edges):
+        self.n_vertices, self.n_states = unary_potentials.shape
+        self.n_edges = edges.shape[0]
+        self.unary_potentials = unary_potentials
+        self.pairwise_potentials = pairwise_potentials
+        self.source = np.hstack([edges[:, 0], edges[:, 1]]).astype(np.intp)
+        self.target = np.hstack([edges[:, 1], edges[:, 0]]).astype(np.intp)
+        n_messages = 2 * self.n_edges
+        self.reverse = np.hstack([np.arange(self.n_edges, n_messages),
+                                  np.arange(self.n_edges)])
+        # sums up incoming messages per vertex
+        self.incoming = sparse.csr_matrix(
+            (np.ones(n_messages), (self.target, np.arange(n_messages))),
+            shape=(self.n_vertices, n_messages))
+
+    def beliefs(self, messages, vertices=None):
+        if vertices is None:
+            return self.unary_potentials + self.incoming * messages
+        return (self.unary_potentials[vertices]
+                + self.incoming[vertices] * messages)
+
+    def pairwise(self, inds):
+        """Pairwise potentials of messages inds, as [source, target]."""
+        forward = inds < self.n_edges
+        edge_inds = np.where(forward, inds, inds - self.n_edges)
+        if self.pairwise_potentials.ndim == 2:
+            return np.where(forward[:, np.newaxis, np.newaxis],
+                            self.pairwise_potentials,
+                            self.pairwise_potentials.T)
+        pairwise = self.pairwise_potentials[edge_inds]
+        backward = ~forward
+        pairwise[backward] = pairwise[backward].transpose(0, 2, 1)
+        return pairwise
+
+    def send(self, inds, evidence):
+        """Compute messages inds given evidence at the source vertex."""
+        messages = np.max(self.pairwise(inds) + evidence[:, :, np.newaxis],
+                          axis=1)
+        # normalize to keep messages bounded
+        return messages - np.max(messages, axis=1)[:, np.newaxis]
+
+    def decode(self, messages, colors):
+        """Decode labels one color at a time, conditioning on earlier ones."""
+        labels = -np.ones(self.n_vertices, dtype=np.int)
+        for color in xrange(colors.max() + 1):
+            vertices = np.where(colors == color)[0]
+            scores = self.beliefs(messages, vertices)
+            # replace messages from labeled neighbors by their actual
+            # pairwise contribution
+            inds = np.where((colors[self.target] == color)
+                            & (labels[self.source] >= 0))[0]
+            if len(inds):
+                position = np.searchsorted(vertices, self.target[inds])
+                np.subtract.at(scores, position, messages[inds])
+                contribution = self.pairwise(inds)[
+                    np.arange(len(inds)), labels[self.source[inds]]]
+                np.add.at(scores, position, contribution)
+            labels[vertices] = np.argmax(scores, axis=1)
+        return labels
+
+
+def iterative_max_product(unary_potentials, pairwise_potentials, edges,
+                          alg='trw', max_iter=30, damping=0.5, tol=1e-5,
+                          init=None):
+    """Approximate max-product message passing on graphs with cycles.
+
+    Parameters
+    ----------
+    unary_potentials : nd-array, shape (n_vertices, n_states)
+        Unary potentials of energy function.
+
+    pairwise_potentials : nd-array
+        Either a single matrix of shape (n_states, n_states) shared by all
+        edges, or one matrix per edge, shape (n_edges, n_states, n_states).
+
+    edges : nd-array, shape (n_edges, 2)
+        Edges of energy function.
+
+    alg : string, default='trw'
+        Schedule of message updates. Possible choices are:
+
+            * 'bp' for loopy belief propagation, all messages are updated
+              at once and damped.
+            * 'trw' for sequential tree-reweighted message passing (TRW-S).
+              Vertices are visited in forward and backward order, vertices
+              of one color are updated at the same time.
+
+    max_iter : int, default=30
+        Maximum number of passes over all messages.
+
+    damping : float, default=0.5
+        Weight of the old message in loopy belief propagation.
+        Not used for 'trw'.
+
+    tol : float, default=1e-5
+        Stop if no message changed more than tol in a pass.
+
+    init : nd-array, shape (n_vertices,) or None (default=None)
+        Labeling to warm-start from. The messages are initialized to the
+        ones sent by vertices fixed to their label in init, instead of zero.
+
+    Returns
+    -------
+    labels : nd-array, shape (n_vertices,)
+        Approximate MAP variable assignment.
+    """
+    if alg not in ['bp', 'trw']:
+        raise ValueError("alg must be 'bp' or 'trw', got %s" % alg)
+    graph = _MessageGraph(unary_potentials, pairwise_potentials, edges)
+    colors = color_graph(edges, graph.n_vertices)
+    all_messages = np.arange(2 * graph.n_edges)
+    if init is None:
+        messages = np.zeros((2 * graph.n_edges, graph.n_states))
+    else:
+        source_labels = np.asarray(init).ravel()[graph.source]
+        messages = graph.pairwise(all_messages)[all_messages, source_labels]
+        messages -= np.max(messages, axis=1)[:, np.newaxis]
+
+    if alg == 'trw':
+        # position in the order is given by color, messages to later colors
+        # are updated in the forward pass, to earlier ones in the backward
+        # pass.
+        forward = colors[graph.source] < colors[graph.target]
+        n_forward = np.bincount(graph.source[forward],
+                                minlength=graph.n_vertices)
+        n_backward = np.bincount(graph.source[~forward],
+                                 minlength=graph.n_vertices)
+        # edge appearance probabilities from monotonic chains
+        gamma = 1. / np.maximum(np.maximum(n_forward, n_backward), 1)
+        n_colors = colors.max() + 1
+        schedule = []
+        for direction, order in [(forward, xrange(n_colors)),
+                                 (~forward, reversed(xrange(n_colors)))]:
+            for color in order:
+                vertices = np.where(colors == color)[0]
+                inds = np.where(direction & (colors[graph.source]
+                                             == color))[0]
+                if len(inds):
+                    position = np.searchsorted(vertices, graph.source[inds])
+                    schedule.append((vertices, inds, position))
+
+    for iteration in xrange(max_iter):
+        if alg == 'bp':
+            beliefs = graph.beliefs(messages)
+            evidence = beliefs[graph.source] - messages[graph.reverse]
+            new_messages = graph.send(all_messages, evidence)
+            change = np.max(np.abs(new_messages - messages))
+            messages = damping * messages + (1 - damping) * new_messages
+        else:
+            change = 0
+            for vertices, inds, position in schedule:
+                beliefs = graph.beliefs(messages, vertices)
+                evidence = (gamma[graph.source[inds]][:, np.newaxis]
+                            * beliefs[position]
+                            - messages[graph.reverse[inds]])
+                new_messages = graph.send(inds, evidence)
+                change = max(change,
+                             np.max(np.abs(new_messages - messages[inds])))
+                messages[inds] = new_messages
+        if change < tol:
+            break
+    return graph.decode(messages, colors)
@@ -8,13 +8,52 @@
 # Implements structured SVM as described in Joachims et. al.
 # Cutting-Plane Training of Structural SVMs
 
-import warnings
+from tempfile import TemporaryFile
 from time import time
 import numpy as np
 from sklearn.utils import check_random_state
 
-from pystruct.learners.ssvm import BaseSSVM
-from pystruct.utils import find_constraint
+from pystruct.learners.ssvm import BaseSSVM, stops_pool
+from pystruct.utils import find_constraint, loss_augmented_inference
+from pystruct.utils.constraints import InferenceCache
+
+
+class _SparseRows(object):
+    """Matrix stored as indices and values of the non-zeros of each row.
+
+    Supports getting and setting whole rows, as dense arrays.
+    """
+    def __init__(self, n_rows, n_cols):
+        self.shape = (n_rows, n_cols)
+        self._indices = [np.zeros(0, dtype=np.int32) for i in xrange(n_rows)]
+        self._values = [np.zeros(0) for i in xrange(n_rows)]
+
+    def __getitem__(self, i):
+        row = np.zeros(self.shape[1])
+        row[self._indices[i]] = self._values[i]
+        return row
+
+    def __setitem__(self, i, row):
+        indices = np.flatnonzero(row)
+        self._indices[i] = indices.astype(np.int32)
+        self._values[i] = row[indices]
+
+
+def _block_storage(storage, n_samples, size_psi):
+    """Allocate the matrix holding the weights of each block."""
+    shape = (n_samples, size_psi)
+    if storage == 'dense':
+        return np.zeros(shape)
+    elif storage == 'float32':
+        return np.zeros(shape, dtype=np.float32)
+    elif storage == 'sparse':
+        return _SparseRows(n_samples, size_psi)
+    elif storage == 'memmap':
+        # the temporary file is removed when the memmap is garbage collected
+        return np.memmap(TemporaryFile(), dtype=np.float, mode='w+',
+                         shape=shape)
+    raise ValueError("block_storage should be 'dense', 'float32', 'sparse'"
+                     " or 'memmap', got %s." % str(storage))
 
 
 class FrankWolfeSSVM(BaseSSVM):
@@ -49,7 +88,10 @@ class FrankWolfeSSVM(BaseSSVM):
         Verbosity.
 
     n_jobs : int, default=1
-        Number of parallel processes. Currently only n_jobs=1 is supported.
+        Number of parallel processes for inference. -1 means as many as cpus.
+        In the block-coordinate version, the workers run inference for the
+        next samples while the updates for the previous ones are applied,
+        so inference uses slightly outdated parameters.
 
     show_loss_every : int, default=0
         How often the training set loss should be computed.
@@ -73,18 +115,63 @@ class FrankWolfeSSVM(BaseSSVM):
     check_dual_every : int, default=10
         How often the stopping criterion should be checked. Computing
         the stopping criterion is as costly as doing one pass over the dataset,
-        so check_dual_every=1 will make learning twice as slow.
+        so check_dual_every=1 will make learning twice as slow, unless
+        ``monitoring='estimate'`` is used.
+
+    monitoring : string, default='full'
+        How the duality gap is computed when checking the stopping criterion
+        in the block-coordinate version. 'full' runs inference on all
+        samples with the current parameters. 'estimate' computes the gap at
+        the current parameters from the labelings found by the last
+        inference run of each sample, which needs no inference. It only
+        matches the exact gap of 'full' if all these labelings are still
+        the most violated ones at the current parameters, otherwise it is a
+        lower bound. Therefore the full pass is run to confirm the gap
+        before stopping. With 'estimate', the objective curves are
+        computed for the current iterate, not the averaged parameters. The
+        dual objective is exact, the primal objective is the dual objective
+        plus the gap estimate.
 
     do_averaging : bool, default=True
         Whether to use weight averaging as described in the reference paper.
         Currently this is only supported in the block-coordinate version.
 
+    sample_method : string, default='perm'
+        Order in which the block-coordinate version visits the samples in
+        each pass. 'perm' uses a random permutation, 'rnd' draws samples
+        uniformly at random with replacement and 'seq' goes through the
+        samples in order. 'gap' draws samples with probability proportional
+        to their block gap, as estimated in the last inference run for the
+        sample. The estimates are refreshed by a pass over a random
+        permutation in the first iteration and whenever the duality gap is
+        checked, see ``check_dual_every``.
+
     random_state : int, RandomState instance or None, optional (default=None)
         If int, random_state is the seed used by the random number generator;
         If RandomState instance, random_state is the random number generator;
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    inference_cache : int, default=0
+        How many results of loss_augmented_inference to cache per sample.
+        If > 0, the most violating of the cached results of a sample is
+        tried before running inference, and inference is only run if its
+        block gap is too small, see ``cache_factor``. Only supported in the
+        block-coordinate version with n_jobs=1.
+
+    cache_factor : float, default=0.25
+        A cached result is used if its block gap is at least cache_factor
+        times the block gap of the sample at the last inference run.
+        Higher values lead to more calls to inference.
+
+
+    block_storage : string, default='dense'
+        How the block-coordinate version stores the weight vector of each
+        sample, which needs n_samples * size_psi numbers. 'dense' uses a
+        dense matrix of doubles, 'float32' a dense matrix of singles, which
+        halves the memory. 'sparse' only stores the non-zero entries of
+        each sample, which saves memory if psi is sparse. 'memmap' keeps the
+        dense matrix in a temporary file on disk.
 
     Attributes
     ----------
@@ -102,18 +189,30 @@ class FrankWolfeSSVM(BaseSSVM):
 
     ``timestamps_`` : list of int
        Total training time stored before each iteration.
+
+    ``cache_hits_`` : list of int
+        Number of steps using a cached result since the previous entry.
+        In the block-coordinate version, there is one entry for each entry
+        of ``objective_curve_``.
+
+    ``cache_misses_`` : list of int
+        Number of steps running inference since the previous entry.
+        In the block-coordinate version, there is one entry for each entry
+        of ``objective_curve_``.
     """
     def __init__(self, model, max_iter=1000, C=1.0, verbose=0, n_jobs=1,
                  show_loss_every=0, logger=None, batch_mode=False,
                  line_search=True, check_dual_every=10, tol=.001,
-                 do_averaging=True, sample_method='perm', random_state=None):
+                 do_averaging=True, sample_method='perm', random_state=None,
+                 inference_cache=0, cache_factor=.25, block_storage='dense',
+                 monitoring='full'):
 
-        if n_jobs != 1:
-            warnings.warn("FrankWolfeSSVM does not support multiprocessing"
-                          " yet. Ignoring n_jobs != 1.")
+        if monitoring not in ['full', 'estimate']:
+            raise ValueError("monitoring can only be full or estimate")
 
-        if sample_method not in ['perm', 'rnd', 'seq']:
-            raise ValueError("sample_method can only be perm, rnd, or seq")
+        if sample_method not in ['perm', 'rnd', 'seq', 'gap']:
+            raise ValueError("sample_method can only be perm, rnd, seq or"
+                             " gap")
 
         BaseSSVM.__init__(self, model, max_iter, C, verbose=verbose,
                           n_jobs=n_jobs, show_loss_every=show_loss_every,
@@ -125,12 +224,20 @@ class FrankWolfeSSVM(BaseSSVM):
         self.do_averaging = do_averaging
         self.sample_method = sample_method
         self.random_state = random_state
+        self.inference_cache = inference_cache
+        self.cache_factor = cache_factor
+        self.block_storage = block_storage
+        self.monitoring = monitoring
 
     def _calc_dual_gap(self, X, Y):
         n_samples = len(X)
         psi_gt = self.model.batch_psi(X, Y, Y)  # FIXME don't calculate this again
-        Y_hat = self.model.batch_loss_augmented_inference(X, Y, self.w,
-                                                          relaxed=True)
+        if self._pool is not None:
+            Y_hat = self._pool.map(loss_augmented_inference, self.w,
+                                   relaxed=True)
+        else:
+            Y_hat = self.model.batch_loss_augmented_inference(X, Y, self.w,
+                                                              relaxed=True)
         dpsi = psi_gt - self.model.batch_psi(X, Y_hat)
         ls = np.sum(self.model.batch_loss(Y, Y_hat))
         ws = dpsi * self.C
@@ -155,8 +262,14 @@ class FrankWolfeSSVM(BaseSSVM):
         psi_gt = self.model.batch_psi(X, Y, Y)
 
         for iteration in xrange(self.max_iter):
-            Y_hat = self.model.batch_loss_augmented_inference(X, Y, self.w,
-                                                              relaxed=True)
+            if self._pool is not None:
+                Y_hat = self._pool.map(loss_augmented_inference, self.w,
+                                       init=self._y_hat_init, relaxed=True)
+            else:
+                Y_hat = self.model.batch_loss_augmented_inference(
+                    X, Y, self.w, relaxed=True, init=self._y_hat_init)
+            if self._use_y_hat_init:
+                self._y_hat_init = Y_hat
             dpsi = psi_gt - self.model.batch_psi(X, Y_hat)
             ls = np.mean(self.model.batch_loss(Y, Y_hat))
             ws = dpsi * self.C
@@ -200,10 +313,27 @@ class FrankWolfeSSVM(BaseSSVM):
         """
         n_samples = len(X)
         w = self.w.copy()
-        w_mat = np.zeros((n_samples, self.model.size_psi))
+        w_mat = _block_storage(self.block_storage, n_samples,
+                               self.model.size_psi)
         l_mat = np.zeros(n_samples)
         l = 0.0
         k = 0
+        cache = None
+        if self.inference_cache > 0 and self._pool is None:
+            # the cache scores np.dot(psi, w) + loss, which is the slack if
+            # we store -delta_psi as psi
+            cache = InferenceCache(n_samples, self.model.size_psi,
+                                   self.inference_cache, dtype=np.float)
+        # block gaps at the last inference run of each sample, used by the
+        # cache and for sample_method='gap'
+        block_gaps = np.zeros(n_samples)
+        if self.monitoring == 'estimate':
+            # sums of ws and ls of the last inference run of each sample, to
+            # compute the gap at the current parameters. Only the labelings
+            # are stored, ws and ls are recomputed when they are replaced.
+            y_hats = [None] * n_samples
+            ws_sum = np.zeros(self.model.size_psi)
+            ls_sum = 0.0
 
         rng = check_random_state(self.random_state)
         for iteration in xrange(self.max_iter):
@@ -215,26 +345,82 @@ class FrankWolfeSSVM(BaseSSVM):
                 rng.shuffle(perm)
             elif self.sample_method == 'rnd':
                 perm = rng.randint(low=0, high=n_samples, size=n_samples)
+            elif self.sample_method == 'gap':
+                gaps = np.maximum(block_gaps, 0)
+                refresh = (iteration == 0 or (self.check_dual_every != 0 and
+                           iteration % self.check_dual_every == 0))
+                if refresh or np.sum(gaps) == 0:
+                    # visit every sample to update the gap estimates
+                    rng.shuffle(perm)
+                else:
+                    perm = rng.choice(n_samples, size=n_samples,
+                                      p=gaps / np.sum(gaps))
+
+            if self._pool is not None:
+                # run inference in the workers, with a snapshot of the
+                # parameters at the time the sample is sent out, as w is
+                # updated in place
+                constraints = self._pool.imap(
+                    find_constraint, lambda: w.copy(), perm,
+                    init=[self._y_hat_init[i] for i in perm])
+            else:
+                constraints = ((i, None) for i in perm)
 
-            for j in range(n_samples):
-                i = perm[j]
+            for i, constraint in constraints:
                 x, y = X[i], Y[i]
-                y_hat, delta_psi, slack, loss = find_constraint(self.model, x, y, w)
+                # as double, as the storage might not be
+                w_block = np.asarray(w_mat[i], dtype=np.float)
+                cached = None
+                if cache is not None:
+                    cached = cache.most_violated_sample(i, w)
+                if cached is not None:
+                    delta_psi, loss = -cached[0], cached[1]
+                    w_diff = w_block - delta_psi * self.C
+                    gap = (w_diff.T.dot(w) - (self.C * n_samples)
+                           * (l_mat[i] - loss / n_samples))
+                    if gap <= max(self.cache_factor * block_gaps[i], 0):
+                        cached = None
+                if cached is not None:
+                    self.cache_hits_[-1] += 1
+                else:
+                    self.cache_misses_[-1] += 1
+                    if constraint is None:
+                        constraint = find_constraint(
+                            self.model, x, y, w, init=self._y_hat_init[i])
+                    y_hat, delta_psi, slack, loss = constraint
+                    self._set_y_hat_init(i, y_hat)
+                    if cache is not None:
+                        cache.add(i, -delta_psi, loss, y_hat, w)
                 # ws and ls
                 ws = delta_psi * self.C
                 ls = loss / n_samples
 
+                w_diff = w_block - ws
+                gap = (w_diff.T.dot(w) - (self.C * n_samples)
+                       * (l_mat[i] - ls))
+                if cached is None:
+                    block_gaps[i] = gap
+                    if self.monitoring == 'estimate':
+                        if y_hats[i] is not None:
+                            _, old_delta_psi, _, old_loss = find_constraint(
+                                self.model, x, y, w, y_hat=y_hats[i])
+                            ws_sum -= old_delta_psi * self.C
+                            ls_sum -= old_loss / n_samples
+                        y_hats[i] = y_hat
+                        ws_sum += ws
+                        ls_sum += ls
+
                 # line search
                 if self.line_search:
                     eps = 1e-15
-                    w_diff = w_mat[i] - ws
-                    gamma = (w_diff.T.dot(w) - (self.C * n_samples)*(l_mat[i] - ls)) / (np.sum(w_diff ** 2) + eps)
+                    gamma = gap / (np.sum(w_diff ** 2) + eps)
                     gamma = max(0.0, min(1.0, gamma))
                 else:
                     gamma = 2.0 * n_samples / (k + 2.0 * n_samples)
 
-                w -= w_mat[i]
-                w_mat[i] = (1.0 - gamma) * w_mat[i] + gamma * ws
+                w -= w_block
+                w_mat[i] = (1.0 - gamma) * w_block + gamma * ws
+                # add what was stored, so w stays the sum of the blocks
                 w += w_mat[i]
 
                 l -= l_mat[i]
@@ -251,13 +437,30 @@ class FrankWolfeSSVM(BaseSSVM):
                 k += 1
 
             if (self.check_dual_every != 0) and (iteration % self.check_dual_every == 0):
-                dual_val, dual_gap, primal_val = self._calc_dual_gap(X, Y)
+                if self.monitoring == 'estimate':
+                    # sum of the block gaps at the current parameters, for
+                    # the last labeling found for each sample
+                    dual_val = -0.5 * np.sum(w ** 2) + l * n_samples * self.C
+                    dual_gap = (np.dot(w - ws_sum, w)
+                                - self.C * n_samples * (l - ls_sum))
+                    primal_val = dual_val + dual_gap
+                    if dual_gap < self.tol:
+                        # better labelings might exist, check before stopping
+                        dual_val, dual_gap, primal_val = self._calc_dual_gap(
+                            X, Y)
+                else:
+                    dual_val, dual_gap, primal_val = self._calc_dual_gap(X, Y)
                 self.primal_objective_curve_.append(primal_val)
                 self.objective_curve_.append(dual_val)
                 self.timestamps_.append(time() - self.timestamps_[0])
                 if self.verbose > 0:
                     print("dual: %f, dual_gap: %f, primal: %f"
                           % (dual_val, dual_gap, primal_val))
+                if self.verbose > 0 and cache is not None:
+                    print("cache hits: %d, cache misses: %d"
+                          % (self.cache_hits_[-1], self.cache_misses_[-1]))
+                self.cache_hits_.append(0)
+                self.cache_misses_.append(0)
 
             if self.logger is not None:
                 self.logger(self, iteration)
@@ -265,6 +468,7 @@ class FrankWolfeSSVM(BaseSSVM):
             if dual_gap < self.tol:
                 return
 
+    @stops_pool
     def fit(self, X, Y, constraints=None, initialize=True):
         """Learn parameters using (block-coordinate) Frank-Wolfe learning.
 
@@ -288,8 +492,11 @@ class FrankWolfeSSVM(BaseSSVM):
             self.model.initialize(X, Y)
         self.objective_curve_, self.primal_objective_curve_ = [], []
         self.timestamps_ = [time()]
+        self.cache_hits_, self.cache_misses_ = [0], [0]
         self.w = getattr(self, "w", np.zeros(self.model.size_psi))
         self.l = getattr(self, "l", 0)
+        self._reset_y_hat_init(len(X), reset=False)
+        self._start_pool(X, Y)
         try:
             if self.batch_mode:
                 self._frank_wolfe_batch(X, Y)
@@ -301,6 +508,7 @@ class FrankWolfeSSVM(BaseSSVM):
             print("Calculating final objective.")
         self.timestamps_.append(time() - self.timestamps_[0])
         self.primal_objective_curve_.append(self._objective(X, Y))
+        self._stop_pool()
         self.objective_curve_.append(self.objective_curve_[-1])
         if self.logger is not None:
             self.logger(self, 'final')
@@ -6,9 +6,9 @@
 
 import numpy as np
 
-from .ssvm import BaseSSVM
+from .ssvm import BaseSSVM, stops_pool
 from .n_slack_ssvm import NSlackSSVM
-from ..utils import find_constraint
+from ..utils import find_constraint, latent
 
 
 class LatentSSVM(BaseSSVM):
@@ -29,6 +29,9 @@ class LatentSSVM(BaseSSVM):
     If the base_ssvm is a 1-slack SSVM, the inference cache will
     be reused. Both methods drastically speed up learning.
 
+    The latent variables are completed in parallel using ``n_jobs`` of the
+    base_ssvm.
+
     Parameters
     ----------
     base_ssvm : object
@@ -51,6 +54,7 @@ class LatentSSVM(BaseSSVM):
         self.latent_iter = latent_iter
         self.logger = logger
 
+    @stops_pool
     def fit(self, X, Y, H_init=None, initialize=True):
         """Learn parameters using the concave-convex procedure.
 
@@ -90,7 +94,15 @@ class LatentSSVM(BaseSSVM):
             if iteration == 0:
                 pass
             else:
-                H_new = [self.model.latent(x, y, w) for x, y in zip(X, Y)]
+                if self.n_jobs != 1:
+                    # the workers only live during the completion, the
+                    # base_ssvm starts its own ones in fit
+                    self._start_pool(X, Y)
+                    H_new = self._pool.map(latent, w)
+                    self._stop_pool()
+                else:
+                    H_new = [latent(self.model, x, y, w)
+                             for x, y in zip(X, Y)]
                 changes = [np.any(h_new != h) for h_new, h in zip(H_new, H)]
                 if not np.any(changes):
                     print("no changes in latent variables of ground truth."
@@ -100,14 +112,8 @@ class LatentSSVM(BaseSSVM):
 
                 # update constraints:
                 if isinstance(self.base_ssvm, NSlackSSVM):
-                    constraints = [[] for i in xrange(len(X))]
-                    for sample, h, i in zip(self.base_ssvm.constraints_, H_new,
-                                            np.arange(len(X))):
-                        for constraint in sample:
-                            const = find_constraint(self.model, X[i], h, w,
-                                                    constraint[0])
-                            y_hat, dpsi, _, loss = const
-                            constraints[i].append([y_hat, dpsi, loss])
+                    constraints = self._update_constraints(
+                        X, H, H_new, np.where(changes)[0], w)
                 H = H_new
             if iteration > 0:
                 self.base_ssvm.fit(X, H, constraints=constraints,
@@ -120,6 +126,36 @@ class LatentSSVM(BaseSSVM):
             if self.logger is not None:
                 self.logger(self, iteration)
 
+    def _update_constraints(self, X, H, H_new, changed, w):
+        # Adjust the constraints of the base_ssvm to the new ground truth.
+        # The labelings and their order stay the same, so that the
+        # base_ssvm can keep track of which ones are active.
+        constraints = self.base_ssvm.constraints_
+        model = self.model
+        for i in changed:
+            rows = constraints.rows(i)
+            if not len(rows):
+                continue
+            Y_hat = [constraints.y_hats[r] for r in rows]
+            if getattr(model, 'rescale_C', False):
+                # psi(x, y_hat) depends on the ground truth
+                new = [find_constraint(model, X[i], H_new[i], w, y_hat)
+                       for y_hat in Y_hat]
+                delta_psis = [c[1] for c in new]
+                losses = [c[3] for c in new]
+            else:
+                # only psi(x, h) changes, and it is shared by all
+                # constraints of the sample
+                delta_psis = (constraints.psis[rows]
+                              + model.psi(X[i], H_new[i])
+                              - model.psi(X[i], H[i]))
+                losses = [model.continuous_loss(H_new[i], y_hat[0])
+                          if isinstance(y_hat, tuple)
+                          else model.loss(H_new[i], y_hat)
+                          for y_hat in Y_hat]
+            constraints.update(rows, delta_psis, losses)
+        return constraints
+
     def predict(self, X):
         prediction = self.base_ssvm.predict(X)
         return [self.model.label_from_latent(h) for h in prediction]
@@ -175,6 +211,14 @@ class LatentSSVM(BaseSSVM):
     def C(self, C_):
         self.base_ssvm.w = C_
 
+    @property
+    def verbose(self):
+        return self.base_ssvm.verbose
+
+    @verbose.setter
+    def verbose(self, verbose_):
+        self.base_ssvm.verbose = verbose_
+
     @property
     def n_jobs(self):
         return self.base_ssvm.n_jobs
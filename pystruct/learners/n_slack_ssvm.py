@@ -12,19 +12,21 @@ import numpy as np
 import cvxopt
 import cvxopt.solvers
 
-from sklearn.externals.joblib import Parallel, delayed
 from sklearn.utils import gen_even_slices
 
-from .ssvm import BaseSSVM
-from ..utils import unwrap_pairwise, find_constraint
+from .ssvm import BaseSSVM, stops_pool
+from ..utils import find_constraint
+from ..utils.constraints import SampleConstraintStore
+from ..utils.qp import active_set_qp
 
 
 class NSlackSSVM(BaseSSVM):
     """Structured SVM solver for the n-slack QP with l1 slack penalty.
 
     Implements margin rescaled structural SVM using
-    the n-slack formulation and cutting plane method, solved using CVXOPT.
-    The optimization is restarted in each iteration.
+    the n-slack formulation and cutting plane method, solved using CVXOPT
+    or an active set method. The optimization is restarted in each
+    iteration when using CVXOPT, and warm-started with the active set method.
 
     Parameters
     ----------
@@ -89,6 +91,14 @@ class NSlackSSVM(BaseSSVM):
         Pystruct logger for storing the model or extracting additional
         information.
 
+    qp_solver : string, default='cvxopt'
+        Solver for the QP over the working set of constraints. 'cvxopt' uses
+        the generic interior point solver of CVXOPT. 'active_set' uses an
+        active set method that exploits the box structure of the QP, only
+        solves linear systems over the constraints with non-zero dual
+        variables and is warm-started from the previous solution.
+        'active_set' does not support ``negativity_constraint``.
+
     Attributes
     ----------
     w : nd-array, shape=(model.size_psi,)
@@ -97,6 +107,14 @@ class NSlackSSVM(BaseSSVM):
     old_solution : dict
         The last solution found by the qp solver.
 
+    ``constraints_`` : SampleConstraintStore
+        Constraints of the working set. Behaves like a list with the
+        constraints ``[y_hat, delta_psi, loss]`` of each sample.
+
+    ``alphas_`` : nd-array, shape=(n_constraints,)
+        Dual variables of the constraints, in the order of
+        ``constraints_.psis``.
+
     ``loss_curve_`` : list of float
         List of loss values if show_loss_every > 0.
 
@@ -123,7 +141,8 @@ class NSlackSSVM(BaseSSVM):
                  verbose=0, negativity_constraint=None, n_jobs=1,
                  break_on_bad=False, show_loss_every=0, batch_size=100,
                  tol=1e-3, inactive_threshold=1e-5,
-                 inactive_window=50, logger=None, switch_to=None):
+                 inactive_window=50, logger=None, switch_to=None,
+                 qp_solver='cvxopt'):
 
         BaseSSVM.__init__(self, model, max_iter, C, verbose=verbose,
                           n_jobs=n_jobs, show_loss_every=show_loss_every,
@@ -137,26 +156,62 @@ class NSlackSSVM(BaseSSVM):
         self.inactive_threshold = inactive_threshold
         self.inactive_window = inactive_window
         self.switch_to = switch_to
+        self.qp_solver = qp_solver
 
     def _solve_n_slack_qp(self, constraints, n_samples):
         C = self.C
-        psis = [c[1] for sample in constraints for c in sample]
-        losses = [c[2] for sample in constraints for c in sample]
+        psi_matrix = constraints.psis
+        n_constraints = constraints.n_constraints
+        gram = constraints.gram
+        losses = constraints.losses
+        # index of the sample each constraint belongs to
+        groups = constraints.samples
+        if self.qp_solver == 'active_set':
+            solution = self._solve_qp_active_set(gram, losses, groups)
+        elif self.qp_solver == 'cvxopt':
+            solution = self._solve_qp_cvxopt(gram, losses, groups,
+                                             psi_matrix, n_samples)
+        else:
+            raise ValueError("qp_solver should be 'cvxopt' or 'active_set',"
+                             " got %s." % str(self.qp_solver))
 
-        psi_matrix = np.vstack(psis).astype(np.float)
-        n_constraints = len(psis)
-        P = cvxopt.matrix(np.dot(psi_matrix, psi_matrix.T))
+        # Lagrange multipliers
+        a = np.ravel(solution['x'])
+        self.alphas_ = a
+        self.old_solution = solution
+        # compute w before pruning changes the constraint store
+        self.w = np.dot(a, psi_matrix)
+
+        # Support vectors have non zero lagrange multipliers
+        sv = a > self.inactive_threshold * C
+        box = np.bincount(groups, a, minlength=n_samples)
+        if self.verbose > 1:
+            print("%d support vectors out of %d points" % (np.sum(sv),
+                                                           n_constraints))
+            # calculate per example box constraint:
+            print("Box constraints at C: %d" % np.sum(1 - box / C < 1e-3))
+            print("dual objective: %f" % -solution['primal objective'])
+        self.prune_constraints(constraints, a)
+        return -solution['primal objective']
+
+    def _solve_qp_active_set(self, gram, losses, groups):
+        if self.negativity_constraint is not None:
+            raise ValueError("negativity_constraint is not supported by the"
+                             " active_set qp_solver.")
+        # start from the previous solution, new constraints start at zero
+        alpha = np.zeros(len(losses))
+        if self.alphas_ is not None and len(self.alphas_) <= len(losses):
+            alpha[:len(self.alphas_)] = self.alphas_
+        a = active_set_qp(gram, losses, groups, self.C, alpha=alpha)
+        primal_objective = np.dot(a, np.dot(gram, a)) / 2. - np.dot(losses, a)
+        return {'x': a, 'primal objective': primal_objective}
+
+    def _solve_qp_cvxopt(self, gram, losses, groups, psi_matrix, n_samples):
+        C = self.C
+        n_constraints = len(losses)
+        P = cvxopt.matrix(gram)
         # q contains loss from margin-rescaling
-        q = cvxopt.matrix(-np.array(losses, dtype=np.float))
-        # constraints are a bit tricky. first, all alpha must be >zero
-        idy = np.identity(n_constraints)
-        tmp1 = np.zeros(n_constraints)
-        # box constraint: sum of all alpha for one example must be <= C
-        blocks = np.zeros((n_samples, n_constraints))
-        first = 0
-        for i, sample in enumerate(constraints):
-            blocks[i, first: first + len(sample)] = 1
-            first += len(sample)
+        q = cvxopt.matrix(-losses)
         # positivity constraints:
         if self.negativity_constraint is None:
             #empty constraints
@@ -166,9 +221,22 @@ class NSlackSSVM(BaseSSVM):
             psis_constr = psi_matrix.T[self.negativity_constraint]
             zero_constr = np.zeros(len(self.negativity_constraint))
 
-        # put together
-        G = cvxopt.sparse(cvxopt.matrix(np.vstack((-idy, blocks,
-                                                   psis_constr))))
+        # constraints are a bit tricky. first, all alpha must be >zero.
+        # second, box constraint: sum of all alpha for one example must be
+        # <= C. Build the sparse matrix directly, a dense identity and block
+        # matrix needs quadratic memory.
+        n_negativity = len(psis_constr)
+        rows = np.hstack([np.arange(n_constraints), n_constraints + groups,
+                          np.repeat(np.arange(n_negativity), n_constraints)
+                          + n_constraints + n_samples])
+        cols = np.hstack([np.arange(n_constraints), np.arange(n_constraints),
+                          np.tile(np.arange(n_constraints), n_negativity)])
+        values = np.hstack([-np.ones(n_constraints), np.ones(n_constraints),
+                            psis_constr.ravel()])
+        G = cvxopt.spmatrix(values, rows, cols,
+                            (n_constraints + n_samples + n_negativity,
+                             n_constraints))
+        tmp1 = np.zeros(n_constraints)
         tmp2 = np.ones(n_samples) * C
         h = cvxopt.matrix(np.hstack((tmp1, tmp2, zero_constr)))
 
@@ -180,38 +248,18 @@ class NSlackSSVM(BaseSSVM):
             solution = {'status': 'error'}
         if solution['status'] != "optimal":
             print("regularizing QP!")
-            P = cvxopt.matrix(np.dot(psi_matrix, psi_matrix.T)
-                              + 1e-8 * np.eye(psi_matrix.shape[0]))
+            P = cvxopt.matrix(gram + 1e-8 * np.eye(n_constraints))
             solution = cvxopt.solvers.qp(P, q, G, h)
             if solution['status'] != "optimal":
                 raise ValueError("QP solver failed. Try regularizing your QP.")
+        return solution
 
-        # Lagrange multipliers
-        a = np.ravel(solution['x'])
-        self.prune_constraints(constraints, a)
-        self.old_solution = solution
-
-        # Support vectors have non zero lagrange multipliers
-        sv = a > self.inactive_threshold * C
-        box = np.dot(blocks, a)
-        if self.verbose > 1:
-            print("%d support vectors out of %d points" % (np.sum(sv),
-                                                           n_constraints))
-            # calculate per example box constraint:
-            print("Box constraints at C: %d" % np.sum(1 - box / C < 1e-3))
-            print("dual objective: %f" % -solution['primal objective'])
-        self.w = np.dot(a, psi_matrix)
-        return -solution['primal objective']
-
-    def _check_bad_constraint(self, y_hat, slack, old_constraints):
+    def _check_bad_constraint(self, y_hat, slack, constraints, i,
+                              old_slacks=None):
         if slack < 1e-5:
             return True
-        y_hat_plain = unwrap_pairwise(y_hat)
 
-        already_active = np.any([True for y__, _, _ in old_constraints
-                                 if np.all(y_hat_plain ==
-                                           unwrap_pairwise(y__))])
-        if already_active:
+        if constraints.contains(i, y_hat):
             return True
 
         # "smart" stopping criterion
@@ -219,24 +267,25 @@ class NSlackSSVM(BaseSSVM):
         # than previous ones by more then eps.
         # If it is less violated, inference was wrong/approximate
         if self.check_constraints:
-            for con in old_constraints:
-                # compute slack for old constraint
-                slack_tmp = max(con[2] - np.dot(self.w, con[1]), 0)
-                if self.verbose > 5:
-                    print("slack old constraint: %f" % slack_tmp)
-                # if slack of new constraint is smaller or not
-                # significantly larger, don't add constraint.
-                # if smaller, complain about approximate inference.
-                if slack - slack_tmp < -1e-5:
-                    if self.verbose > 0:
-                        print("bad inference: %f" % (slack_tmp - slack))
-                    if self.break_on_bad:
-                        raise ValueError("bad inference: %f" % (slack_tmp -
-                                                                slack))
-                    return True
+            # slacks of the old constraints of this sample
+            slacks_i = old_slacks[constraints.rows(i)]
+            if self.verbose > 5:
+                print("slack old constraints: %s" % str(slacks_i))
+            # if slack of new constraint is smaller or not
+            # significantly larger, don't add constraint.
+            # if smaller, complain about approximate inference.
+            if len(slacks_i) and slack - np.max(slacks_i) < -1e-5:
+                slack_tmp = np.max(slacks_i)
+                if self.verbose > 0:
+                    print("bad inference: %f" % (slack_tmp - slack))
+                if self.break_on_bad:
+                    raise ValueError("bad inference: %f" % (slack_tmp -
+                                                            slack))
+                return True
 
         return False
 
+    @stops_pool
     def fit(self, X, Y, constraints=None, warm_start=None, initialize=True):
         """Learn parameters using cutting plane method.
 
@@ -256,7 +305,9 @@ class NSlackSSVM(BaseSSVM):
             Each constraint is of the form [y_hat, delta_psi, loss], where
             y_hat is a labeling, ``delta_psi = psi(x, y) - psi(x, y_hat)``
             and loss is the loss for predicting y_hat instead of the true label
-            y.
+            y. Can also be a ``SampleConstraintStore``, which is used
+            directly. Constraints are kept active as in the previous call to
+            fit if the store has the same constraints in the same order.
 
         initialize : boolean, default=True
             Whether to initialize the model for the data.
@@ -271,14 +322,27 @@ class NSlackSSVM(BaseSSVM):
         stopping_criterion = False
         if constraints is None:
             # fresh start
-            constraints = [[] for i in xrange(n_samples)]
-            self.last_active = [[] for i in xrange(n_samples)]
+            constraints = SampleConstraintStore(n_samples,
+                                                self.model.size_psi)
+            self.last_active = np.zeros(0, dtype=np.int)
+            self.alphas_ = None
             self.objective_curve_ = []
             self.primal_objective_curve_ = []
             self.timestamps_ = [time()]
+            self._reset_y_hat_init(n_samples)
         else:
             # warm start
+            if not isinstance(constraints, SampleConstraintStore):
+                constraints = SampleConstraintStore.from_lists(
+                    constraints, self.model.size_psi)
+            if (len(getattr(self, 'last_active', []))
+                    != constraints.n_constraints):
+                self.last_active = np.zeros(constraints.n_constraints,
+                                            dtype=np.int)
+                self.alphas_ = None
             objective = self._solve_n_slack_qp(constraints, n_samples)
+            self._reset_y_hat_init(n_samples, reset=False)
+        self._start_pool(X, Y)
         try:
             # catch ctrl+c to stop training
             # we have to update at least once after going through the dataset
@@ -302,20 +366,30 @@ class NSlackSSVM(BaseSSVM):
                 slack_sum = 0
                 for batch in slices:
                     new_constraints_batch = 0
-                    verbose = max(0, self.verbose - 3)
                     X_b = X[batch]
                     Y_b = Y[batch]
                     indices_b = indices[batch]
-                    candidate_constraints = Parallel(
-                        n_jobs=self.n_jobs, verbose=verbose)(
-                            delayed(find_constraint)(self.model, x, y, self.w)
-                            for x, y in zip(X_b, Y_b))
+                    init_b = [self._y_hat_init[i] for i in indices_b]
+                    # slacks of the old constraints, for checking the new
+                    # ones. w only changes after the batch.
+                    old_slacks = None
+                    if self.check_constraints:
+                        old_slacks = constraints.slacks(self.w)
+                    if self.n_jobs != 1:
+                        candidate_constraints = self._pool.map(
+                            find_constraint, self.w, indices_b, init=init_b)
+                    else:
+                        candidate_constraints = [
+                            find_constraint(self.model, x, y, self.w,
+                                            init=y_init)
+                            for x, y, y_init in zip(X_b, Y_b, init_b)]
 
                     # for each batch, gather new constraints
                     for i, x, y, constraint in zip(indices_b, X_b, Y_b,
                                                    candidate_constraints):
                         # loop over samples in batch
                         y_hat, delta_psi, slack, loss = constraint
+                        self._set_y_hat_init(i, y_hat)
                         slack_sum += slack
 
                         if self.verbose > 3:
@@ -327,10 +401,11 @@ class NSlackSSVM(BaseSSVM):
                             continue
 
                         if self._check_bad_constraint(y_hat, slack,
-                                                      constraints[i]):
+                                                      constraints, i,
+                                                      old_slacks):
                             continue
 
-                        constraints[i].append([y_hat, delta_psi, loss])
+                        constraints.append(i, y_hat, delta_psi, loss)
                         new_constraints_batch += 1
 
                     # after processing the slice, solve the qp
@@ -369,6 +444,8 @@ class NSlackSSVM(BaseSSVM):
                         self.model.inference_method_ = \
                             self.model.inference_method
                         self.model.inference_method = self.switch_to
+                        # workers need the new inference method
+                        self._start_pool(X, Y)
                         stopping_criterion = False
                         continue
                     else:
@@ -386,41 +463,32 @@ class NSlackSSVM(BaseSSVM):
         if self.verbose and self.n_jobs == 1:
             print("calls to inference: %d" % self.model.inference_calls)
 
-        if verbose:
+        if self.verbose:
             print("Computing final objective.")
         self.timestamps_.append(time() - self.timestamps_[0])
         self.primal_objective_curve_.append(self._objective(X, Y))
+        self._stop_pool()
         self.objective_curve_.append(objective)
         if self.logger is not None:
             self.logger(self, 'final')
         return self
 
     def prune_constraints(self, constraints, a):
-        # append list for new constraint
-        # self.alpha is a list which has
-        # an entry per sample. each sample has an int for each constraint,
-        # saying when was it last used
+        # self.last_active has an int for each constraint,
+        # saying how many solves ago it was last used
         if self.inactive_window == 0:
             return
-        k = 0
-        for i, sample in enumerate(constraints):
-            # if there are no constraints for this sample, do nothing:
-            if not len(sample):
-                continue
-            # add self.last_active for any new constraint
-            n_old_constraints_sample = len(self.last_active[i])
-            if n_old_constraints_sample < len(sample):
-                self.last_active[i] = np.hstack([self.last_active[i], [0]])
-            # if inactive, count up
-            inactive_this = (a[k:k + len(sample)] < self.inactive_threshold
-                             * self.C)
-            self.last_active[i][inactive_this] += 1
-            k += len(sample)
-            assert(len(sample) == len(self.last_active[i]))
-
-            # remove unused constraints:
-            to_remove = self.last_active[i] > self.inactive_window
-            self.last_active[i] = self.last_active[i][~to_remove]
-            for j in np.where(to_remove)[0][::-1]:
-                del sample[j]
-            assert(len(sample) == len(self.last_active[i]))
+        # add self.last_active for any new constraint
+        n_new = len(a) - len(self.last_active)
+        self.last_active = np.hstack([self.last_active,
+                                      np.zeros(n_new, dtype=np.int)])
+        # if inactive, count up
+        inactive = a < self.inactive_threshold * self.C
+        self.last_active[inactive] += 1
+
+        # remove unused constraints:
+        to_remove = self.last_active > self.inactive_window
+        self.last_active = self.last_active[~to_remove]
+        self.alphas_ = self.alphas_[~to_remove]
+        del constraints[np.where(to_remove)[0]]
+        assert(constraints.n_constraints == len(self.last_active))
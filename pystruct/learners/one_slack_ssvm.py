@@ -11,10 +11,10 @@ import numpy as np
 import cvxopt
 import cvxopt.solvers
 
-from sklearn.externals.joblib import Parallel, delayed
-
-from .ssvm import BaseSSVM
+from .ssvm import BaseSSVM, stops_pool
 from ..utils import loss_augmented_inference
+from ..utils.constraints import ConstraintStore, InferenceCache
+from ..utils.qp import active_set_qp
 
 
 class NoConstraint(Exception):
@@ -26,8 +26,10 @@ class OneSlackSSVM(BaseSSVM):
     """Structured SVM solver for the 1-slack QP with l1 slack penalty.
 
     Implements margin rescaled structural SVM using
-    the 1-slack formulation and cutting plane method, solved using CVXOPT.
-    The optimization is restarted in each iteration.
+    the 1-slack formulation and cutting plane method, solved using CVXOPT
+    or an active set method. The inner products of the
+    constraints are updated incrementally and the QP is warm-started from
+    the previous solution in each iteration.
 
     Parameters
     ----------
@@ -80,6 +82,17 @@ class OneSlackSSVM(BaseSSVM):
         exhausted. Using inference_cache > 0 is only advisable if computation
         time is dominated by inference.
 
+    cache_memory : int or None, default=None
+        Maximum number of bytes used for the psis in the inference cache.
+        Fewer than ``inference_cache`` results are cached per sample if they
+        do not fit. None means no limit. The psis are stored in single
+        precision.
+
+    cache_eviction : string, default='lru'
+        Which result to replace when the cache of a sample is full. 'lru'
+        replaces the least recently added or used result, 'violation' the
+        result that is least violated by the current parameters.
+
     cache_tol : float, default=None
         Tolerance when to reject a constraint from cache (and do inference).
         If None, ``tol`` will be used. Higher values might lead to faster
@@ -101,6 +114,14 @@ class OneSlackSSVM(BaseSSVM):
         Pystruct logger for storing the model or extracting additional
         information.
 
+    qp_solver : string, default='cvxopt'
+        Solver for the QP over the working set of constraints. 'cvxopt' uses
+        the generic interior point solver of CVXOPT. 'active_set' uses an
+        active set method that exploits the simplex structure of the QP, only
+        solves linear systems over the constraints with non-zero dual
+        variables and is warm-started from the previous solution.
+        'active_set' does not support ``negativity_constraint``.
+
     Attributes
     ----------
     w : nd-array, shape=(model.size_psi,)
@@ -133,7 +154,8 @@ class OneSlackSSVM(BaseSSVM):
                  break_on_bad=False, show_loss_every=0, tol=1e-3,
                  inference_cache=0, inactive_threshold=1e-5,
                  inactive_window=50, logger=None, cache_tol='auto',
-                 switch_to=None):
+                 switch_to=None, qp_solver='cvxopt', cache_memory=None,
+                 cache_eviction='lru'):
 
         BaseSSVM.__init__(self, model, max_iter, C, verbose=verbose,
                           n_jobs=n_jobs, show_loss_every=show_loss_every,
@@ -145,20 +167,62 @@ class OneSlackSSVM(BaseSSVM):
         self.tol = tol
         self.cache_tol = cache_tol
         self.inference_cache = inference_cache
+        self.cache_memory = cache_memory
+        self.cache_eviction = cache_eviction
         self.inactive_threshold = inactive_threshold
         self.inactive_window = inactive_window
         self.switch_to = switch_to
+        self.qp_solver = qp_solver
 
     def _solve_1_slack_qp(self, constraints, n_samples):
         C = np.float(self.C) * n_samples  # this is how libsvm/svmstruct do it
-        psis = [c[0] for c in constraints]
-        losses = [c[1] for c in constraints]
+        psi_matrix = constraints.psis
+        n_constraints = len(constraints)
+        if self.qp_solver == 'active_set':
+            solution = self._solve_qp_active_set(constraints, C)
+        elif self.qp_solver == 'cvxopt':
+            solution = self._solve_qp_cvxopt(constraints, C)
+        else:
+            raise ValueError("qp_solver should be 'cvxopt' or 'active_set',"
+                             " got %s." % str(self.qp_solver))
 
-        psi_matrix = np.vstack(psis)
-        n_constraints = len(psis)
-        P = cvxopt.matrix(np.dot(psi_matrix, psi_matrix.T))
+        # Lagrange multipliers
+        a = np.ravel(solution['x'])
+        self.old_solution = solution
+        # compute w before pruning changes the constraint store
+        self.w = np.dot(a, psi_matrix)
+        self.prune_constraints(constraints, a)
+
+        # Support vectors have non zero lagrange multipliers
+        sv = a > self.inactive_threshold * C
+        if self.verbose > 1:
+            print("%d support vectors out of %d points" % (np.sum(sv),
+                                                           n_constraints))
+        # we needed to flip the sign to make the dual into a minimization
+        # model
+        return -solution['primal objective']
+
+    def _solve_qp_active_set(self, constraints, C):
+        if self.negativity_constraint is not None:
+            raise ValueError("negativity_constraint is not supported by the"
+                             " active_set qp_solver.")
+        n_constraints = len(constraints)
+        alpha = None
+        if len(self.alphas) == n_constraints - 1:
+            alpha = np.array([alphas[-1] for alphas in self.alphas] + [0.])
+        a = active_set_qp(constraints.gram, constraints.losses,
+                          np.zeros(n_constraints, dtype=np.int), C,
+                          alpha=alpha, equality=True)
+        primal_objective = (np.dot(a, np.dot(constraints.gram, a)) / 2.
+                            - np.dot(constraints.losses, a))
+        return {'x': a, 'primal objective': primal_objective}
+
+    def _solve_qp_cvxopt(self, constraints, C):
+        psi_matrix = constraints.psis
+        n_constraints = len(constraints)
+        P = cvxopt.matrix(constraints.gram)
         # q contains loss from margin-rescaling
-        q = cvxopt.matrix(-np.array(losses, dtype=np.float))
+        q = cvxopt.matrix(-constraints.losses)
         # constraints: all alpha must be >zero
         idy = np.identity(n_constraints)
         tmp1 = np.zeros(n_constraints)
@@ -181,44 +245,40 @@ class OneSlackSSVM(BaseSSVM):
 
         # solve QP model
         cvxopt.solvers.options['feastol'] = 1e-5
-        #if hasattr(self, 'old_solution'):
-            #s = self.old_solution['s']
-            ## put s slightly inside the cone..
-            #s = cvxopt.matrix(np.vstack([s, [[1e-10]]]))
-            #z = self.old_solution['z']
-            #z = cvxopt.matrix(np.vstack([z, [[1e-10]]]))
-            #initvals = {'x': self.old_solution['x'], 'y':
-                        #self.old_solution['y'], 'z': z,
-                        #'s': s}
-        #else:
-            #initvals = {}
-        #solution = cvxopt.solvers.qp(P, q, G, h, A, b, initvals=initvals)
+        initvals = self._qp_initvals(n_constraints, C, psis_constr)
         try:
-            solution = cvxopt.solvers.qp(P, q, G, h, A, b)
+            solution = cvxopt.solvers.qp(P, q, G, h, A, b, initvals=initvals)
         except ValueError:
             solution = {'status': 'error'}
+        if solution['status'] != "optimal" and initvals:
+            # try again from scratch
+            try:
+                solution = cvxopt.solvers.qp(P, q, G, h, A, b)
+            except ValueError:
+                solution = {'status': 'error'}
         if solution['status'] != "optimal":
             print("regularizing QP!")
-            P = cvxopt.matrix(np.dot(psi_matrix, psi_matrix.T)
-                              + 1e-8 * np.eye(psi_matrix.shape[0]))
+            P = cvxopt.matrix(constraints.gram
+                              + 1e-8 * np.eye(n_constraints))
             solution = cvxopt.solvers.qp(P, q, G, h, A, b)
             if solution['status'] != "optimal":
                 raise ValueError("QP solver failed. Try regularizing your QP.")
-
-        # Lagrange multipliers
-        a = np.ravel(solution['x'])
-        self.old_solution = solution
-        self.prune_constraints(constraints, a)
-
-        # Support vectors have non zero lagrange multipliers
-        sv = a > self.inactive_threshold * C
-        if self.verbose > 1:
-            print("%d support vectors out of %d points" % (np.sum(sv),
-                                                           n_constraints))
-        self.w = np.dot(a, psi_matrix)
-        # we needed to flip the sign to make the dual into a minimization
-        # model
-        return -solution['primal objective']
+        return solution
+
+    def _qp_initvals(self, n_constraints, C, psis_constr):
+        """Starting point for the QP from the previous dual solution."""
+        if len(self.alphas) != n_constraints - 1:
+            return {}
+        alpha = np.array([alphas[-1] for alphas in self.alphas] + [0.])
+        # move the previous solution into the interior of the feasible set
+        # by mixing in a little of the uniform solution
+        alpha = np.maximum(alpha, 0)
+        alpha = (.9 * C * alpha / max(np.sum(alpha), 1e-10)
+                 + .1 * C / n_constraints)
+        # slack of the inequality constraints, which has to be positive
+        s = np.hstack([alpha, -np.dot(psis_constr, alpha)])
+        s = np.maximum(s, 1e-8 * C)
+        return {'x': cvxopt.matrix(alpha), 's': cvxopt.matrix(s)}
 
     def prune_constraints(self, constraints, a):
         # append list for new constraint
@@ -226,7 +286,8 @@ class OneSlackSSVM(BaseSSVM):
         assert(len(self.alphas) == len(constraints))
         for constraint, alpha in zip(self.alphas, a):
             constraint.append(alpha)
-            constraint = constraint[-self.inactive_window:]
+            if self.inactive_window != 0:
+                del constraint[:-self.inactive_window]
 
         # prune unused constraints:
         # if the max of alpha in last 50 iterations was small, throw away
@@ -238,9 +299,9 @@ class OneSlackSSVM(BaseSSVM):
             inactive = np.where(max_active
                                 < self.inactive_threshold * strongest)[0]
 
+            del constraints[inactive]
             for idx in reversed(inactive):
                 # if we don't reverse, we'll mess the indices up
-                del constraints[idx]
                 del self.alphas[idx]
 
     def _check_bad_constraint(self, violation, dpsi_mean, loss,
@@ -258,8 +319,8 @@ class OneSlackSSVM(BaseSSVM):
             if self.verbose:
                 print("new constraint too weak.")
             return True
-        equals = [True for dpsi_, loss_ in old_constraints
-                  if (np.all(dpsi_ == dpsi_mean) and loss == loss_)]
+        equals = (np.all(old_constraints.psis == dpsi_mean, axis=1)
+                  & (old_constraints.losses == loss))
 
         if np.any(equals):
             return True
@@ -287,26 +348,18 @@ class OneSlackSSVM(BaseSSVM):
             return
         if (not hasattr(self, "inference_cache_")
                 or self.inference_cache_ is None):
-            self.inference_cache_ = [[] for y in Y_hat]
-
-        def constraint_equal(y_1, y_2):
-            if isinstance(y_1, tuple):
-                return np.all(y_1[0] == y_2[0]) and np.all(y_1[1] == y_2[1])
-            return np.all(y_1 == y_2)
-
-        for sample, x, y, y_hat in zip(self.inference_cache_, X, Y, Y_hat):
-            already_there = [constraint_equal(y_hat, cache[2])
-                             for cache in sample]
-            if np.any(already_there):
-                continue
-            if len(sample) > self.inference_cache:
-                sample.pop(0)
+            self.inference_cache_ = InferenceCache(
+                len(X), self.model.size_psi, self.inference_cache,
+                memory=self.cache_memory, eviction=self.cache_eviction)
+
+        for i, (x, y, y_hat) in enumerate(zip(X, Y, Y_hat)):
             # we computed both of these before, but summed them up immediately
             # this makes it a little less efficient in the caching case.
             # the idea is that if we cache, inference is way more expensive
             # and this doesn't matter much.
-            sample.append((self.model.psi(x, y_hat),
-                           self.model.loss(y, y_hat), y_hat))
+            self.inference_cache_.add(i, self.model.psi(x, y_hat),
+                                      self.model.loss(y, y_hat), y_hat,
+                                      self.w)
 
     def _constraint_from_cache(self, X, Y, psi_gt, constraints):
         if (not getattr(self, 'inference_cache_', False) or
@@ -323,17 +376,9 @@ class OneSlackSSVM(BaseSSVM):
                       % (gap, self.cache_tol_))
             raise NoConstraint
 
-        Y_hat = []
-        psi_acc = np.zeros(self.model.size_psi)
-        loss_mean = 0
-        for cached in self.inference_cache_:
-            # cached has entries of form (psi, loss, y_hat)
-            violations = [np.dot(psi, self.w) + loss
-                          for psi, loss, _ in cached]
-            psi, loss, y_hat = cached[np.argmax(violations)]
-            Y_hat.append(y_hat)
-            psi_acc += psi
-            loss_mean += loss
+        # most violating cached result for each sample
+        Y_hat, psi_acc, loss_mean = self.inference_cache_.most_violated(
+            self.w)
 
         dpsi = (psi_gt - psi_acc) / len(X)
         loss_mean = loss_mean / len(X)
@@ -349,14 +394,13 @@ class OneSlackSSVM(BaseSSVM):
     def _find_new_constraint(self, X, Y, psi_gt, constraints, check=True):
         if self.n_jobs != 1:
             # do inference in parallel
-            verbose = max(0, self.verbose - 3)
-            Y_hat = Parallel(n_jobs=self.n_jobs, verbose=verbose)(
-                delayed(loss_augmented_inference)(
-                    self.model, x, y, self.w, relaxed=True)
-                for x, y in zip(X, Y))
+            Y_hat = self._pool.map(loss_augmented_inference, self.w,
+                                   init=self._y_hat_init, relaxed=True)
         else:
             Y_hat = self.model.batch_loss_augmented_inference(
-                X, Y, self.w, relaxed=True)
+                X, Y, self.w, relaxed=True, init=self._y_hat_init)
+        if self._use_y_hat_init:
+            self._y_hat_init = Y_hat
         # compute the mean over psis and losses
 
         if getattr(self.model, 'rescale_C', False):
@@ -373,6 +417,7 @@ class OneSlackSSVM(BaseSSVM):
             raise NoConstraint
         return Y_hat, dpsi, loss_mean
 
+    @stops_pool
     def fit(self, X, Y, constraints=None, warm_start=False, initialize=True):
         """Learn parameters using cutting plane method.
 
@@ -409,7 +454,7 @@ class OneSlackSSVM(BaseSSVM):
 
         if not warm_start:
             self.w = np.zeros(self.model.size_psi)
-            constraints = []
+            constraints = ConstraintStore(self.model.size_psi)
             self.objective_curve_, self.primal_objective_curve_ = [], []
             self.cached_constraint_ = []
             self.alphas = []  # dual solutions
@@ -420,7 +465,7 @@ class OneSlackSSVM(BaseSSVM):
             self.timestamps_ = [time()]
         elif warm_start == "soft":
             self.w = np.zeros(self.model.size_psi)
-            constraints = []
+            constraints = ConstraintStore(self.model.size_psi)
             self.alphas = []  # dual solutions
             # append constraint given by ground truth to make our life easier
             constraints.append((np.zeros(self.model.size_psi), 0))
@@ -430,6 +475,8 @@ class OneSlackSSVM(BaseSSVM):
             constraints = self.constraints_
 
         self.last_slack_ = -1
+        self._reset_y_hat_init(len(X), reset=not warm_start)
+        self._start_pool(X, Y)
 
         # get the psi of the ground truth
         if getattr(self.model, 'rescale_C', False):
@@ -468,6 +515,8 @@ class OneSlackSSVM(BaseSSVM):
                             self.model.inference_method_ = \
                                 self.model.inference_method
                             self.model.inference_method = self.switch_to
+                            # workers need the new inference method
+                            self._start_pool(X, Y)
                             continue
                         else:
                             break
@@ -516,6 +565,7 @@ class OneSlackSSVM(BaseSSVM):
         # compute final objective:
         self.timestamps_.append(time() - self.timestamps_[0])
         primal_objective = self._objective(X, Y)
+        self._stop_pool()
         self.primal_objective_curve_.append(primal_objective)
         self.objective_curve_.append(objective)
         self.cached_constraint_.append(False)
@@ -1,9 +1,23 @@
+from functools import wraps
 
 import numpy as np
 from sklearn.externals.joblib import Parallel, delayed
 from sklearn.base import BaseEstimator
 
+from ..inference import uses_init
 from ..utils import inference, objective_primal
+from ..utils.parallel import WorkerPool
+
+
+def stops_pool(fit):
+    """Decorate fit so that the worker pool is stopped even if it fails."""
+    @wraps(fit)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return fit(self, *args, **kwargs)
+        finally:
+            self._stop_pool()
+    return wrapper
 
 
 class BaseSSVM(BaseEstimator):
@@ -18,6 +32,13 @@ class BaseSSVM(BaseEstimator):
         self.n_jobs = n_jobs
         self.logger = logger
 
+    def __getstate__(self):
+        # the worker pool of a running fit can't be pickled, for example by
+        # a SaveLogger
+        state = self.__dict__.copy()
+        state.pop('_pool', None)
+        return state
+
     def predict(self, X):
         """Predict output on examples in X.
 
@@ -32,6 +53,10 @@ class BaseSSVM(BaseEstimator):
             List of inference results for X using the learned parameters.
 
         """
+        pool = getattr(self, '_pool', None)
+        if pool is not None and pool.X is X:
+            # during fit, the workers already hold the training data
+            return pool.map(inference, self.w, use_labels=False)
         verbose = max(0, self.verbose - 3)
         if self.n_jobs != 1:
             prediction = Parallel(n_jobs=self.n_jobs, verbose=verbose)(
@@ -69,6 +94,37 @@ class BaseSSVM(BaseEstimator):
         max_losses = [self.model.max_loss(y) for y in Y]
         return 1. - np.sum(losses) / float(np.sum(max_losses))
 
+    def _start_pool(self, X, Y, shared=None):
+        # worker processes that keep the training data during fit
+        self._stop_pool()
+        if self.n_jobs != 1:
+            self._pool = WorkerPool(self.model, X, Y, n_jobs=self.n_jobs,
+                                    shared=shared)
+
+    def _stop_pool(self):
+        if getattr(self, '_pool', None) is not None:
+            self._pool.close()
+            self.worker_utilization_ = self._pool.utilization()
+            if self.verbose:
+                print("worker utilization: %s"
+                      % np.array2string(self.worker_utilization_,
+                                        precision=2))
+        self._pool = None
+
+    def _reset_y_hat_init(self, n_samples, reset=True):
+        # the last loss-augmented prediction for each sample is used to
+        # warm-start inference in the next iteration, if the inference
+        # method makes use of it
+        self._use_y_hat_init = uses_init(
+            getattr(self.model, 'inference_method', None))
+        if (reset or not self._use_y_hat_init
+                or len(getattr(self, '_y_hat_init', [])) != n_samples):
+            self._y_hat_init = [None] * n_samples
+
+    def _set_y_hat_init(self, i, y_hat):
+        if self._use_y_hat_init:
+            self._y_hat_init[i] = y_hat
+
     def _compute_training_loss(self, X, Y, iteration):
         # optionally compute training loss for output / training curve
         if (self.show_loss_every != 0
@@ -86,4 +142,5 @@ class BaseSSVM(BaseEstimator):
         else:
             variant = 'n_slack'
         return objective_primal(self.model, self.w, X, Y, self.C,
-                                variant=variant, n_jobs=self.n_jobs)
+                                variant=variant, n_jobs=self.n_jobs,
+                                pool=getattr(self, '_pool', None))
@@ -2,6 +2,7 @@ import numpy as np
 from sklearn.externals.joblib import Parallel, delayed
 
 from .ssvm import BaseSSVM
+from ..utils.weights import LazyWeights
 
 
 def inference(model, x, w):
@@ -99,7 +100,7 @@ class StructuredPerceptron(BaseSSVM):
         if initialize:
             self.model.initialize(X, Y)
         size_psi = self.model.size_psi
-        self.w = np.zeros(size_psi)
+        w_bar = None
         if self.average is not False:
             if self.average is True:
                 self.average = 0
@@ -110,15 +111,20 @@ class StructuredPerceptron(BaseSSVM):
                                      "possibility of early stopping.")
             w_bar = np.zeros(size_psi)
             n_obs = 0
+        # the average is updated lazily, so that an update only touches the
+        # non-zero entries of the psi difference. w is never scaled, so
+        # self.w is the same array as weights.v.
+        weights = LazyWeights(np.zeros(size_psi), w_bar)
+        self.w = weights.v
         self.loss_curve_ = []
         max_losses = np.sum([self.model.max_loss(y) for y in Y])
         try:
             for iteration in xrange(self.max_iter):
                 if self.average == -1:
                     # By resetting at every iteration we effectively get
-                    # averaging over the last one.
+                    # averaging over the last one. The first update of the
+                    # average discards the old one.
                     n_obs = 0
-                    w_bar.fill(0)
                 effective_lr = ((iteration + self.decay_t0) **
                                 self.decay_exponent)
                 losses = 0
@@ -132,12 +138,12 @@ class StructuredPerceptron(BaseSSVM):
                         current_loss = self.model.loss(y, y_hat)
                         losses += current_loss
                         if current_loss:
-                            self.w += effective_lr * (self.model.psi(x, y) -
-                                                      self.model.psi(x, y_hat))
+                            weights.add(effective_lr * (
+                                self.model.psi(x, y)
+                                - self.model.psi(x, y_hat)))
                     if self.average is not False and iteration >= self.average:
                         n_obs += 1
-                        w_bar = ((1 - 1. / n_obs) * w_bar +
-                                 (1. / n_obs) * self.w)
+                        weights.update_average(1. / n_obs)
                 else:
                     # standard online update
                     for x, y in zip(X, Y):
@@ -145,13 +151,13 @@ class StructuredPerceptron(BaseSSVM):
                         current_loss = self.model.loss(y, y_hat)
                         losses += current_loss
                         if current_loss:
-                            self.w += effective_lr * (self.model.psi(x, y) -
-                                                      self.model.psi(x, y_hat))
+                            weights.add(effective_lr * (
+                                self.model.psi(x, y)
+                                - self.model.psi(x, y_hat)))
                         if (self.average is not False and
                                 iteration >= self.average):
                             n_obs += 1
-                            w_bar = ((1 - 1. / n_obs) * w_bar +
-                                     (1. / n_obs) * self.w)
+                            weights.update_average(1. / n_obs)
                 self.loss_curve_.append(float(losses) / max_losses)
                 if self.verbose:
                     print("avg loss: %f w: %s" % (self.loss_curve_[-1],
@@ -165,5 +171,5 @@ class StructuredPerceptron(BaseSSVM):
             pass
         finally:
             if self.average is not False:
-                self.w = w_bar
+                self.w = weights.w_avg
         return self
@@ -6,11 +6,11 @@
 from time import time
 import numpy as np
 
-from sklearn.externals.joblib import Parallel, delayed, cpu_count
 from sklearn.utils import gen_even_slices
 
+from .ssvm import stops_pool
 from .subgradient_ssvm import SubgradientSSVM
-from ..utils import find_constraint_latent
+from ..utils import find_constraint, find_constraint_latent, latent
 
 
 class SubgradientLatentSSVM(SubgradientSSVM):
@@ -20,9 +20,10 @@ class SubgradientLatentSSVM(SubgradientSSVM):
     By default, a constant learning rate is used.
     It is also possible to use the adaptive learning rate found by AdaGrad.
 
-    This class implements online subgradient descent. If n_jobs != 1,
-    small batches of size n_jobs are used to exploit parallel inference.
-    If inference is fast, use n_jobs=1.
+    This class implements online subgradient descent, or mini-batch
+    subgradient descent if batch_size is given. If n_jobs != 1, inference
+    for the samples of a batch runs in parallel, with batches of size n_jobs
+    by default. If inference is fast, use n_jobs=1.
 
     Parameters
     ----------
@@ -50,6 +51,10 @@ class SubgradientLatentSSVM(SubgradientSSVM):
     n_jobs : int, default=1
         Number of parallel jobs for inference. -1 means as many as cpus.
 
+    batch_size : int, default=None
+        Number of samples used for each subgradient step. None means online
+        learning if n_jobs=1 and batches of size n_jobs otherwise.
+
     show_loss_every : int, default=0
         Controlls how often the hamming loss is computed (for monitoring
         purposes). Zero means never, otherwise it will be computed very
@@ -77,7 +82,11 @@ class SubgradientLatentSSVM(SubgradientSSVM):
         Uniform averaging is not implemented as it is worse than linear
         weighted averaging or no averaging.
 
-
+    latent_tol : float, default=0
+        If positive, the latent variables completing the ground truth of a
+        sample are only recomputed once w moved by more than latent_tol since
+        they were last computed. The distance is bounded by the length of
+        the path w took, which is cheap to keep track of.
 
     Attributes
     ----------
@@ -97,14 +106,17 @@ class SubgradientLatentSSVM(SubgradientSSVM):
     def __init__(self, model, max_iter=100, C=1.0, verbose=0, momentum=0.,
                  learning_rate='auto', n_jobs=1,
                  show_loss_every=0, decay_exponent=1, decay_t0=10,
-                 break_on_no_constraints=True, logger=None, averaging=None):
+                 break_on_no_constraints=True, logger=None, averaging=None,
+                 batch_size=None, latent_tol=0):
         SubgradientSSVM.__init__(
             self, model, max_iter, C, verbose=verbose, n_jobs=n_jobs,
             show_loss_every=show_loss_every, decay_exponent=decay_exponent,
             momentum=momentum, learning_rate=learning_rate,
             break_on_no_constraints=break_on_no_constraints, logger=logger,
-            decay_t0=decay_t0, averaging=averaging)
+            decay_t0=decay_t0, averaging=averaging, batch_size=batch_size)
+        self.latent_tol = latent_tol
 
+    @stops_pool
     def fit(self, X, Y, H_init=None, warm_start=False, initialize=True):
         """Learn parameters using subgradient descent.
 
@@ -147,57 +159,66 @@ class SubgradientLatentSSVM(SubgradientSSVM):
             self.timestamps_[0] = time() - self.timestamps_[-1]
         w = self.w.copy()
         n_samples = len(X)
+        # latent variables of the ground truth and the length of the path
+        # of w when they were computed
+        self._H = [None] * n_samples
+        self._H_path = np.zeros(n_samples)
+        self._path = 0.
+        self._start_pool(X, Y)
+        batch_size = self.batch_size
+        if batch_size is None and self._pool is not None:
+            batch_size = self._pool.n_jobs
         try:
             # catch ctrl+c to stop training
             for iteration in xrange(self.max_iter):
                 self.timestamps_.append(time() - self.timestamps_[0])
                 positive_slacks = 0
                 objective = 0.
-                #verbose = max(0, self.verbose - 3)
 
-                if self.n_jobs == 1:
+                if batch_size is None:
                     # online learning
-                    for x, y in zip(X, Y):
-                        h = self.model.latent(x, y, w)
-                        h_hat = self.model.loss_augmented_inference(
-                            x, h, w, relaxed=True)
-                        delta_psi = (self.model.psi(x, h)
-                                     - self.model.psi(x, h_hat))
-                        slack = (-np.dot(delta_psi, w)
-                                 + self.model.loss(h, h_hat))
-                        objective += np.maximum(slack, 0)
+                    for i in xrange(n_samples):
+                        h = self._complete_latent(X, Y, [i], w)[0]
+                        h_hat, delta_psi, slack, loss = find_constraint(
+                            self.model, X[i], h, w)
+                        objective += slack
                         if slack > 0:
                             positive_slacks += 1
-                        w = self._solve_subgradient(delta_psi, n_samples, w)
+                        w = self._latent_subgradient_step(delta_psi,
+                                                          n_samples, w)
                 else:
-                    #generate batches of size n_jobs
-                    #to speed up inference
-                    if self.n_jobs == -1:
-                        n_jobs = cpu_count()
-                    else:
-                        n_jobs = self.j_jobs
-
-                    n_batches = int(np.ceil(float(len(X)) / n_jobs))
-                    slices = gen_even_slices(n_samples, n_batches)
-                    for batch in slices:
-                        X_b = X[batch]
-                        Y_b = Y[batch]
-                        verbose = self.verbose - 1
-                        candidate_constraints = Parallel(
-                            n_jobs=self.n_jobs,
-                            verbose=verbose)(delayed(find_constraint_latent)(
-                                self.model, x, y, w)
-                                for x, y in zip(X_b, Y_b))
-                        dpsi = np.zeros(self.model.size_psi)
-                        for x, y, constraint in zip(X_b, Y_b,
-                                                    candidate_constraints):
-                            y_hat, delta_psi, slack, loss = constraint
+                    # mini batch learning
+                    n_batches = int(np.ceil(float(n_samples) / batch_size))
+                    for batch in gen_even_slices(n_samples, n_batches):
+                        indices = np.arange(n_samples)[batch]
+                        H_b = self._complete_latent(X, Y, indices, w)
+                        if self._pool is not None:
+                            constraints = self._pool.map(
+                                find_constraint, w, indices, labels=H_b,
+                                compute_difference=False)
+                        else:
+                            constraints = [
+                                find_constraint(self.model, X[i], h, w,
+                                                compute_difference=False)
+                                for i, h in zip(indices, H_b)]
+                        # sum psi(x, h) and psi(x, h_hat) separately, in the
+                        # same order as SubgradientSSVM does
+                        psi_h = np.zeros(self.model.size_psi)
+                        psi_h_hat = np.zeros(self.model.size_psi)
+                        for i, h, constraint in zip(indices, H_b,
+                                                    constraints):
+                            h_hat, minus_psi_hat, _, loss = constraint
+                            psi = self.model.psi(X[i], h)
+                            slack = max(loss - np.dot(w, psi + minus_psi_hat),
+                                        0)
                             objective += slack
-                            dpsi += delta_psi
+                            psi_h += psi
+                            psi_h_hat -= minus_psi_hat
                             if slack > 0:
                                 positive_slacks += 1
-                        dpsi /= float(len(X_b))
-                        w = self._solve_subgradient(dpsi, n_samples, w)
+                        dpsi = (psi_h - psi_h_hat) / float(len(indices))
+                        w = self._latent_subgradient_step(dpsi, n_samples,
+                                                          w)
 
                 # some statistics
                 objective *= self.C
@@ -226,6 +247,7 @@ class SubgradientLatentSSVM(SubgradientSSVM):
             pass
         self.timestamps_.append(time() - self.timestamps_[0])
         self.objective_curve_.append(self._objective(X, Y))
+        self._stop_pool()
         if self.logger is not None:
             self.logger(self, 'final')
         if self.verbose:
@@ -235,6 +257,29 @@ class SubgradientLatentSSVM(SubgradientSSVM):
                 print("calls to inference: %d" % self.model.inference_calls)
         return self
 
+    def _complete_latent(self, X, Y, indices, w):
+        # latent variables for the ground truth of the samples in indices,
+        # recomputing only those where w moved too much
+        stale = [i for i in indices if self.latent_tol <= 0
+                 or self._H[i] is None
+                 or self._path - self._H_path[i] > self.latent_tol]
+        if self._pool is not None and len(stale) > 1:
+            H_new = self._pool.map(latent, w, stale)
+        else:
+            H_new = [latent(self.model, X[i], Y[i], w) for i in stale]
+        for i, h in zip(stale, H_new):
+            self._H[i] = h
+            self._H_path[i] = self._path
+        return [self._H[i] for i in indices]
+
+    def _latent_subgradient_step(self, dpsi, n_samples, w):
+        if self.latent_tol <= 0:
+            return self._solve_subgradient(dpsi, n_samples, w)
+        w_old = w.copy()
+        w = self._solve_subgradient(dpsi, n_samples, w)
+        self._path += np.linalg.norm(w - w_old)
+        return w
+
     def predict(self, X):
         prediction = SubgradientSSVM.predict(self, X)
         return [self.model.label_from_latent(h) for h in prediction]
@@ -271,11 +316,12 @@ class SubgradientLatentSSVM(SubgradientSSVM):
         return 1. - np.sum(losses) / float(np.sum(max_losses))
 
     def _objective(self, X, Y):
-        constraints = Parallel(
-            n_jobs=self.n_jobs,
-            verbose=self.verbose - 1)(delayed(find_constraint_latent)(
-                self.model, x, y, self.w)
-                for x, y in zip(X, Y))
+        if getattr(self, '_pool', None) is not None:
+            # workers already hold X and Y
+            constraints = self._pool.map(find_constraint_latent, self.w)
+        else:
+            constraints = [find_constraint_latent(self.model, x, y, self.w)
+                           for x, y in zip(X, Y)]
         slacks = zip(*constraints)[2]
         slacks = np.maximum(slacks, 0)
 
@@ -1,11 +1,46 @@
 from time import time
 import numpy as np
 
-from sklearn.externals.joblib import Parallel, delayed, cpu_count
 from sklearn.utils import gen_even_slices, shuffle
 
-from .ssvm import BaseSSVM
+from .ssvm import BaseSSVM, stops_pool
 from ..utils import find_constraint
+from ..utils.weights import LazyWeights
+
+
+def _hogwild_pass(model, X, Y, shared, indices, init, C, n_samples,
+                  learning_rate, decay_exponent, decay_t0, momentum,
+                  averaging):
+    # runs in a worker process and updates the shared w without locking.
+    # Returns the sum of the weighted iterates, to merge the averages of
+    # the workers.
+    w, t = shared['w'], shared['t']
+    grad_old = np.zeros(len(w))
+    w_sum, weight_sum = np.zeros(len(w)), 0.
+    objective, positive_slacks, Y_hat = 0, 0, []
+    for i, y_init in zip(indices, init):
+        w_read = w.copy()
+        y_hat, delta_psi, slack, loss = find_constraint(
+            model, X[i], Y[i], w_read, init=y_init)
+        Y_hat.append(y_hat)
+        objective += slack
+        if slack > 0:
+            positive_slacks += 1
+        step = t[0]
+        t[0] += 1
+        if decay_exponent == 0:
+            effective_lr = learning_rate
+        else:
+            effective_lr = (learning_rate / (step + decay_t0)
+                            ** decay_exponent)
+        grad = delta_psi - w_read / (C * n_samples)
+        grad_old = (1 - momentum) * grad + momentum * grad_old
+        w += effective_lr * grad_old
+        if averaging in ['linear', 'squared']:
+            weight = (step + 1.) ** (1 if averaging == 'linear' else 2)
+            w_sum += weight * w
+            weight_sum += weight
+    return objective, positive_slacks, Y_hat, w_sum, weight_sum
 
 
 class SubgradientSSVM(BaseSSVM):
@@ -16,7 +51,8 @@ class SubgradientSSVM(BaseSSVM):
     It is also possible to use the adaptive learning rate found by AdaGrad.
 
     This class implements online subgradient descent. If n_jobs != 1,
-    small batches of size n_jobs are used to exploit parallel inference.
+    small batches of size n_jobs are used to exploit parallel inference,
+    or, with asynchronous=True, each worker does online updates.
     If inference is fast, use n_jobs=1.
 
     Parameters
@@ -85,6 +121,22 @@ class SubgradientSSVM(BaseSSVM):
     shuffle : bool, default=False
         Whether to shuffle the dataset in each iteration.
 
+    monitoring : string, default='full'
+        How the primal objective in ``objective_curve_`` is computed after
+        each pass. 'full' runs inference on all samples with the current
+        parameters. 'estimate' uses the slacks found during the pass, which
+        costs nothing, but the slacks were computed with the parameters
+        before each update. The final objective is always computed with a
+        full pass.
+
+    asynchronous : bool, default=False
+        Only used if n_jobs != 1. If True, each worker process runs online
+        subgradient descent on its share of the samples, applying the steps
+        to weights in shared memory without locking (Hogwild). Each worker
+        keeps its own momentum, and the averages of the workers are merged
+        after each pass. Steps can be computed with weights that other
+        workers changed in the meantime.
+
     Attributes
     ----------
     w : nd-array, shape=(model.size_psi,)
@@ -107,12 +159,17 @@ class SubgradientSSVM(BaseSSVM):
     * Shalev-Shwartz, Shai and Singer, Yoram and Srebro, Nathan and Cotter,
         Andrew: Pegasos: Primal estimated sub-gradient solver for svm,
         Mathematical Programming 2011
+
+    * Feng Niu, Benjamin Recht, Christopher Re and Stephen J. Wright:
+        Hogwild!: A Lock-Free Approach to Parallelizing Stochastic Gradient
+        Descent, NIPS 2011
     """
     def __init__(self, model, max_iter=100, C=1.0, verbose=0, momentum=0.0,
                  learning_rate='auto', n_jobs=1,
                  show_loss_every=0, decay_exponent=1,
                  break_on_no_constraints=True, logger=None, batch_size=None,
-                 decay_t0=10, averaging=None, shuffle=False):
+                 decay_t0=10, averaging=None, shuffle=False,
+                 monitoring='full', asynchronous=False):
         BaseSSVM.__init__(self, model, max_iter, C, verbose=verbose,
                           n_jobs=n_jobs, show_loss_every=show_loss_every,
                           logger=logger)
@@ -125,9 +182,13 @@ class SubgradientSSVM(BaseSSVM):
         self.decay_t0 = decay_t0
         self.batch_size = batch_size
         self.shuffle = shuffle
+        self.monitoring = monitoring
+        self.asynchronous = asynchronous
 
     def _solve_subgradient(self, dpsi, n_samples, w):
         """Do a single subgradient step."""
+        if getattr(self, '_weights', None) is not None:
+            return self._solve_subgradient_lazy(dpsi, n_samples, w)
         grad = (dpsi - w / (self.C * n_samples))
 
         self.grad_old = ((1 - self.momentum) * grad
@@ -151,6 +212,42 @@ class SubgradientSSVM(BaseSSVM):
         self.t += 1.
         return w
 
+    def _solve_subgradient_lazy(self, dpsi, n_samples, w):
+        """Do a single subgradient step without momentum.
+
+        Works on self._weights, where shrinking w costs O(1) and the update
+        only touches the non-zero entries of dpsi. The new weights are
+        written to w for the next inference, the average is only computed
+        at the end of each pass, see _sync_weights.
+        """
+        if self.decay_exponent == 0:
+            effective_lr = self.learning_rate_
+        else:
+            effective_lr = (self.learning_rate_
+                            / (self.t + self.decay_t0)
+                            ** self.decay_exponent)
+        self._weights.shrink(1 - effective_lr / (self.C * n_samples))
+        self._weights.add(effective_lr * dpsi)
+
+        if self.averaging == 'linear':
+            self._weights.update_average(2. / (self.t + 2.))
+        elif self.averaging == 'squared':
+            self._weights.update_average(6. * (self.t + 1)
+                                         / ((self.t + 2) * (2 * self.t + 3)))
+        self.t += 1.
+        np.multiply(self._weights.scale, self._weights.v, out=w)
+        return w
+
+    def _sync_weights(self):
+        # make self.w reflect the lazily updated weights
+        if self._weights is None:
+            return
+        if self.averaging in ['linear', 'squared']:
+            self.w = self._weights.w_avg
+        else:
+            self.w = self._weights.w
+
+    @stops_pool
     def fit(self, X, Y, constraints=None, warm_start=False, initialize=True):
         """Learn parameters using subgradient descent.
 
@@ -177,6 +274,9 @@ class SubgradientSSVM(BaseSSVM):
         if initialize:
             self.model.initialize(X, Y)
         print("Training primal subgradient structural SVM")
+        if self.monitoring not in ['full', 'estimate']:
+            raise ValueError("monitoring should be 'full' or 'estimate', got"
+                             " %s." % str(self.monitoring))
         self.grad_old = np.zeros(self.model.size_psi)
         self.w = getattr(self, "w", np.zeros(self.model.size_psi))
         w = self.w.copy()
@@ -189,15 +289,37 @@ class SubgradientSSVM(BaseSSVM):
                 self.learning_rate_ = self.learning_rate
         else:
             self.timestamps_ = (np.array(self.timestamps_) - time()).tolist()
+        self._reset_y_hat_init(len(X), reset=not warm_start)
+        self._weights = None
+        asynchronous = self.asynchronous and self.n_jobs != 1
+        if asynchronous:
+            self._start_pool(X, Y, shared={'w': len(w), 't': 1})
+            # total weight of the iterates in the current average
+            power = 2 if self.averaging == 'squared' else 1
+            self._weight_sum = np.sum(np.arange(1., self.t + 1) ** power)
+        else:
+            self._start_pool(X, Y)
+            if self.momentum == 0:
+                self._weights = LazyWeights(
+                    w, self.w if self.averaging in ['linear', 'squared']
+                    else None)
+        # position of the samples in X, to keep track of the warm starts
+        indices = np.arange(len(X))
         try:
             # catch ctrl+c to stop training
             for iteration in xrange(self.max_iter):
                 if self.shuffle:
-                    X, Y = shuffle(X, Y)
+                    X, Y, indices = shuffle(X, Y, indices)
                 if self.n_jobs == 1:
-                    objective, positive_slacks, w = self._sequential_learning(X, Y, w)
+                    objective, positive_slacks, w = self._sequential_learning(
+                        X, Y, w, indices)
+                elif asynchronous:
+                    objective, positive_slacks, w = self._hogwild_learning(
+                        X, Y, w, indices)
                 else:
-                    objective, positive_slacks, w = self._parallel_learning(X, Y, w)
+                    objective, positive_slacks, w = self._parallel_learning(
+                        X, Y, w, indices)
+                self._sync_weights()
 
                 # some statistics
                 objective = objective * self.C + np.sum(w ** 2) / 2.
@@ -213,7 +335,10 @@ class SubgradientSSVM(BaseSSVM):
                           "objective: %f" %
                           (positive_slacks, objective))
                 self.timestamps_.append(time() - self.timestamps_[0])
-                self.objective_curve_.append(self._objective(X, Y))
+                if self.monitoring == 'estimate':
+                    self.objective_curve_.append(objective)
+                else:
+                    self.objective_curve_.append(self._objective(X, Y))
 
                 if self.verbose > 2:
                     print(self.w)
@@ -228,8 +353,11 @@ class SubgradientSSVM(BaseSSVM):
         if self.verbose:
             print("Computing final objective")
 
+        self._sync_weights()
+        self._weights = None
         self.timestamps_.append(time() - self.timestamps_[0])
         self.objective_curve_.append(self._objective(X, Y))
+        self._stop_pool()
         if self.logger is not None:
             self.logger(self, 'final')
         if self.verbose:
@@ -240,34 +368,25 @@ class SubgradientSSVM(BaseSSVM):
 
         return self
 
-    def _parallel_learning(self, X, Y, w):
+    def _parallel_learning(self, X, Y, w, indices):
         n_samples = len(X)
         objective, positive_slacks = 0, 0
-        verbose = max(0, self.verbose - 3)
         if self.batch_size is not None:
             raise ValueError("If n_jobs != 1, batch_size needs to"
                              "be None")
         # generate batches of size n_jobs
         # to speed up inference
-        if self.n_jobs == -1:
-            n_jobs = cpu_count()
-        else:
-            n_jobs = self.n_jobs
-
-        n_batches = int(np.ceil(float(len(X)) / n_jobs))
+        n_batches = int(np.ceil(float(len(X)) / self._pool.n_jobs))
         slices = gen_even_slices(n_samples, n_batches)
         for batch in slices:
-            X_b = X[batch]
-            Y_b = Y[batch]
-            candidate_constraints = Parallel(
-                n_jobs=self.n_jobs,
-                verbose=verbose)(delayed(find_constraint)(
-                    self.model, x, y, w)
-                    for x, y in zip(X_b, Y_b))
+            indices_b = indices[batch]
+            candidate_constraints = self._pool.map(
+                find_constraint, w, indices_b,
+                init=[self._y_hat_init[i] for i in indices_b])
             dpsi = np.zeros(self.model.size_psi)
-            for x, y, constraint in zip(X_b, Y_b,
-                                        candidate_constraints):
+            for i, constraint in zip(indices_b, candidate_constraints):
                 y_hat, delta_psi, slack, loss = constraint
+                self._set_y_hat_init(i, y_hat)
                 if slack > 0:
                     objective += slack
                     dpsi += delta_psi
@@ -275,14 +394,48 @@ class SubgradientSSVM(BaseSSVM):
             w = self._solve_subgradient(dpsi, n_samples, w)
         return objective, positive_slacks, w
 
-    def _sequential_learning(self, X, Y, w):
+    def _hogwild_learning(self, X, Y, w, indices):
+        if self.batch_size is not None:
+            raise ValueError("If n_jobs != 1, batch_size needs to"
+                             "be None")
+        shared = self._pool.shared
+        shared['w'][:] = w
+        shared['t'][0] = self.t
+        results = self._pool.map_shared(
+            _hogwild_pass, indices,
+            init=[self._y_hat_init[i] for i in indices], C=self.C,
+            n_samples=len(X), learning_rate=self.learning_rate_,
+            decay_exponent=self.decay_exponent, decay_t0=self.decay_t0,
+            momentum=self.momentum, averaging=self.averaging)
+        objective, positive_slacks = 0, 0
+        w_sum, weight_sum = 0, 0
+        for chunk, result in results:
+            objective += result[0]
+            positive_slacks += result[1]
+            for i, y_hat in zip(chunk, result[2]):
+                self._set_y_hat_init(i, y_hat)
+            w_sum += result[3]
+            weight_sum += result[4]
+        w = shared['w'].copy()
+        # concurrent increments of the shared counter can get lost
+        self.t += len(indices)
+        if self.averaging in ['linear', 'squared']:
+            self.w = ((self._weight_sum * self.w + w_sum)
+                      / (self._weight_sum + weight_sum))
+            self._weight_sum += weight_sum
+        else:
+            self.w = w
+        return objective, positive_slacks, w
+
+    def _sequential_learning(self, X, Y, w, indices):
         n_samples = len(X)
         objective, positive_slacks = 0, 0
         if self.batch_size in [None, 1]:
             # online learning
-            for x, y in zip(X, Y):
-                y_hat, delta_psi, slack, loss = \
-                    find_constraint(self.model, x, y, w)
+            for x, y, i in zip(X, Y, indices):
+                y_hat, delta_psi, slack, loss = find_constraint(
+                    self.model, x, y, w, init=self._y_hat_init[i])
+                self._set_y_hat_init(i, y_hat)
                 objective += slack
                 if slack > 0:
                     positive_slacks += 1
@@ -290,15 +443,19 @@ class SubgradientSSVM(BaseSSVM):
         else:
             # mini batch learning
             if self.batch_size == -1:
-                slices = [slice(0, len(X)), None]
+                slices = [slice(0, len(X))]
             else:
                 n_batches = int(np.ceil(float(len(X)) / self.batch_size))
                 slices = gen_even_slices(n_samples, n_batches)
             for batch in slices:
                 X_b = X[batch]
                 Y_b = Y[batch]
+                indices_b = indices[batch]
                 Y_hat = self.model.batch_loss_augmented_inference(
-                    X_b, Y_b, w, relaxed=True)
+                    X_b, Y_b, w, relaxed=True,
+                    init=[self._y_hat_init[i] for i in indices_b])
+                for i, y_hat in zip(indices_b, Y_hat):
+                    self._set_y_hat_init(i, y_hat)
                 delta_psi = (self.model.batch_psi(X_b, Y_b)
                              - self.model.batch_psi(X_b, Y_hat))
                 loss = np.sum(self.model.batch_loss(Y_b, Y_hat))
@@ -1,5 +1,7 @@
 import numpy as np
 
+from ..utils.inference import loss_augmented_inference
+
 
 class StructuredModel(object):
     """Interface definition for Structured Learners.
@@ -85,14 +87,18 @@ class StructuredModel(object):
             return np.sum(self.class_weight[y] * result)
         return np.sum(result)
 
-    def loss_augmented_inference(self, x, y, w, relaxed=None):
+    def loss_augmented_inference(self, x, y, w, relaxed=None, init=None):
         print("FALLBACK no loss augmented inference found")
         return self.inference(x, w)
 
-    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None):
+    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None,
+                                       init=None):
         # default implementation of batch loss augmented inference
-        return [self.loss_augmented_inference(x, y, w, relaxed=relaxed)
-                for x, y in zip(X, Y)]
+        if init is None:
+            init = [None] * len(X)
+        return [loss_augmented_inference(self, x, y, w, relaxed=relaxed,
+                                         init=y_init)
+                for x, y, y_init in zip(X, Y, init)]
 
     def _set_class_weight(self):
         if not hasattr(self, 'size_psi'):
@@ -37,8 +37,10 @@ class ChainCRF(GraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for exact Viterbi decoding.
 
-        If None, ad3 is used if installed, otherwise lp.
+        If None, 'max-product' is used, which is exact and does not require
+        any additional packages.
 
     class_weight : None, or array-like
         Class weights. If an array-like is passed, it must have length
@@ -51,6 +53,8 @@ class ChainCRF(GraphCRF):
     """
     def __init__(self, n_states=None, n_features=None, inference_method=None,
                  class_weight=None, directed=True):
+        if inference_method is None:
+            inference_method = 'max-product'
         GraphCRF.__init__(self, n_states=n_states, n_features=n_features,
                           inference_method=inference_method,
                           class_weight=class_weight, directed=directed)
@@ -1,7 +1,8 @@
 import numpy as np
 
 from .base import StructuredModel
-from ..inference import inference_dispatch, get_installed
+from ..inference import (inference_dispatch, batch_inference_dispatch,
+                         get_installed)
 from .utils import loss_augment_unaries
 
 
@@ -12,7 +13,7 @@ class CRF(StructuredModel):
         self.n_states = n_states
         if inference_method is None:
             # get first in list that is installed
-            inference_method = get_installed(['ad3', 'lp'])[0]
+            inference_method = get_installed(['ad3', 'max-product'])[0]
         self.inference_method = inference_method
         self.inference_calls = 0
         self.n_features = n_features
@@ -52,8 +53,25 @@ class CRF(StructuredModel):
                              " got %s instead."
                              % (self.n_features, features.shape[1]))
 
+    def _loss_augment_unaries(self, unary_potentials, y):
+        # add the (class weighted) hamming loss to the unary potentials inplace
+        loss_augment_unaries(unary_potentials, np.asarray(y), self.class_weight)
+
+    def _round_init(self, init, n_nodes):
+        # flat integer labeling to start inference from
+        if init is None:
+            return None
+        if isinstance(init, tuple):
+            # relaxed solution
+            init = np.argmax(init[0], axis=-1)
+        init = np.ravel(init)
+        if init.size != n_nodes:
+            # not a labeling of this instance
+            return None
+        return init
+
     def loss_augmented_inference(self, x, y, w, relaxed=False,
-                                 return_energy=False):
+                                 return_energy=False, init=None):
         """Loss-augmented Inference for x relative to y using parameters w.
 
         Finds (approximately)
@@ -85,6 +103,11 @@ class CRF(StructuredModel):
         return_energy : bool, default=False
             Whether to return the energy of the solution (x, y) that was found.
 
+        init : ndarray or tuple, optional
+            Labeling to warm-start inference from, usually the result of the
+            previous call for the same instance. Relaxed solutions are
+            rounded.
+
         Returns
         -------
         y_pred : ndarray or tuple
@@ -103,11 +126,13 @@ class CRF(StructuredModel):
         unary_potentials = self._get_unary_potentials(x, w)
         pairwise_potentials = self._get_pairwise_potentials(x, w)
         edges = self._get_edges(x)
-        loss_augment_unaries(unary_potentials, np.asarray(y), self.class_weight)
+        self._loss_augment_unaries(unary_potentials, y)
 
         return inference_dispatch(unary_potentials, pairwise_potentials, edges,
                                   self.inference_method, relaxed=relaxed,
-                                  return_energy=return_energy)
+                                  return_energy=return_energy,
+                                  init=self._round_init(
+                                      init, len(unary_potentials)))
 
     def inference(self, x, w, relaxed=False, return_energy=False):
         """Inference for x using parameters w.
@@ -159,3 +184,78 @@ class CRF(StructuredModel):
         return inference_dispatch(unary_potentials, pairwise_potentials, edges,
                                   self.inference_method, relaxed=relaxed,
                                   return_energy=return_energy)
+
+    def _batch_dispatch(self, X, w, Y=None, relaxed=False, init=None):
+        self._check_size_w(w)
+        self.inference_calls += len(X)
+        unaries, pairwise, edges = [], [], []
+        for i, x in enumerate(X):
+            unary_potentials = self._get_unary_potentials(x, w)
+            if Y is not None:
+                self._loss_augment_unaries(unary_potentials, Y[i])
+            unaries.append(unary_potentials)
+            pairwise.append(self._get_pairwise_potentials(x, w))
+            edges.append(self._get_edges(x))
+        if init is not None:
+            init = [self._round_init(y_init, len(unary))
+                    for y_init, unary in zip(init, unaries)]
+        return batch_inference_dispatch(unaries, pairwise, edges,
+                                        self.inference_method,
+                                        relaxed=relaxed, init=init)
+
+    def batch_inference(self, X, w, relaxed=False):
+        """Inference for a list of instances using parameters w.
+
+        With 'max-product', all instances without cycles are packed into a
+        single graph with one connected component per instance, which is
+        solved with a single call to the inference method. The other
+        instances are solved one by one. See ``batch_inference_dispatch``.
+
+        Parameters
+        ----------
+        X : list of tuples
+            Instances, see ``inference``.
+
+        w : ndarray, shape=(size_psi,)
+            Parameters for the CRF energy function.
+
+        relaxed : bool, default=False
+            Whether relaxed inference should be performed.
+
+        Returns
+        -------
+        Y_pred : list
+            Result of ``inference`` for each instance.
+        """
+        return self._batch_dispatch(X, w, relaxed=relaxed)
+
+    def batch_loss_augmented_inference(self, X, Y, w, relaxed=False,
+                                       init=None):
+        """Loss-augmented inference for a list of instances.
+
+        Like ``batch_inference``, instances are packed into a single call to
+        the inference method if possible.
+
+        Parameters
+        ----------
+        X : list of tuples
+            Instances, see ``loss_augmented_inference``.
+
+        Y : list of ndarray
+            Ground truth labelings relative to which the loss is measured.
+
+        w : ndarray, shape=(size_psi,)
+            Parameters for the CRF energy function.
+
+        relaxed : bool, default=False
+            Whether relaxed inference should be performed.
+
+        init : list, optional
+            Labelings to warm-start inference from, one per instance.
+
+        Returns
+        -------
+        Y_pred : list
+            Result of ``loss_augmented_inference`` for each instance.
+        """
+        return self._batch_dispatch(X, w, Y=Y, relaxed=relaxed, init=init)
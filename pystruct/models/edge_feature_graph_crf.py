@@ -42,6 +42,10 @@ class EdgeFeatureGraphCRF(GraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing, which is exact
+              on trees and forests. On graphs with cycles TRW-S is used,
+              unless another method is given, e.g.
+              ``('max-product', {'fallback': 'ad3'})``.
 
     class_weight : None, or array-like
         Class weights. If an array-like is passed, it must have length
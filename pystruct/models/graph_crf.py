@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 
 from .crf import CRF
 from ..utils import expand_sym, compress_sym
@@ -68,8 +69,12 @@ class GraphCRF(CRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing, which is exact
+              on trees and forests. On graphs with cycles TRW-S is used,
+              unless another method is given, e.g.
+              ``('max-product', {'fallback': 'ad3'})``.
 
-        If None, ad3 is used if installed, otherwise lp.
+        If None, ad3 is used if installed, otherwise max-product.
 
     class_weight : None, or array-like
         Class weights. If an array-like is passed, it must have length
@@ -182,22 +187,23 @@ class GraphCRF(CRF):
             # y is result of relaxation, tuple of unary and pairwise marginals
             unary_marginals, pw = y
             unary_marginals = unary_marginals.reshape(n_nodes, self.n_states)
+            unaries_acc = np.dot(unary_marginals.T, features)
             # accumulate pairwise
             pw = pw.reshape(-1, self.n_states, self.n_states).sum(axis=0)
         else:
             y = y.reshape(n_nodes)
-            gx = np.ogrid[:n_nodes]
+            # sum the features of the nodes in each state, using a sparse
+            # one hot encoding of y
+            onehot = sparse.csr_matrix(
+                (np.ones(n_nodes, dtype=features.dtype),
+                 (y, np.arange(n_nodes))), shape=(self.n_states, n_nodes))
+            unaries_acc = onehot * features
+
+            # count the pairs of states along the edges
+            pw = np.bincount(y[edges[:, 0]] * self.n_states + y[edges[:, 1]],
+                             minlength=self.n_states ** 2)
+            pw = pw.reshape(self.n_states, self.n_states)
 
-            #make one hot encoding
-            unary_marginals = np.zeros((n_nodes, self.n_states), dtype=np.int)
-            gx = np.ogrid[:n_nodes]
-            unary_marginals[gx, y] = 1
-
-            ##accumulated pairwise
-            pw = np.dot(unary_marginals[edges[:, 0]].T,
-                        unary_marginals[edges[:, 1]])
-
-        unaries_acc = np.dot(unary_marginals.T, features)
         if self.directed:
             pw = pw.ravel()
         else:
@@ -28,6 +28,7 @@ class GridCRF(GraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing (TRW-S).
 
     neighborhood : int, default=4
         Neighborhood defining connection for each variable in the grid.
@@ -64,12 +65,25 @@ class GridCRF(GraphCRF):
         return self._reshape_y(y, x.shape, return_energy)
 
     def loss_augmented_inference(self, x, y, w, relaxed=False,
-                                 return_energy=False):
+                                 return_energy=False, init=None):
         y_hat = GraphCRF.loss_augmented_inference(self, x, y.ravel(), w,
                                                   relaxed=relaxed,
-                                                  return_energy=return_energy)
+                                                  return_energy=return_energy,
+                                                  init=init)
         return self._reshape_y(y_hat, x.shape, return_energy)
 
+    def batch_inference(self, X, w, relaxed=False):
+        Y_hat = GraphCRF.batch_inference(self, X, w, relaxed=relaxed)
+        return [self._reshape_y(y_hat, x.shape, False)
+                for x, y_hat in zip(X, Y_hat)]
+
+    def batch_loss_augmented_inference(self, X, Y, w, relaxed=False,
+                                       init=None):
+        Y_hat = GraphCRF.batch_loss_augmented_inference(
+            self, X, [y.ravel() for y in Y], w, relaxed=relaxed, init=init)
+        return [self._reshape_y(y_hat, x.shape, False)
+                for x, y_hat in zip(X, Y_hat)]
+
     def continuous_loss(self, y, y_hat):
         # continuous version of the loss
         # y_hat is the result of linear programming
@@ -104,6 +118,7 @@ class DirectionalGridCRF(GridCRF, EdgeFeatureGraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing (TRW-S).
 
     neighborhood : int, default=4
         Neighborhood defining connection for each variable in the grid.
@@ -87,6 +87,7 @@ class LatentGraphCRF(GraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing (TRW-S).
 
     """
     def __init__(self, n_labels=None, n_features=None, n_states_per_label=2,
@@ -148,24 +149,13 @@ class LatentGraphCRF(GraphCRF):
         return kmeans_init(features, Y, edges, n_labels=self.n_labels,
                            n_states_per_label=self.n_states_per_label)
 
-    def loss_augmented_inference(self, x, h, w, relaxed=False,
-                                 return_energy=False):
-        self.inference_calls += 1
-        self._check_size_w(w)
-        unary_potentials = self._get_unary_potentials(x, w)
-        pairwise_potentials = self._get_pairwise_potentials(x, w)
-        edges = self._get_edges(x)
-        # do loss-augmentation
+    def _loss_augment_unaries(self, unary_potentials, h):
         for l in np.arange(self.n_states):
             # for each class, decrement features
             # for loss-agumention
             unary_potentials[self.label_from_latent(h)
                              != self.label_from_latent(l), l] += 1.
 
-        return inference_dispatch(unary_potentials, pairwise_potentials, edges,
-                                  self.inference_method, relaxed=relaxed,
-                                  return_energy=return_energy)
-
     def latent(self, x, y, w):
         unary_potentials = self._get_unary_potentials(x, w)
         # forbid h that is incompoatible with y
@@ -33,9 +33,10 @@ class LatentGridCRF(GridCRF, LatentGraphCRF):
         return np.array(H).reshape(Y.shape)
 
     def loss_augmented_inference(self, x, h, w, relaxed=False,
-                                 return_energy=False):
+                                 return_energy=False, init=None):
         h = LatentGraphCRF.loss_augmented_inference(self, x, h.ravel(), w,
-                                                    relaxed, return_energy)
+                                                    relaxed, return_energy,
+                                                    init)
         return self._reshape_y(h, x.shape, return_energy)
 
     def latent(self, x, y, w):
@@ -85,7 +86,7 @@ class LatentDirectionalGridCRF(DirectionalGridCRF, LatentGridCRF):
                         symmetric=False)
         return np.array(H).reshape(Y.shape)
 
-    def loss_augmented_inference(self, x, h, w, relaxed=False):
+    def loss_augmented_inference(self, x, h, w, relaxed=False, init=None):
         h = LatentGridCRF.loss_augmented_inference(self, x, h, w,
-                                                   relaxed=relaxed)
+                                                   relaxed=relaxed, init=init)
         return h
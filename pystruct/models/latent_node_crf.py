@@ -92,6 +92,7 @@ class LatentNodeCRF(GraphCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing (TRW-S).
 
     class_weight : None, or array-like
         Class weights. If an array-like is passed, it must have length
@@ -207,14 +208,7 @@ class LatentNodeCRF(GraphCRF):
         unaries[n_visible:, :self.n_labels] = -1e2 * max_entry
         return unaries
 
-    def loss_augmented_inference(self, x, h, w, relaxed=False,
-                                 return_energy=False):
-        self.inference_calls += 1
-        self._check_size_w(w)
-        unary_potentials = self._get_unary_potentials(x, w)
-        pairwise_potentials = self._get_pairwise_potentials(x, w)
-        edges = self._get_edges(x)
-        # do loss-augmentation
+    def _loss_augment_unaries(self, unary_potentials, h):
         for l in np.arange(self.n_states):
             # for each class, decrement features
             # for loss-agumention
@@ -222,10 +216,6 @@ class LatentNodeCRF(GraphCRF):
             unary_potentials[inds, l] += self.class_weight[
                 self.label_from_latent(h)][inds]
 
-        return inference_dispatch(unary_potentials, pairwise_potentials, edges,
-                                  self.inference_method, relaxed=relaxed,
-                                  return_energy=return_energy)
-
     def latent(self, x, y, w):
         unary_potentials = self._get_unary_potentials(x, w)
         # clamp observed nodes by modifying unary potentials
@@ -356,6 +346,7 @@ class EdgeFeatureLatentNodeCRF(LatentNodeCRF):
             - 'dai' for LibDAI bindings (which has another parameter).
             - 'lp' for Linear Programming relaxation using GLPK.
             - 'ad3' for AD3 dual decomposition.
+            - 'max-product' for max-product message passing (TRW-S).
 
     class_weight : None, or array-like
         Class weights. If an array-like is passed, it must have length
@@ -505,25 +496,6 @@ class EdgeFeatureLatentNodeCRF(LatentNodeCRF):
         unaries[n_visible:, :self.n_labels] = -1e2 * max_entry
         return unaries
 
-    def loss_augmented_inference(self, x, h, w, relaxed=False,
-                                 return_energy=False):
-        self.inference_calls += 1
-        self._check_size_w(w)
-        unary_potentials = self._get_unary_potentials(x, w)
-        pairwise_potentials = self._get_pairwise_potentials(x, w)
-        edges = self._get_edges(x)
-        # do loss-augmentation
-        for l in np.arange(self.n_states):
-            # for each class, decrement features
-            # for loss-agumention
-            inds = np.where(self.label_from_latent(h) != l)[0]
-            unary_potentials[inds, l] += self.class_weight[
-                self.label_from_latent(h)][inds]
-
-        return inference_dispatch(unary_potentials, pairwise_potentials, edges,
-                                  self.inference_method, relaxed=relaxed,
-                                  return_energy=return_energy)
-
     def latent(self, x, y, w):
         unary_potentials = self._get_unary_potentials(x, w)
         # clamp observed nodes by modifying unary potentials
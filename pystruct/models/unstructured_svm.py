@@ -94,7 +94,7 @@ class BinaryClf(StructuredModel):
     def batch_inference(self, X, w):
         return 2 * (np.dot(X, w) >= 0) - 1
 
-    def loss_augmented_inference(self, x, y, w, relaxed=None):
+    def loss_augmented_inference(self, x, y, w, relaxed=None, init=None):
         """Loss-augmented inference for x and y using parameters w.
 
         Minimizes over y_hat:
@@ -122,7 +122,8 @@ class BinaryClf(StructuredModel):
         self.inference_calls += 1
         return np.sign(np.dot(x, w) - y)
 
-    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None):
+    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None,
+                                       init=None):
         return np.sign(np.dot(X, w) - Y)
 
     def batch_loss(self, Y, Y_hat):
@@ -277,7 +278,7 @@ class MultiClassClf(StructuredModel):
         return np.argmax(scores)
 
     def loss_augmented_inference(self, x, y, w, relaxed=None,
-                                 return_energy=False):
+                                 return_energy=False, init=None):
         """Loss-augmented inference for x and y using parameters w.
 
         Minimizes over y_hat:
@@ -311,7 +312,8 @@ class MultiClassClf(StructuredModel):
             return np.argmax(scores), np.max(scores)
         return np.argmax(scores)
 
-    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None):
+    def batch_loss_augmented_inference(self, X, Y, w, relaxed=None,
+                                       init=None):
         scores = np.dot(X, w.reshape(self.n_states, -1).T)
         other_classes = (np.arange(self.n_states) != Y[:, np.newaxis])
         if self.rescale_C or self.uniform_class_weight:
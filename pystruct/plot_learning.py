@@ -24,7 +24,8 @@ def plot_learning(ssvm, time=True):
     It plots the primal and cutting plane objective (if applicable) and also
     the target loss on the training set against training time.
     For one-slack SSVMs with constraint caching, cached constraints are also
-    contrasted against inference runs.
+    contrasted against inference runs. For Frank-Wolfe SSVMs with an
+    inference cache, the number of cache hits and inference runs is plotted.
 
     Parameters
     -----------
@@ -51,12 +52,15 @@ def plot_learning(ssvm, time=True):
         print("Gap: %f" %
               (np.array(ssvm.primal_objective_curve_)[inference_run][-1] -
                ssvm.objective_curve_[-1]))
-    if hasattr(ssvm, "loss_curve_"):
-        n_plots = 2
-        fig, axes = plt.subplots(1, 2)
-    else:
-        n_plots = 1
-        fig, axes = plt.subplots(1, 1)
+    cache_hits = None
+    if np.sum(getattr(ssvm, 'cache_hits_', [])):
+        cache_hits = np.array(ssvm.cache_hits_)
+        cache_misses = np.array(ssvm.cache_misses_)
+        print("Cache hits: %d, inference runs: %d" % (np.sum(cache_hits),
+                                                      np.sum(cache_misses)))
+    n_plots = 1 + hasattr(ssvm, "loss_curve_") + (cache_hits is not None)
+    fig, axes = plt.subplots(1, n_plots)
+    if n_plots == 1:
         axes = [axes]
     if time and hasattr(ssvm, 'timestamps_'):
         print("loading timestamps")
@@ -81,7 +85,7 @@ def plot_learning(ssvm, time=True):
                      np.array(ssvm.primal_objective_curve_)[inference_run],
                      'o', label="primal")
     axes[0].legend()
-    if n_plots == 2:
+    if hasattr(ssvm, "loss_curve_"):
         if time and hasattr(ssvm, "timestamps_"):
             axes[1].set_xlabel('training time (min)')
         else:
@@ -94,6 +98,17 @@ def plot_learning(ssvm, time=True):
 
         axes[1].set_title("Training Error")
         axes[1].set_yscale('log')
+    if cache_hits is not None:
+        ax = axes[-1]
+        if time and hasattr(ssvm, "timestamps_"):
+            ax.set_xlabel('training time (min)')
+        else:
+            ax.set_xlabel('QP iterations')
+        ax.plot(inds[:len(cache_hits)], cache_hits, label="cache hits")
+        ax.plot(inds[:len(cache_misses)], cache_misses,
+                label="inference runs")
+        ax.set_title("Cache")
+        ax.legend()
     plt.show()
 
 
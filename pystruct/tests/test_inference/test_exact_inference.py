@@ -1,7 +1,15 @@
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import (assert_array_equal, assert_almost_equal,
+                           assert_equal)
+from nose.tools import assert_true, assert_false
 
-from pystruct.inference import get_installed, inference_dispatch
+from pystruct.inference import (get_installed, inference_dispatch,
+                                batch_inference_dispatch, compute_energy,
+                                batch_compute_energy, uses_init)
+from pystruct.inference.maxprod import color_graph
+from pystruct.inference.linear_programming import lp_general_graph
+from pystruct.inference.inference_methods import _validate_params
+from pystruct.utils import make_grid_edges
 
 
 def test_chain():
@@ -39,3 +47,238 @@ def test_chain():
                 y = inference_dispatch(unary_potentials, pairwise_potentials,
                                        chain, alg)
                 assert_array_equal(y, y_lp)
+
+
+def test_max_product_chain():
+    # max-product is exact on chains, compare against LP
+    rnd = np.random.RandomState(0)
+    n_states = 3
+    n_nodes = 10
+    chain = np.c_[np.arange(n_nodes - 1), np.arange(1, n_nodes)]
+    for i in xrange(10):
+        unary_potentials = rnd.normal(size=(n_nodes, n_states))
+        for pairwise_potentials in [rnd.normal(size=(n_states, n_states)),
+                                    rnd.normal(size=(n_nodes - 1, n_states,
+                                                     n_states))]:
+            y_lp = inference_dispatch(unary_potentials, pairwise_potentials,
+                                      chain, 'lp')
+            y, energy = inference_dispatch(unary_potentials,
+                                           pairwise_potentials, chain,
+                                           'max-product', return_energy=True)
+            assert_array_equal(y, y_lp)
+            assert_almost_equal(energy, compute_energy(unary_potentials,
+                                                       pairwise_potentials,
+                                                       chain, y))
+
+
+def test_max_product_tree():
+    # max-product is exact on forests, compare against LP
+    rnd = np.random.RandomState(0)
+    n_states = 3
+    n_nodes = 20
+    for i in xrange(10):
+        # random tree: connect every node to an earlier one, then
+        # drop some edges to get a forest, and shuffle edge directions
+        edges = np.c_[[rnd.randint(j) for j in xrange(1, n_nodes)],
+                      np.arange(1, n_nodes)]
+        edges = edges[rnd.permutation(len(edges))[:n_nodes - 1 - i]]
+        flip = rnd.uniform(size=len(edges)) > .5
+        edges[flip] = edges[flip, ::-1]
+        unary_potentials = rnd.normal(size=(n_nodes, n_states))
+        for pairwise_potentials in [rnd.normal(size=(n_states, n_states)),
+                                    rnd.normal(size=(len(edges), n_states,
+                                                     n_states))]:
+            y_lp = inference_dispatch(unary_potentials, pairwise_potentials,
+                                      edges, 'lp')
+            y, energy = inference_dispatch(unary_potentials,
+                                           pairwise_potentials, edges,
+                                           'max-product', return_energy=True)
+            assert_array_equal(y, y_lp)
+            assert_almost_equal(energy, compute_energy(unary_potentials,
+                                                       pairwise_potentials,
+                                                       edges, y))
+
+
+def test_max_product_fallback():
+    # graphs with cycles are passed on to the fallback method
+    rnd = np.random.RandomState(0)
+    edges = np.array([[0, 1], [1, 2], [2, 0], [2, 3]])
+    unary_potentials = rnd.normal(size=(4, 3))
+    pairwise_potentials = rnd.normal(size=(3, 3))
+    y_lp = inference_dispatch(unary_potentials, pairwise_potentials, edges,
+                              'lp')
+    y = inference_dispatch(unary_potentials, pairwise_potentials, edges,
+                           ('max-product', {'fallback': 'lp'}))
+    assert_array_equal(y, y_lp)
+
+
+def test_color_graph():
+    # no edge connects two vertices with the same color
+    x = np.zeros((7, 8))
+    for neighborhood in [4, 8]:
+        edges = make_grid_edges(x, neighborhood=neighborhood)
+        colors = color_graph(edges, x.size)
+        assert_true(np.all(colors >= 0))
+        assert_true(np.all(colors[edges[:, 0]] != colors[edges[:, 1]]))
+
+
+def test_max_product_loopy_submodular():
+    # binary submodular problems are solved exactly by TRW-S, loopy BP should
+    # at least not be worse than the unaries
+    rnd = np.random.RandomState(0)
+    x = np.zeros((6, 6))
+    edges = make_grid_edges(x)
+    pairwise_potentials = np.array([[1., 0], [0, 1.]])
+    for i in xrange(5):
+        unary_potentials = rnd.normal(size=(x.size, 2))
+        y_lp = inference_dispatch(unary_potentials, pairwise_potentials,
+                                  edges, 'lp')
+        energy_lp = compute_energy(unary_potentials, pairwise_potentials,
+                                   edges, y_lp)
+        y_trw, energy = inference_dispatch(
+            unary_potentials, pairwise_potentials, edges,
+            ('max-product', {'alg': 'trw'}), return_energy=True)
+        assert_almost_equal(energy, energy_lp)
+        y_bp = inference_dispatch(unary_potentials, pairwise_potentials,
+                                  edges, ('max-product', {'alg': 'bp'}))
+        y_unaries = np.argmax(unary_potentials, axis=1)
+        assert_true(compute_energy(unary_potentials, pairwise_potentials,
+                                   edges, y_bp)
+                    >= compute_energy(unary_potentials, pairwise_potentials,
+                                      edges, y_unaries))
+
+
+def test_max_product_init():
+    # on loopy graphs, a warm start is never worse than the initialization
+    rnd = np.random.RandomState(0)
+    edges = make_grid_edges(np.zeros((5, 5)))
+    for i in xrange(5):
+        unary_potentials = rnd.normal(size=(25, 3))
+        pairwise_potentials = rnd.normal(size=(3, 3))
+        y_init = inference_dispatch(unary_potentials, pairwise_potentials,
+                                    edges, 'lp')
+        for alg in ['bp', 'trw']:
+            y_mp = inference_dispatch(unary_potentials, pairwise_potentials,
+                                      edges, ('max-product', {'alg': alg}),
+                                      init=y_init)
+            assert_true(compute_energy(unary_potentials,
+                                       pairwise_potentials, edges, y_mp)
+                        >= compute_energy(unary_potentials,
+                                          pairwise_potentials, edges,
+                                          y_init))
+
+
+def test_uses_init():
+    assert_true(uses_init('max-product'))
+    assert_true(uses_init(('max-product', {'alg': 'bp'})))
+    assert_true(uses_init('ogm'))
+    assert_false(uses_init('qpbo'))
+    assert_false(uses_init('lp'))
+    assert_false(uses_init(('max-product', {'fallback': 'lp'})))
+    assert_false(uses_init(None))
+
+
+def test_batch_inference_mixed_graphs():
+    # the result for each problem is the same as when solving it alone, even
+    # if problems with and without cycles are solved together
+    rnd = np.random.RandomState(0)
+    chain = np.c_[np.arange(5), np.arange(1, 6)]
+    grid = make_grid_edges(np.zeros((4, 4)))
+    edges = [chain, grid, chain, grid, grid]
+    for i in xrange(10):
+        unaries = [rnd.normal(size=(np.max(e) + 1, 3)) for e in edges]
+        pairwise = [rnd.normal(size=(3, 3)) for e in edges]
+        for inference_method in [('max-product', {'fallback': 'unary'}),
+                                 ('max-product', {'alg': 'bp'}),
+                                 'max-product']:
+            Y = batch_inference_dispatch(unaries, pairwise, edges,
+                                         inference_method)
+            for y, unary, pw, e in zip(Y, unaries, pairwise, edges):
+                assert_array_equal(y, inference_dispatch(unary, pw, e,
+                                                         inference_method))
+
+    # energies are returned per problem
+    Y = batch_inference_dispatch(unaries, pairwise, edges, 'max-product',
+                                 return_energy=True)
+    for (y, energy), unary, pw, e in zip(Y, unaries, pairwise, edges):
+        assert_equal(y.shape, (len(unary),))
+        assert_almost_equal(energy, compute_energy(unary, pw, e, y))
+
+    # an initialization is never worse than the result on the grids, and
+    # ignored on the chains, which are solved exactly
+    inference_method = ('max-product', {'alg': 'bp', 'max_iter': 1})
+    init = [inference_dispatch(unary, pw, e, 'lp') if e is grid
+            else rnd.randint(3, size=len(unary))
+            for unary, pw, e in zip(unaries, pairwise, edges)]
+    Y = batch_inference_dispatch(unaries, pairwise, edges, inference_method)
+    Y_init = batch_inference_dispatch(unaries, pairwise, edges,
+                                      inference_method, init=init)
+    for y, y_init, y_start, unary, pw, e in zip(Y, Y_init, init, unaries,
+                                                pairwise, edges):
+        if e is grid:
+            assert_true(compute_energy(unary, pw, e, y_init)
+                        >= compute_energy(unary, pw, e, y_start))
+        else:
+            assert_array_equal(y_init, y)
+
+
+def test_lp_constraint_cache():
+    # repeated calls on the same graph reuse the constraints, which must not
+    # get mixed up between different numbers of states.
+    rnd = np.random.RandomState(0)
+    edges = np.c_[np.arange(5), np.arange(1, 6)]
+    for n_states in [2, 3, 2, 3]:
+        unaries = rnd.normal(size=(6, n_states))
+        edge_weights = rnd.normal(size=(5, n_states, n_states))
+        unary_marginals, pairwise_marginals, energy = lp_general_graph(
+            -unaries, edges, -edge_weights)
+        # LP is tight on chains
+        y = np.argmax(unary_marginals, axis=1)
+        y_chain = inference_dispatch(unaries, edge_weights, edges,
+                                     'max-product')
+        assert_array_equal(y, y_chain)
+        assert_almost_equal(-energy,
+                            compute_energy(unaries, edge_weights, edges, y),
+                            decimal=4)
+
+
+def test_shared_pairwise():
+    # a single pairwise matrix is shared between edges without copying,
+    # and gives the same results as one copy per edge
+    rnd = np.random.RandomState(0)
+    edges = make_grid_edges(np.zeros((4, 4)))
+    unary_potentials = rnd.normal(size=(16, 3))
+    pairwise_potentials = rnd.normal(size=(3, 3))
+    n_states, shared = _validate_params(unary_potentials,
+                                        pairwise_potentials, edges)
+    assert_equal(shared.shape, (len(edges), 3, 3))
+    assert_true(np.may_share_memory(shared, pairwise_potentials))
+    assert_false(shared.flags.writeable)
+    repeated = np.repeat(pairwise_potentials[np.newaxis], len(edges), axis=0)
+    for inference_method in get_installed():
+        y_shared = inference_dispatch(unary_potentials, pairwise_potentials,
+                                      edges, inference_method)
+        y_repeated = inference_dispatch(unary_potentials, repeated, edges,
+                                        inference_method)
+        assert_array_equal(y_shared, y_repeated)
+
+
+def test_batch_compute_energy():
+    rnd = np.random.RandomState(0)
+    edges = make_grid_edges(np.zeros((4, 5)))
+    unary_potentials = rnd.normal(size=(20, 3))
+    for pairwise_potentials in [rnd.normal(size=(3, 3)),
+                                rnd.normal(size=(len(edges), 3, 3))]:
+        labelings = rnd.randint(3, size=(6, 20))
+        energies = batch_compute_energy(unary_potentials, pairwise_potentials,
+                                        edges, labelings)
+        assert_equal(energies.shape, (6,))
+        for y, energy in zip(labelings, energies):
+            pairwise = np.broadcast_arrays(
+                pairwise_potentials, np.zeros((len(edges), 1, 1)))[0]
+            expected = np.sum(unary_potentials[np.arange(20), y])
+            for edge, pw in zip(edges, pairwise):
+                expected += pw[y[edge[0]], y[edge[1]]]
+            assert_almost_equal(energy, expected)
+            assert_almost_equal(compute_energy(
+                unary_potentials, pairwise_potentials, edges, y), expected)
@@ -1,8 +1,8 @@
 from tempfile import mkstemp
 
 import numpy as np
-from numpy.testing import assert_array_equal
-from nose.tools import assert_less
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from nose.tools import assert_less, assert_greater, assert_equal, assert_true
 
 from sklearn.datasets import load_iris
 
@@ -10,6 +10,7 @@ from pystruct.models import GridCRF, GraphCRF
 from pystruct.datasets import generate_blocks_multinomial
 from pystruct.learners import FrankWolfeSSVM
 from pystruct.utils import SaveLogger, train_test_split
+from pystruct.inference import get_installed
 
 
 def test_multinomial_blocks_frankwolfe():
@@ -30,6 +31,31 @@ def test_multinomial_blocks_frankwolfe_batch():
     assert_array_equal(Y, Y_pred)
 
 
+def test_multinomial_blocks_frankwolfe_cache():
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=0.5, seed=0)
+    crf = GridCRF(inference_method=get_installed(["qpbo", "ad3", "lp"])[0])
+    clf = FrankWolfeSSVM(model=crf, C=1, max_iter=50, inference_cache=10,
+                         check_dual_every=5)
+    clf.fit(X, Y)
+    Y_pred = clf.predict(X)
+    assert_array_equal(Y, Y_pred)
+    assert_equal(len(clf.cache_hits_), len(clf.objective_curve_))
+    assert_greater(np.sum(clf.cache_hits_), 0)
+    # each step either used the cache or ran inference
+    assert_equal(np.sum(clf.cache_hits_) + np.sum(clf.cache_misses_),
+                 50 * len(X))
+
+
+def test_multinomial_blocks_frankwolfe_gap_sampling():
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=0.5, seed=0)
+    crf = GridCRF(inference_method=get_installed(["qpbo", "ad3", "lp"])[0])
+    clf = FrankWolfeSSVM(model=crf, C=1, max_iter=50, sample_method='gap',
+                         check_dual_every=5, random_state=0)
+    clf.fit(X, Y)
+    Y_pred = clf.predict(X)
+    assert_array_equal(Y, Y_pred)
+
+
 def test_svm_as_crf_pickling_bcfw():
 
     iris = load_iris()
@@ -68,3 +94,49 @@ def test_svm_as_crf_pickling_batch():
 
     assert_less(.97, svm.score(X_test, y_test))
     assert_less(.97, logger.load().score(X_test, y_test))
+
+
+def test_bcfw_block_storage():
+    # all storage modes for the blocks give the same weights
+    iris = load_iris()
+    X, y = iris.data, iris.target
+    X_ = [(np.atleast_2d(x), np.empty((0, 2), dtype=np.int)) for x in X]
+    Y = y.reshape(-1, 1)
+
+    pbl = GraphCRF(n_features=4, n_states=3, inference_method='unary')
+    ws = []
+    for storage in ['dense', 'sparse', 'memmap', 'float32']:
+        svm = FrankWolfeSSVM(pbl, C=10, max_iter=20, random_state=0,
+                             block_storage=storage)
+        svm.fit(X_, Y)
+        ws.append(svm.w)
+    assert_array_equal(ws[0], ws[1])
+    assert_array_equal(ws[0], ws[2])
+    assert_array_almost_equal(ws[0], ws[3], decimal=3)
+
+
+def test_bcfw_gap_estimate():
+    iris = load_iris()
+    X, y = iris.data, iris.target
+    X_ = [(np.atleast_2d(x), np.empty((0, 2), dtype=np.int)) for x in X]
+    Y = y.reshape(-1, 1)
+
+    pbl = GraphCRF(n_features=4, n_states=3, inference_method='unary')
+    svms = []
+    for monitoring in ['full', 'estimate']:
+        svm = FrankWolfeSSVM(pbl, C=10, max_iter=30, monitoring=monitoring,
+                             check_dual_every=5, do_averaging=False, tol=-1,
+                             random_state=0)
+        svm.fit(X_, Y)
+        svms.append(svm)
+    # the iterates are the same, and the dual objective is exact
+    assert_array_almost_equal(svms[0].w, svms[1].w)
+    assert_array_almost_equal(svms[0].objective_curve_,
+                              svms[1].objective_curve_)
+    gaps = (np.array(svms[1].primal_objective_curve_)
+            - svms[1].objective_curve_)
+    assert_true(np.all(gaps[:-1] >= 0))
+    # the estimate is a lower bound on the gap at the same parameters
+    full_gaps = (np.array(svms[0].primal_objective_curve_)
+                 - svms[0].objective_curve_)
+    assert_true(np.all(gaps <= full_gaps + 1e-6))
@@ -1,6 +1,6 @@
 import numpy as np
-from numpy.testing import assert_array_equal
-from nose.tools import assert_equal, assert_true
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from nose.tools import assert_equal, assert_true, assert_almost_equal
 
 from pystruct.models import LatentGridCRF, LatentDirectionalGridCRF
 from pystruct.learners import (LatentSSVM, NSlackSSVM, OneSlackSSVM,
@@ -8,6 +8,7 @@ from pystruct.learners import (LatentSSVM, NSlackSSVM, OneSlackSSVM,
 
 from pystruct.datasets import generate_crosses, generate_easy
 from pystruct.inference import get_installed
+from pystruct.utils import find_constraint
 
 inference_method = get_installed(["qpbo", "ad3", "lp"])[0]
 
@@ -78,6 +79,37 @@ def test_with_crosses_bad_init():
     assert_true(.98 < clf.score(X_test, Y_test) < 1)
 
 
+def test_n_slack_constraint_update():
+    # the constraints are adjusted to the new latent variables without
+    # recomputing psi(x, y_hat)
+    rnd = np.random.RandomState(0)
+    X, Y = generate_crosses(n_samples=10, noise=5, n_crosses=1, total_size=8)
+    crf = LatentGridCRF(n_states_per_label=2)
+    crf.initialize(X, Y)
+    H = crf.init_latent(X, Y)
+    clf = LatentSSVM(NSlackSSVM(crf, C=100, max_iter=5))
+    clf.base_ssvm.fit(X, H, initialize=False)
+    constraints = clf.base_ssvm.constraints_
+    samples, Y_hat = constraints.samples, list(constraints.y_hats)
+
+    H_new = [h.copy() for h in H]
+    for h in H_new[::2]:
+        mask = rnd.uniform(size=h.shape) > .7
+        h[mask] = 2 * (h[mask] / 2)
+    changed = [i for i in range(len(X)) if np.any(H_new[i] != H[i])]
+    w = clf.w
+    clf._update_constraints(X, H, H_new, changed, w)
+    assert_true(clf.base_ssvm.constraints_ is constraints)
+    assert_array_equal(constraints.samples, samples)
+    for r, (i, y_hat) in enumerate(zip(samples, Y_hat)):
+        _, delta_psi, _, loss = find_constraint(crf, X[i], H_new[i], w,
+                                                y_hat)
+        assert_array_almost_equal(constraints.psis[r], delta_psi)
+        assert_almost_equal(constraints.losses[r], loss)
+    assert_array_almost_equal(constraints.gram,
+                              np.dot(constraints.psis, constraints.psis.T))
+
+
 def test_directional_bars():
     X, Y = generate_easy(n_samples=10, noise=5, box_size=2, total_size=6,
                          seed=1)
@@ -122,6 +122,17 @@ def test_binary_blocks_batches_n_slack():
     assert_array_equal(Y, Y_pred)
 
 
+def test_binary_blocks_active_set_n_slack():
+    X, Y = generate_blocks(n_samples=5)
+    crf = GridCRF(inference_method=inference_method)
+    clf = NSlackSSVM(model=crf, max_iter=20, C=100, qp_solver='active_set')
+    clf.fit(X, Y)
+    Y_pred = clf.predict(X)
+    assert_array_equal(Y, Y_pred)
+    # dual variables of each sample sum to at most C
+    assert_true(np.all([np.sum(a) <= 100 + 1e-8 for a in clf.alphas_]))
+
+
 def test_binary_ssvm_repellent_potentials():
     # test non-submodular problem with and without submodularity constraint
     # dataset is checkerboard
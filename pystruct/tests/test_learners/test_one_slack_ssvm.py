@@ -78,6 +78,22 @@ def test_constraint_removal():
                 len(clf.objective_curve_))
 
 
+def test_constraint_removal_window():
+    # only the last inactive_window dual variables of each constraint are
+    # kept, and they decide which constraints are removed
+    digits = load_digits()
+    X, y = digits.data[:200], digits.target[:200]
+    y = 2 * (y % 2) - 1  # even vs odd as +1 vs -1
+    X = X / 16.
+    pbl = BinaryClf(n_features=X.shape[1])
+    clf = OneSlackSSVM(model=pbl, max_iter=500, C=1, tol=0.01,
+                       inactive_window=3, inactive_threshold=1e-8)
+    clf.fit(X, y)
+    assert_equal(len(clf.alphas), len(clf.constraints_))
+    assert_true(all(len(alphas) <= 3 for alphas in clf.alphas))
+    assert_less(len(clf.constraints_), len(clf.objective_curve_))
+
+
 def test_binary_blocks_one_slack_graph():
     #testing cutting plane ssvm on easy binary dataset
     # generate graphs explicitly for each example
@@ -145,6 +161,22 @@ def test_one_slack_attractive_potentials():
     assert_true(submodular_clf.w[5] < 0)
 
 
+def test_one_slack_active_set_qp():
+    # the active set solver reaches about the same objective as cvxopt,
+    # the cutting planes found on the way can differ
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=0.5, seed=0)
+    crf = GridCRF(n_states=3, inference_method=inference_method)
+    clf_cvxopt = OneSlackSSVM(model=crf, max_iter=150, C=1, tol=.1)
+    clf_cvxopt.fit(X, Y)
+    clf = OneSlackSSVM(model=crf, max_iter=150, C=1, tol=.1,
+                       qp_solver='active_set')
+    clf.fit(X, Y)
+    assert_array_equal(Y, clf.predict(X))
+    assert_less(abs(clf.objective_curve_[-1]
+                    - clf_cvxopt.objective_curve_[-1]),
+                0.05 * clf_cvxopt.objective_curve_[-1])
+
+
 def test_one_slack_repellent_potentials():
     # test non-submodular problem with and without submodularity constraint
     # dataset is checkerboard
@@ -1,6 +1,7 @@
 import numpy as np
 from numpy.testing import (assert_array_equal, assert_array_almost_equal,
                            assert_almost_equal)
+from nose.tools import assert_true
 
 from pystruct.models import LatentGridCRF, LatentDirectionalGridCRF, GridCRF
 from pystruct.learners import SubgradientLatentSSVM, SubgradientSSVM
@@ -91,3 +92,46 @@ def test_directional_bars():
     Y_pred = clf.predict(X)
 
     assert_array_equal(np.array(Y_pred), Y)
+
+
+def test_objective_mini_batch():
+    # without latent states, mini batches do the same as in SubgradientSSVM
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=.3, seed=1)
+    inference_method = get_installed(["qpbo", "ad3", "lp"])[0]
+    crfl = LatentGridCRF(n_labels=3, n_states_per_label=1,
+                         inference_method=inference_method)
+    clfl = SubgradientLatentSSVM(model=crfl, max_iter=20, C=10.,
+                                 learning_rate=0.001, momentum=0.98,
+                                 batch_size=3)
+    crfl.initialize(X, Y)
+    clfl.w = np.zeros(crfl.size_psi)  # this disables random init
+    clfl.fit(X, Y)
+
+    crf = GridCRF(n_states=3, inference_method=inference_method)
+    clf = SubgradientSSVM(model=crf, max_iter=20, C=10., learning_rate=0.001,
+                          momentum=0.98, batch_size=3)
+    clf.fit(X, Y)
+    assert_array_almost_equal(clf.w, clfl.w)
+    assert_almost_equal(clf.objective_curve_[-1], clfl.objective_curve_[-1])
+
+
+def test_latent_tol():
+    X, Y = generate_easy(n_samples=10, noise=2, box_size=2, total_size=6,
+                         seed=2)
+    crf = LatentDirectionalGridCRF(n_labels=2, n_states_per_label=[1, 4])
+    crf.initialize(X, Y)
+    w_init = np.random.RandomState(0).normal(size=crf.size_psi)
+    clfs = []
+    for latent_tol, max_iter in [(0, 5), (1e-10, 5), (1e10, 5), (1e10, 1)]:
+        clf = SubgradientLatentSSVM(model=crf, max_iter=max_iter, C=10.,
+                                    learning_rate=1, decay_exponent=0.5,
+                                    batch_size=5, latent_tol=latent_tol,
+                                    break_on_no_constraints=False)
+        clf.w = w_init.copy()
+        clf.fit(X, Y, initialize=False)
+        clfs.append(clf)
+    # a tiny tolerance recomputes whenever w moves
+    assert_array_almost_equal(clfs[0].w, clfs[1].w)
+    assert_true(np.all(clfs[1]._H_path > clfs[3]._path))
+    # with a large one, the latent variables from the first pass are kept
+    assert_array_equal(clfs[2]._H_path, clfs[3]._H_path)
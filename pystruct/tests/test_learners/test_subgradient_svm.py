@@ -1,7 +1,8 @@
 from tempfile import mkstemp
 
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import (assert_array_equal, assert_array_almost_equal,
+                           assert_almost_equal)
 from nose.tools import assert_less
 
 from sklearn.datasets import load_iris
@@ -28,6 +29,46 @@ def test_multinomial_blocks_subgradient():
     assert_array_equal(Y, Y_pred)
 
 
+def test_subgradient_objective_estimate():
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=0.6, seed=1)
+    crf = GridCRF(n_states=3, inference_method=inference_method)
+    clf = SubgradientSSVM(model=crf, max_iter=10,
+                          break_on_no_constraints=False)
+    clf.fit(X, Y)
+    clf_estimate = SubgradientSSVM(model=crf, max_iter=10,
+                                   break_on_no_constraints=False,
+                                   monitoring='estimate')
+    clf_estimate.fit(X, Y)
+    assert_array_equal(clf.w, clf_estimate.w)
+    # after the first pass the estimates are close to the real objective
+    assert_array_almost_equal(np.array(clf_estimate.objective_curve_[2:])
+                              / clf.objective_curve_[2:], 1, decimal=1)
+    # the final objective is exact
+    assert_almost_equal(clf_estimate.objective_curve_[-1],
+                        clf.objective_curve_[-1])
+
+
+def test_subgradient_lazy_weights():
+    # without momentum, the scaled representation of w is used. A tiny
+    # momentum gives the same updates with dense vectors.
+    X, Y = generate_blocks_multinomial(n_samples=10, noise=0.6, seed=1)
+    crf = GridCRF(n_states=3, inference_method=inference_method)
+    for averaging in [None, 'linear', 'squared']:
+        for batch_size in [None, 5]:
+            clf_lazy = SubgradientSSVM(model=crf, max_iter=5,
+                                       averaging=averaging,
+                                       batch_size=batch_size)
+            clf_lazy.fit(X, Y)
+            clf_dense = SubgradientSSVM(model=crf, max_iter=5,
+                                        averaging=averaging,
+                                        batch_size=batch_size,
+                                        momentum=1e-30)
+            clf_dense.fit(X, Y)
+            assert_array_almost_equal(clf_lazy.w, clf_dense.w)
+            assert_array_almost_equal(clf_lazy.objective_curve_,
+                                      clf_dense.objective_curve_)
+
+
 def test_multinomial_checker_subgradient():
     X, Y = generate_checker_multinomial(n_samples=10, noise=0.4)
     n_labels = len(np.unique(Y))
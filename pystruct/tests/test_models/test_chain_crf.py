@@ -4,6 +4,7 @@ from numpy.testing import assert_array_equal, assert_equal
 from nose.tools import assert_raises
 
 from pystruct.models import ChainCRF
+from pystruct.utils import exhaustive_loss_augmented_inference
 
 
 def test_initialize():
@@ -40,3 +41,17 @@ def test_directed_chain():
     crf = ChainCRF(n_states=3, n_features=3)
     y = crf.inference(x, w)
     assert_array_equal([0, 1, 2], y)
+
+
+def test_loss_augmented_inference_max_product():
+    # viterbi should find the most violating labeling on small chains
+    rnd = np.random.RandomState(0)
+    crf = ChainCRF(n_states=3, n_features=2)
+    assert_equal(crf.inference_method, 'max-product')
+    for i in xrange(5):
+        x = rnd.normal(size=(5, 2))
+        y = rnd.randint(3, size=5)
+        w = rnd.normal(size=crf.size_psi)
+        y_hat = crf.loss_augmented_inference(x, y, w)
+        y_ex = exhaustive_loss_augmented_inference(crf, x, y, w)
+        assert_array_equal(y_hat, y_ex)
@@ -216,3 +216,21 @@ def test_energy_discrete():
             energy_svm = np.dot(psi, w)
 
             assert_almost_equal(energy, energy_svm)
+
+
+def test_max_product_tree():
+    # exact max-product inference on a tree with edge features
+    rnd = np.random.RandomState(0)
+    n_nodes, n_states = 15, 3
+    edges = np.c_[[rnd.randint(j) for j in xrange(1, n_nodes)],
+                  np.arange(1, n_nodes)]
+    edge_features = rnd.normal(size=(n_nodes - 1, 2))
+    x = (rnd.normal(size=(n_nodes, 2)), edges, edge_features)
+    crf_lp = EdgeFeatureGraphCRF(n_states=n_states, n_features=2,
+                                 n_edge_features=2, inference_method='lp')
+    crf_mp = EdgeFeatureGraphCRF(n_states=n_states, n_features=2,
+                                 n_edge_features=2,
+                                 inference_method='max-product')
+    for i in xrange(5):
+        w = rnd.normal(size=crf_lp.size_psi)
+        assert_array_equal(crf_mp.inference(x, w), crf_lp.inference(x, w))
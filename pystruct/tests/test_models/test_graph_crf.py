@@ -6,6 +6,7 @@ from nose.tools import assert_raises
 
 from pystruct.models import GraphCRF
 from pystruct.inference import get_installed
+from pystruct.utils import compress_sym
 
 
 w = np.array([1, 0,  # unary
@@ -166,3 +167,25 @@ def test_directed_graph_chain():
     crf = GraphCRF(n_states=3, n_features=3, directed=True)
     y = crf.inference(x, w)
     assert_array_equal([0, 1, 2], y)
+
+
+def test_graph_crf_psi():
+    # compare with psi from one hot encodings
+    rnd = np.random.RandomState(0)
+    n_nodes, n_states = 50, 4
+    features = rnd.normal(size=(n_nodes, 3))
+    edges = rnd.randint(n_nodes, size=(100, 2))
+    y = rnd.randint(n_states, size=n_nodes)
+    onehot = np.eye(n_states, dtype=np.int)[y]
+    pw = np.dot(onehot[edges[:, 0]].T, onehot[edges[:, 1]])
+    unaries = np.dot(onehot.T, features).ravel()
+    for directed in [False, True]:
+        crf = GraphCRF(n_states=n_states, n_features=3, directed=directed)
+        psi = crf.psi((features, edges), y)
+        pairwise = pw.ravel() if directed else compress_sym(pw)
+        assert_array_almost_equal(psi, np.hstack([unaries, pairwise]))
+        # same as for relaxed labels with integral marginals
+        psi_relaxed = crf.psi((features, edges),
+                              (onehot, np.ones((len(edges), 1, 1)) *
+                               pw / float(len(edges))))
+        assert_array_almost_equal(psi, psi_relaxed)
@@ -1,6 +1,6 @@
 import numpy as np
 from numpy.testing import (assert_array_equal, assert_array_almost_equal,
-                           assert_almost_equal)
+                           assert_almost_equal, assert_equal)
 
 from pystruct.datasets import (generate_blocks, generate_blocks_multinomial,
                                binary, multinomial)
@@ -212,3 +212,23 @@ def test_binary_crf_exhaustive_loss_augmented():
             y_hat = crf.loss_augmented_inference(x, y, w)
             y_ex = exhaustive_loss_augmented_inference(crf, x, y, w)
             assert_array_equal(y_hat, y_ex)
+
+
+def test_batch_inference():
+    X, Y = generate_blocks_multinomial(n_samples=4, noise=.5, seed=0)
+    w = np.array([1., 0., 0.,  # unaryA
+                  0., 1., 0.,
+                  0., 0., 1.,
+                 .4,           # pairwise
+                 -.3, .3,
+                 -.5, -.1, .3])
+    for inference_method in get_installed(['max-product', 'lp', 'ad3']):
+        crf = GridCRF(inference_method=inference_method)
+        crf.initialize(X, Y)
+        Y_hat = crf.batch_inference(X, w)
+        Y_hat_aug = crf.batch_loss_augmented_inference(X, Y, w)
+        assert_equal(crf.inference_calls, 2 * len(X))
+        for x, y, y_hat, y_hat_aug in zip(X, Y, Y_hat, Y_hat_aug):
+            assert_array_equal(y_hat, crf.inference(x, w))
+            assert_array_equal(y_hat_aug,
+                               crf.loss_augmented_inference(x, y, w))
@@ -129,6 +129,23 @@ def test_inference_chain():
     assert_almost_equal(energy_psi, -energy_lp)
 
 
+def test_batch_loss_augmented_inference():
+    # batched loss-augmented inference uses the latent loss augmentation
+    rnd = np.random.RandomState(0)
+    crf = LatentNodeCRF(n_labels=2, n_features=1, n_hidden_states=2)
+    w = np.hstack([[-1, 1], [+1, +0, 1, +3, 0, 0, +0, 3, 0, 0]])
+    X, H = [], []
+    for n_visible in [4, 6, 3]:
+        features = rnd.normal(size=(n_visible, 1))
+        edges = np.vstack([np.arange(n_visible - 1), np.arange(1, n_visible)])
+        latent_edges = [[n, n_visible + n % 2] for n in range(n_visible)]
+        X.append((features, np.vstack([edges.T, latent_edges]), 2))
+        H.append(np.hstack([rnd.randint(2, size=n_visible), [2, 3]]))
+    H_hat = crf.batch_loss_augmented_inference(X, H, w)
+    for x, h, h_hat in zip(X, H, H_hat):
+        assert_array_equal(h_hat, crf.loss_augmented_inference(x, h, w))
+
+
 def test_inference_trivial_features():
     # size 6 chain graph
     # first three and last three have a latent variable
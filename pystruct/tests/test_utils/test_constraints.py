@@ -0,0 +1,124 @@
+import numpy as np
+from numpy.testing import (assert_array_equal, assert_array_almost_equal,
+                           assert_almost_equal)
+from nose.tools import assert_equal, assert_raises, assert_true, assert_false
+
+from pystruct.utils import constraints
+from pystruct.utils.constraints import (ConstraintStore, SampleConstraintStore,
+                                        InferenceCache)
+
+
+def test_constraint_store():
+    rnd = np.random.RandomState(0)
+    psis = rnd.normal(size=(40, 7))
+    losses = rnd.uniform(size=40)
+    # start small to exercise growing the storage
+    store = ConstraintStore(7, capacity=2)
+    for psi, loss in zip(psis, losses):
+        store.append((psi, loss))
+    assert_equal(len(store), 40)
+    assert_array_equal(store.psis, psis)
+    assert_array_equal(store.losses, losses)
+    assert_array_almost_equal(store.gram, np.dot(psis, psis.T))
+
+    del store[[0, 3, 39]]
+    keep = np.setdiff1d(np.arange(40), [0, 3, 39])
+    del store[0]
+    keep = keep[1:]
+    assert_equal(len(store), len(keep))
+    assert_array_equal(store.psis, psis[keep])
+    assert_array_almost_equal(store.gram, np.dot(psis[keep], psis[keep].T))
+    psi, loss = store[-1]
+    assert_array_equal(psi, psis[38])
+    assert_equal(loss, losses[38])
+    assert_raises(IndexError, lambda: store[len(keep)])
+    assert_equal(len(list(store)), len(keep))
+
+    # adding after deleting keeps the gram matrix up to date
+    store.append((psis[0], losses[0]))
+    keep = np.hstack([keep, 0])
+    assert_array_almost_equal(store.gram, np.dot(psis[keep], psis[keep].T))
+
+
+def test_sample_constraint_store():
+    rnd = np.random.RandomState(0)
+    lists = [[[rnd.randint(3, size=5), rnd.normal(size=4), rnd.uniform()]
+              for j in xrange(n)] for n in [3, 0, 2]]
+    store = SampleConstraintStore.from_lists(lists, 4)
+    assert_equal(len(store), 3)
+    assert_equal(store.n_constraints, 5)
+    assert_array_equal(store.samples, [0, 0, 0, 2, 2])
+    for sample, sample_list in zip(store, lists):
+        assert_equal(len(sample), len(sample_list))
+        for constraint, constraint_list in zip(sample, sample_list):
+            assert_array_equal(constraint[0], constraint_list[0])
+            assert_array_equal(constraint[1], constraint_list[1])
+            assert_equal(constraint[2], constraint_list[2])
+
+    y_hat = lists[2][1][0]
+    assert_true(store.contains(2, y_hat.copy()))
+    assert_false(store.contains(0, y_hat))
+    # relaxed labelings are compared by their unary marginals
+    store.append(1, (np.eye(3)[y_hat], None), rnd.normal(size=4), 1.)
+    assert_true(store.contains(1, (np.eye(3)[y_hat], np.zeros(2))))
+    assert_array_equal(store.rows(1), [5])
+
+    w = rnd.normal(size=4)
+    assert_array_almost_equal(
+        store.slacks(w), np.maximum(store.losses - np.dot(store.psis, w), 0))
+
+    del store[[0, 4]]
+    assert_array_equal(store.samples, [0, 0, 2, 1])
+    assert_array_equal(store.rows(2), [2])
+    assert_false(store.contains(2, y_hat))
+    assert_array_almost_equal(store.gram, np.dot(store.psis, store.psis.T))
+
+
+def test_inference_cache():
+    rnd = np.random.RandomState(0)
+    psis = rnd.normal(size=(3, 6, 4))
+    losses = rnd.uniform(size=(3, 6))
+    w = rnd.normal(size=4)
+    for eviction in ['lru', 'violation']:
+        cache = InferenceCache(3, 4, size=5, eviction=eviction)
+        for j in xrange(6):
+            for i in xrange(3):
+                cache.add(i, psis[i, j], losses[i, j], np.array([i, j]), w)
+        # labelings that are already cached are not added again
+        cache.add(0, psis[0, 3], losses[0, 3], np.array([0, 3]), w)
+        assert_equal([len(sample) for sample in cache], [5, 5, 5])
+        violations = np.dot(psis, w) + losses
+        if eviction == 'lru':
+            # the first labeling was evicted
+            cached = np.arange(1, 6)
+        else:
+            # the least violated of the first five was evicted
+            cached = np.sort(np.argsort(violations[0, :5])[1:].tolist() + [5])
+        assert_array_equal(np.sort([y_hat[1] for _, _, y_hat in cache[0]]),
+                           cached)
+
+        Y_hat, psi_sum, loss_sum = cache.most_violated(w)
+        best = [max([j for _, _, (i, j) in cache[i]],
+                    key=lambda j: violations[i, j]) for i in xrange(3)]
+        assert_array_equal([y_hat[1] for y_hat in Y_hat], best)
+        assert_array_almost_equal(psi_sum, psis[np.arange(3), best].sum(0),
+                                  decimal=5)
+        assert_almost_equal(loss_sum, losses[np.arange(3), best].sum())
+
+    # the memory budget limits the number of cached labelings
+    cache = InferenceCache(3, 4, size=5, memory=3 * 4 * 4 * 2)
+    assert_equal(cache.size, 2)
+
+
+def test_inference_cache_hash_collision():
+    # labelings with the same hash are both cached
+    label_key = constraints._label_key
+    constraints._label_key = lambda y: 0
+    try:
+        cache = InferenceCache(1, 2, size=5)
+        cache.add(0, np.ones(2), 1., np.array([0, 1]))
+        cache.add(0, np.ones(2), 1., np.array([1, 0]))
+        cache.add(0, np.ones(2), 1., np.array([1, 0]))
+    finally:
+        constraints._label_key = label_key
+    assert_equal(len(cache[0]), 2)
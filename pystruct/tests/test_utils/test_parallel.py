@@ -0,0 +1,255 @@
+import os
+from tempfile import mkstemp
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_almost_equal
+from nose.tools import (assert_equal, assert_true, assert_greater,
+                        assert_raises)
+
+from pystruct.datasets import (generate_blocks_multinomial, generate_blocks,
+                               generate_crosses)
+from pystruct.models import GridCRF, GraphCRF, LatentGridCRF
+from pystruct.learners import (NSlackSSVM, FrankWolfeSSVM, SubgradientSSVM,
+                               LatentSSVM, SubgradientLatentSSVM, OneSlackSSVM)
+from pystruct.utils import find_constraint, inference, SaveLogger
+from pystruct.utils.parallel import WorkerPool, estimate_cost
+
+
+def test_worker_pool():
+    X, Y = generate_blocks_multinomial(n_samples=5, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    crf.initialize(X, Y)
+    w = np.random.RandomState(0).normal(size=crf.size_psi)
+    pool = WorkerPool(crf, X, Y, n_jobs=2)
+    try:
+        constraints = pool.map(find_constraint, w, indices=[3, 0, 4])
+        assert_equal(len(constraints), 3)
+        for i, constraint in zip([3, 0, 4], constraints):
+            expected = find_constraint(crf, X[i], Y[i], w)
+            assert_array_equal(constraint[0], expected[0])
+            assert_almost_equal(constraint[2], expected[2])
+        # warm starts are passed on
+        init = [y_hat for y_hat, _, _, _ in constraints]
+        constraints = pool.map(find_constraint, w, indices=[3, 0, 4],
+                               init=init)
+        assert_equal(len(constraints), 3)
+    finally:
+        pool.close()
+
+    pool = WorkerPool(crf, X, n_jobs=2)
+    try:
+        Y_pred = pool.map(inference, w)
+    finally:
+        pool.close()
+    for x, y_pred in zip(X, Y_pred):
+        assert_array_equal(y_pred, crf.inference(x, w))
+
+
+def _return_init(model, x, y, w, init=None):
+    return init
+
+
+def test_worker_pool_init_per_sample():
+    # samples in one chunk without warm start don't get the one of the
+    # sample before
+    X, Y = generate_blocks_multinomial(n_samples=8, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    crf.initialize(X, Y)
+    pool = WorkerPool(crf, X, Y, n_jobs=1)
+    try:
+        init = [i if i % 2 else None for i in range(8)]
+        assert_equal(pool.map(_return_init, None, init=init), init)
+    finally:
+        pool.close()
+
+
+def test_worker_pool_scheduling():
+    # graphs of very different size
+    rnd = np.random.RandomState(0)
+    X, Y = [], []
+    for n_nodes in [2, 50, 3, 400, 5, 100]:
+        edges = np.c_[np.arange(n_nodes - 1), np.arange(1, n_nodes)]
+        X.append((rnd.normal(size=(n_nodes, 3)), edges))
+        Y.append(rnd.randint(3, size=n_nodes))
+    crf = GraphCRF(n_states=3, inference_method='max-product')
+    crf.initialize(X, Y)
+    assert_equal(estimate_cost(crf, X[0]), 2 * 3 + 1 * 9)
+
+    w = rnd.normal(size=crf.size_psi)
+    pool = WorkerPool(crf, X, Y, n_jobs=2)
+    try:
+        assert_array_equal(np.argsort(pool.costs_), [0, 2, 4, 1, 5, 3])
+        chunks = pool._schedule(np.arange(len(X)))
+        # the largest graph goes first, every sample once
+        assert_equal(chunks[0][0], 3)
+        assert_array_equal(np.sort(np.hstack(chunks)), np.arange(len(X)))
+
+        constraints = pool.map(find_constraint, w)
+        for x, y, constraint in zip(X, Y, constraints):
+            assert_array_equal(constraint[0], find_constraint(crf, x, y, w)[0])
+        assert_equal(np.sum(np.isnan(pool.times_)), 0)
+        utilization = pool.utilization()
+        assert_equal(len(utilization), 2)
+        assert_true(np.all(utilization >= 0))
+        assert_true(np.all(utilization <= 1))
+    finally:
+        pool.close()
+
+
+def test_worker_pool_imap():
+    X, Y = generate_blocks_multinomial(n_samples=5, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    crf.initialize(X, Y)
+    rnd = np.random.RandomState(0)
+    ws = [rnd.normal(size=crf.size_psi)]
+    pool = WorkerPool(crf, X, Y, n_jobs=2)
+    try:
+        results = {}
+        # change the parameters after each result, the first chunks are
+        # sent out with the first parameters
+        for i, constraint in pool.imap(find_constraint, lambda: ws[-1],
+                                       indices=[4, 1, 3, 0, 2]):
+            results[i] = constraint
+            ws.append(rnd.normal(size=crf.size_psi))
+        assert_equal(sorted(results.keys()), range(5))
+        for i in [4, 1, 3, 0]:
+            expected = find_constraint(crf, X[i], Y[i], ws[0])
+            assert_array_equal(results[i][0], expected[0])
+    finally:
+        pool.close()
+
+
+def _count_samples(model, X, Y, shared, indices, init):
+    shared['counts'][indices] += 1
+    return len(indices)
+
+
+def test_worker_pool_map_shared():
+    X, Y = generate_blocks_multinomial(n_samples=5, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    crf.initialize(X, Y)
+    pool = WorkerPool(crf, X, Y, n_jobs=2, shared={'counts': 5})
+    try:
+        # the parent process sees the changes of the workers
+        pool.shared['counts'][0] = 10
+        results = pool.map_shared(_count_samples, indices=[4, 1, 0, 2])
+        assert_array_equal(pool.shared['counts'], [11, 1, 1, 0, 1])
+        assert_equal(sorted(np.hstack([chunk for chunk, _ in results])),
+                     [0, 1, 2, 4])
+        for chunk, result in results:
+            assert_equal(len(chunk), result)
+    finally:
+        pool.close()
+
+
+def test_parallel_learning():
+    X, Y = generate_blocks_multinomial(n_samples=6, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    clf = NSlackSSVM(crf, max_iter=10, C=100, n_jobs=2)
+    clf.fit(X, Y)
+    assert_equal(clf._pool, None)
+    assert_equal(len(clf.worker_utilization_), 2)
+    # same result as without workers
+    clf_seq = NSlackSSVM(crf, max_iter=10, C=100, n_jobs=1)
+    clf_seq.fit(X, Y)
+    assert_almost_equal(clf.w, clf_seq.w)
+    assert_array_equal(clf.predict(X), clf_seq.predict(X))
+
+
+def test_parallel_show_loss():
+    # predict on the training data goes through the workers without labels
+    X, Y = generate_blocks_multinomial(n_samples=6, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    clf = SubgradientSSVM(crf, max_iter=3, C=1, n_jobs=2, show_loss_every=1)
+    clf.fit(X, Y)
+    assert_equal(clf._pool, None)
+    assert_greater(len(clf.loss_curve_), 0)
+
+
+def test_parallel_frankwolfe():
+    X, Y = generate_blocks_multinomial(n_samples=6, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    clf = FrankWolfeSSVM(crf, max_iter=50, C=1, n_jobs=2, random_state=0)
+    clf.fit(X, Y)
+    assert_equal(clf._pool, None)
+    assert_array_equal(clf.predict(X), Y)
+    # the dual gap is checked with the workers as well
+    assert_true(np.all(np.array(clf.primal_objective_curve_)
+                       >= np.array(clf.objective_curve_) - 1e-5))
+
+
+def test_parallel_subgradient_hogwild():
+    X, Y = generate_blocks(n_samples=10)
+    crf = GridCRF(inference_method='max-product')
+    for averaging in [None, 'linear']:
+        clf = SubgradientSSVM(crf, max_iter=20, C=1, learning_rate=.1,
+                              n_jobs=2, asynchronous=True,
+                              averaging=averaging,
+                              break_on_no_constraints=False)
+        clf.fit(X, Y)
+        assert_equal(clf._pool, None)
+        assert_equal(clf.t, 20 * len(X))
+        assert_greater(clf.score(X, Y), .99)
+
+
+def test_parallel_latent():
+    X, Y = generate_crosses(n_samples=10, noise=5, n_crosses=1, total_size=8)
+    crf = LatentGridCRF(n_states_per_label=[1, 2],
+                        inference_method='max-product')
+    # no workers for the latent completion while the base_ssvm has its own
+    pools = []
+
+    def log_pool(learner, iteration):
+        pools.append(getattr(clf, '_pool', None))
+
+    clf = LatentSSVM(NSlackSSVM(crf, C=100, n_jobs=2, logger=log_pool))
+    clf.fit(X, Y)
+    assert_equal(clf._pool, None)
+    assert_true(len(pools))
+    assert_true(all(pool is None for pool in pools))
+    # same result as without workers
+    clf_seq = LatentSSVM(NSlackSSVM(crf, C=100))
+    clf_seq.fit(X, Y)
+    assert_almost_equal(clf.w, clf_seq.w)
+    assert_array_equal(clf.predict(X), Y)
+
+
+def test_parallel_subgradient_latent():
+    X, Y = generate_crosses(n_samples=10, noise=5, n_crosses=1, total_size=8)
+    crf = LatentGridCRF(n_states_per_label=[1, 2],
+                        inference_method='max-product')
+    crf.initialize(X, Y)
+    w_init = np.random.RandomState(0).normal(size=crf.size_psi)
+    clf = SubgradientLatentSSVM(crf, max_iter=5, C=10, n_jobs=2,
+                                batch_size=3)
+    clf.w = w_init.copy()
+    clf.fit(X, Y, initialize=False)
+    assert_equal(clf._pool, None)
+    # same result as without workers
+    clf_seq = SubgradientLatentSSVM(crf, max_iter=5, C=10, batch_size=3)
+    clf_seq.w = w_init.copy()
+    clf_seq.fit(X, Y, initialize=False)
+    assert_almost_equal(clf.w, clf_seq.w)
+    assert_almost_equal(clf.objective_curve_, clf_seq.objective_curve_)
+
+
+def _raise_error(learner, iteration):
+    raise ValueError("logger failed")
+
+
+def test_parallel_learning_pool_cleanup():
+    X, Y = generate_blocks_multinomial(n_samples=4, noise=.5, seed=0)
+    crf = GridCRF(inference_method='max-product')
+    # the learner can be pickled during fit
+    file_name = mkstemp()[1]
+    try:
+        clf = OneSlackSSVM(crf, max_iter=3, C=1, n_jobs=2,
+                           logger=SaveLogger(file_name, save_every=1))
+        clf.fit(X, Y)
+        assert_almost_equal(clf.logger.load().w, clf.w)
+    finally:
+        os.remove(file_name)
+    # the workers are stopped if fit fails
+    clf = NSlackSSVM(crf, max_iter=3, C=1, n_jobs=2, logger=_raise_error)
+    assert_raises(ValueError, clf.fit, X, Y)
+    assert_equal(clf._pool, None)
@@ -0,0 +1,78 @@
+import warnings
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from nose.tools import assert_true, assert_equal, assert_almost_equal
+from sklearn.utils import ConvergenceWarning
+
+import cvxopt
+import cvxopt.solvers
+
+from pystruct.utils.qp import active_set_qp
+
+
+def _objective(gram, losses, alpha):
+    return np.dot(alpha, np.dot(gram, alpha)) / 2. - np.dot(losses, alpha)
+
+
+def _solve_cvxopt(gram, losses, groups, C, equality):
+    n_constraints, n_groups = len(losses), np.max(groups) + 1
+    blocks = (groups == np.arange(n_groups)[:, np.newaxis]).astype(np.float)
+    G = -np.eye(n_constraints)
+    h = np.zeros(n_constraints)
+    A, b = None, None
+    if equality:
+        A, b = cvxopt.matrix(blocks), cvxopt.matrix(C * np.ones(n_groups))
+    else:
+        G = np.vstack([G, blocks])
+        h = np.hstack([h, C * np.ones(n_groups)])
+    options_backup = cvxopt.solvers.options.copy()
+    # with many groups, the default tolerances are not enough to compare
+    cvxopt.solvers.options.update(show_progress=False, abstol=1e-10,
+                                  reltol=1e-10)
+    solution = cvxopt.solvers.qp(cvxopt.matrix(gram), cvxopt.matrix(-losses),
+                                 cvxopt.matrix(G), cvxopt.matrix(h), A, b)
+    cvxopt.solvers.options.clear()
+    cvxopt.solvers.options.update(options_backup)
+    return np.ravel(solution['x'])
+
+
+def test_active_set_qp():
+    rnd = np.random.RandomState(0)
+    for n_groups, equality in [(1, True), (1, False), (5, False),
+                               (5, True), (20, False)]:
+        # low rank gram matrix like in the cutting plane methods
+        psis = rnd.normal(size=(30, 4))
+        gram = np.dot(psis, psis.T)
+        losses = rnd.uniform(size=30) * 3
+        groups = rnd.randint(n_groups, size=30)
+        C = 2.
+        alpha = active_set_qp(gram, losses, groups, C, equality=equality)
+        reference = _solve_cvxopt(gram, losses, groups, C, equality)
+        assert_true(np.all(alpha >= 0))
+        sums = np.bincount(groups, alpha, minlength=n_groups)
+        if equality:
+            assert_array_almost_equal(sums, C)
+        else:
+            assert_true(np.all(sums <= C + 1e-10))
+        assert_almost_equal(_objective(gram, losses, alpha),
+                            _objective(gram, losses, reference), places=5)
+
+        # warm start from a perturbed solution
+        warm = active_set_qp(gram, losses, groups, C, alpha=alpha + 0.1,
+                             equality=equality)
+        assert_almost_equal(_objective(gram, losses, warm),
+                            _objective(gram, losses, alpha), places=8)
+
+
+def test_active_set_qp_max_iter():
+    rnd = np.random.RandomState(0)
+    psis = rnd.normal(size=(30, 4))
+    gram = np.dot(psis, psis.T)
+    losses = rnd.uniform(size=30) * 3
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        alpha = active_set_qp(gram, losses, np.zeros(30), 2., max_iter=1)
+    assert_equal(len(w), 1)
+    assert_true(issubclass(w[0].category, ConvergenceWarning))
+    assert_true(np.all(alpha >= 0))
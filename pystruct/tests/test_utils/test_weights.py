@@ -0,0 +1,27 @@
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+
+from pystruct.utils.weights import LazyWeights
+
+
+def test_lazy_weights():
+    # compare with the dense updates
+    rnd = np.random.RandomState(0)
+    w, w_avg = rnd.normal(size=20), rnd.normal(size=20)
+    weights = LazyWeights(w, w_avg)
+    for t in xrange(1000):
+        factor = rnd.uniform(.5, 1.)
+        w *= factor
+        weights.shrink(factor)
+        x = np.zeros(20)
+        x[rnd.randint(20, size=3)] = rnd.normal(size=3)
+        w += x
+        weights.add(x)
+        rho = 2. / (t + 2.)
+        w_avg = (1 - rho) * w_avg + rho * w
+        weights.update_average(rho)
+        assert_array_almost_equal(weights.w, w)
+        assert_array_almost_equal(weights.w_avg, w_avg)
+    weights.shrink(0)
+    assert_array_almost_equal(weights.w, 0)
+    assert_array_almost_equal(weights.w_avg, w_avg)
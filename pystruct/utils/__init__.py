@@ -1,6 +1,6 @@
 from .backports import train_test_split
 from .inference import (unwrap_pairwise, find_constraint,
-                        find_constraint_latent, inference,
+                        find_constraint_latent, inference, latent,
                         loss_augmented_inference, objective_primal,
                         exhaustive_loss_augmented_inference,
                         exhaustive_inference, compress_sym, expand_sym)
@@ -10,7 +10,8 @@ from .graph import make_grid_edges, edge_list_to_features
 
 __all__ = ["train_test_split", "unwrap_pairwise",
            "make_grid_edges", "find_constraint",
-           "find_constraint_latent", "inference", "loss_augmented_inference",
+           "find_constraint_latent", "inference", "latent",
+           "loss_augmented_inference",
            "objective_primal", "exhaustive_loss_augmented_inference",
            "exhaustive_inference", "SaveLogger", "plot_grid", "compress_sym",
            "expand_sym", "edge_list_to_features"]
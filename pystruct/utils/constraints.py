@@ -0,0 +1,431 @@
+import numpy as np
+
+from .inference import unwrap_pairwise
+
+
+class ConstraintStore(object):
+    """Constraints of a cutting plane QP together with their Gram matrix.
+
+    Behaves like a list of ``(psi, loss)`` tuples, but keeps all psis in one
+    array and updates the matrix of their inner products as constraints are
+    added and removed. Adding a constraint costs one matrix-vector product
+    with the stored psis, instead of recomputing the whole Gram matrix.
+
+    Parameters
+    ----------
+    size_psi : int
+        Length of the psi vectors.
+
+    capacity : int (default=16)
+        Number of constraints to allocate memory for initially. The storage
+        grows automatically.
+    """
+    def __init__(self, size_psi, capacity=16):
+        self._psis = np.empty((capacity, size_psi))
+        self._losses = np.empty(capacity)
+        self._gram = np.empty((capacity, capacity))
+        self._n = 0
+
+    @property
+    def psis(self):
+        """Stored psis, shape (n_constraints, size_psi)."""
+        return self._psis[:self._n]
+
+    @property
+    def losses(self):
+        """Stored losses, shape (n_constraints,)."""
+        return self._losses[:self._n]
+
+    @property
+    def gram(self):
+        """Inner products of the psis, shape (n_constraints, n_constraints).
+        """
+        return self._gram[:self._n, :self._n]
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if not -self._n <= i < self._n:
+            raise IndexError("constraint index out of range")
+        i = i % self._n
+        return self._psis[i], self._losses[i]
+
+    def __iter__(self):
+        for i in xrange(self._n):
+            yield self._psis[i], self._losses[i]
+
+    def _grow(self):
+        capacity = 2 * len(self._losses)
+        psis = np.empty((capacity, self._psis.shape[1]))
+        psis[:self._n] = self.psis
+        losses = np.empty(capacity)
+        losses[:self._n] = self.losses
+        gram = np.empty((capacity, capacity))
+        gram[:self._n, :self._n] = self.gram
+        self._psis, self._losses, self._gram = psis, losses, gram
+
+    def append(self, constraint):
+        """Add a constraint given as tuple ``(psi, loss)``."""
+        psi, loss = constraint
+        if self._n == len(self._losses):
+            self._grow()
+        n = self._n
+        self._psis[n] = psi
+        self._losses[n] = loss
+        row = np.dot(self._psis[:n + 1], self._psis[n])
+        self._gram[n, :n + 1] = row
+        self._gram[:n + 1, n] = row
+        self._n += 1
+
+    def update(self, indices, psis, losses):
+        """Replace psis and losses of the constraints with given indices.
+        """
+        self._psis[indices] = psis
+        self._losses[indices] = losses
+        rows = np.dot(self._psis[indices], self.psis.T)
+        self._gram[indices, :self._n] = rows
+        self._gram[:self._n, indices] = rows.T
+
+    def __delitem__(self, indices):
+        keep = np.ones(self._n, dtype=np.bool)
+        keep[indices] = False
+        n = np.sum(keep)
+        self._psis[:n] = self.psis[keep]
+        self._losses[:n] = self.losses[keep]
+        self._gram[:n, :n] = self.gram[np.ix_(keep, keep)]
+        self._n = n
+
+
+def _label_key(y):
+    y = np.ascontiguousarray(unwrap_pairwise(y))
+    return hash((y.shape, y.dtype.str, y.tostring()))
+
+
+def _same_labeling(y_hat, other):
+    # compare the labelings themselves to rule out hash collisions
+    if isinstance(y_hat, tuple):
+        return (isinstance(other, tuple)
+                and all(np.array_equal(a, b) for a, b in zip(y_hat, other)))
+    return not isinstance(other, tuple) and np.array_equal(y_hat, other)
+
+
+class SampleConstraintStore(object):
+    """Constraints of the n-slack cutting plane QP, grouped by sample.
+
+    Behaves like a list with one entry per sample, each entry being the list
+    of ``[y_hat, delta_psi, loss]`` constraints of that sample. Internally,
+    the constraints of all samples are kept in one ``ConstraintStore``, in
+    the order they were added, together with the sample each of them
+    belongs to. A hash of each labeling allows to check whether a labeling
+    is already among the constraints of a sample in constant time.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples.
+
+    size_psi : int
+        Length of the psi vectors.
+
+    capacity : int (default=16)
+        Number of constraints to allocate memory for initially. The storage
+        grows automatically.
+    """
+    def __init__(self, n_samples, size_psi, capacity=16):
+        self._constraints = ConstraintStore(size_psi, capacity)
+        self._samples = []
+        self._keys = []
+        self.y_hats = []
+        # constraints and labeling hashes of each sample
+        self._rows = [[] for i in xrange(n_samples)]
+        self._sample_keys = [dict() for i in xrange(n_samples)]
+
+    @classmethod
+    def from_lists(cls, constraints, size_psi):
+        """Create the store from a list of lists of constraints per sample.
+        """
+        store = cls(len(constraints), size_psi)
+        for i, sample in enumerate(constraints):
+            for y_hat, delta_psi, loss in sample:
+                store.append(i, y_hat, delta_psi, loss)
+        return store
+
+    @property
+    def n_constraints(self):
+        """Number of constraints of all samples together."""
+        return len(self._constraints)
+
+    @property
+    def psis(self):
+        """Psis of all constraints, shape (n_constraints, size_psi)."""
+        return self._constraints.psis
+
+    @property
+    def losses(self):
+        """Losses of all constraints, shape (n_constraints,)."""
+        return self._constraints.losses
+
+    @property
+    def gram(self):
+        """Inner products of the psis, shape (n_constraints, n_constraints).
+        """
+        return self._constraints.gram
+
+    @property
+    def samples(self):
+        """Sample of each constraint, shape (n_constraints,)."""
+        return np.array(self._samples, dtype=np.int)
+
+    def rows(self, i):
+        """Indices of the constraints of sample i."""
+        return np.array(self._rows[i], dtype=np.int)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __getitem__(self, i):
+        return [[self.y_hats[r], self.psis[r].copy(), self.losses[r]]
+                for r in self._rows[i]]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def append(self, i, y_hat, delta_psi, loss):
+        """Add the constraint ``[y_hat, delta_psi, loss]`` to sample i."""
+        key = _label_key(y_hat)
+        self._rows[i].append(self.n_constraints)
+        self._constraints.append((delta_psi, loss))
+        self._samples.append(i)
+        self._keys.append(key)
+        self.y_hats.append(y_hat)
+        keys = self._sample_keys[i]
+        keys[key] = keys.get(key, 0) + 1
+
+    def update(self, rows, delta_psis, losses):
+        """Replace delta_psi and loss of the constraints with given rows.
+
+        The labelings stay the same, for example when the ground truth
+        changes in latent variable models.
+        """
+        self._constraints.update(rows, delta_psis, losses)
+
+    def contains(self, i, y_hat):
+        """Whether y_hat is the labeling of a constraint of sample i."""
+        key = _label_key(y_hat)
+        if key not in self._sample_keys[i]:
+            return False
+        # rule out hash collisions
+        y_hat = unwrap_pairwise(y_hat)
+        return any(np.all(y_hat == unwrap_pairwise(self.y_hats[r]))
+                   for r in self._rows[i] if self._keys[r] == key)
+
+    def slacks(self, w):
+        """Slack of each constraint for parameters w."""
+        return np.maximum(self.losses - np.dot(self.psis, w), 0)
+
+    def __delitem__(self, indices):
+        """Remove the constraints with the given indices."""
+        keep = np.ones(self.n_constraints, dtype=np.bool)
+        keep[indices] = False
+        for r in np.where(~keep)[0]:
+            keys = self._sample_keys[self._samples[r]]
+            keys[self._keys[r]] -= 1
+            if not keys[self._keys[r]]:
+                del keys[self._keys[r]]
+        del self._constraints[~keep]
+        self._samples = [s for s, k in zip(self._samples, keep) if k]
+        self._keys = [s for s, k in zip(self._keys, keep) if k]
+        self.y_hats = [s for s, k in zip(self.y_hats, keep) if k]
+        self._rows = [[] for i in xrange(len(self._rows))]
+        for r, i in enumerate(self._samples):
+            self._rows[i].append(r)
+
+
+class InferenceCache(object):
+    """Results of loss-augmented inference, cached per sample.
+
+    Stores up to ``size`` labelings per sample together with their psi and
+    loss. All psis are kept in one array of shape
+    ``(n_samples, size, size_psi)``, in single precision by default, so the
+    most violating cached labeling of every sample is found with a single
+    tensor product. The array grows with the number of cached labelings, up
+    to ``size`` per sample.
+
+    Behaves like a list with one entry per sample, each entry being the list
+    of cached ``(psi, loss, y_hat)`` tuples of that sample.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples.
+
+    size_psi : int
+        Length of the psi vectors.
+
+    size : int
+        Maximum number of labelings to cache per sample.
+
+    memory : int or None (default=None)
+        Maximum number of bytes used for storing the psis. Reduces the
+        number of cached labelings per sample if necessary, but at least one
+        labeling per sample is cached. None means no limit.
+
+    eviction : string (default='lru')
+        Which labeling to replace when the cache of a sample is full.
+        'lru' replaces the labeling that was least recently added or
+        used, 'violation' replaces the labeling that is least violated by
+        the current parameters.
+
+    dtype : numpy dtype (default=np.float32)
+        Data type for storing the psis.
+    """
+    def __init__(self, n_samples, size_psi, size, memory=None,
+                 eviction='lru', dtype=np.float32):
+        if eviction not in ['lru', 'violation']:
+            raise ValueError("eviction should be 'lru' or 'violation', got"
+                             " %s." % str(eviction))
+        if memory is not None:
+            bytes_per_labeling = (n_samples * size_psi
+                                  * np.dtype(dtype).itemsize)
+            size = max(min(size, int(memory // bytes_per_labeling)), 1)
+        self.size = size
+        self.eviction = eviction
+        capacity = min(size, 4)
+        self._psis = np.zeros((n_samples, capacity, size_psi), dtype=dtype)
+        self._losses = np.zeros((n_samples, capacity))
+        # when each labeling was last added or used
+        self._last_used = np.zeros((n_samples, capacity), dtype=np.int)
+        self._n_cached = np.zeros(n_samples, dtype=np.int)
+        self._y_hats = [[] for i in xrange(n_samples)]
+        self._keys = [[] for i in xrange(n_samples)]
+        self._time = 0
+
+    @property
+    def nbytes(self):
+        """Number of bytes used for the psis."""
+        return self._psis.nbytes
+
+    def __len__(self):
+        return len(self._y_hats)
+
+    def __getitem__(self, i):
+        return [(self._psis[i, j].astype(np.float), self._losses[i, j],
+                 y_hat) for j, y_hat in enumerate(self._y_hats[i])]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _grow(self):
+        n_samples, capacity, size_psi = self._psis.shape
+        capacity = min(2 * capacity, self.size)
+        psis = np.zeros((n_samples, capacity, size_psi),
+                        dtype=self._psis.dtype)
+        psis[:, :self._psis.shape[1]] = self._psis
+        losses = np.zeros((n_samples, capacity))
+        losses[:, :self._losses.shape[1]] = self._losses
+        last_used = np.zeros((n_samples, capacity), dtype=np.int)
+        last_used[:, :self._last_used.shape[1]] = self._last_used
+        self._psis, self._losses, self._last_used = psis, losses, last_used
+
+    def _violations(self, w):
+        violations = np.dot(self._psis, w.astype(self._psis.dtype))
+        violations += self._losses
+        # empty slots are never the most violated
+        empty = (np.arange(self._psis.shape[1])
+                 >= self._n_cached[:, np.newaxis])
+        violations[empty] = -np.inf
+        return violations
+
+    def add(self, i, psi, loss, y_hat, w=None):
+        """Cache labeling y_hat of sample i, if it is not cached already.
+
+        The parameters w are needed for the 'violation' eviction.
+        """
+        if isinstance(y_hat, tuple):
+            key = hash((_label_key(y_hat[0]), _label_key(y_hat[1])))
+        else:
+            key = _label_key(y_hat)
+        if any(_same_labeling(y_hat, self._y_hats[i][j])
+               for j, other in enumerate(self._keys[i]) if other == key):
+            return
+        self._time += 1
+        n_cached = self._n_cached[i]
+        if n_cached < self.size:
+            if n_cached == self._psis.shape[1]:
+                self._grow()
+            j = n_cached
+            self._n_cached[i] += 1
+            self._y_hats[i].append(y_hat)
+            self._keys[i].append(key)
+        else:
+            if self.eviction == 'lru':
+                j = np.argmin(self._last_used[i])
+            else:
+                violations = np.dot(self._psis[i], w) + self._losses[i]
+                j = np.argmin(violations)
+            self._y_hats[i][j] = y_hat
+            self._keys[i][j] = key
+        self._psis[i, j] = psi
+        self._losses[i, j] = loss
+        self._last_used[i, j] = self._time
+
+    def most_violated_sample(self, i, w):
+        """Find the most violated cached labeling of sample i.
+
+        Parameters
+        ----------
+        i : int
+            Index of the sample.
+
+        w : ndarray, shape (size_psi,)
+            Current parameters.
+
+        Returns
+        -------
+        constraint : tuple or None
+            ``(psi, loss, y_hat)`` of the labeling with the largest
+            ``np.dot(psi, w) + loss``, or None if nothing is cached for i.
+        """
+        n_cached = self._n_cached[i]
+        if not n_cached:
+            return None
+        violations = (np.dot(self._psis[i, :n_cached], w)
+                      + self._losses[i, :n_cached])
+        j = np.argmax(violations)
+        self._time += 1
+        self._last_used[i, j] = self._time
+        return (self._psis[i, j].astype(np.float), self._losses[i, j],
+                self._y_hats[i][j])
+
+    def most_violated(self, w):
+        """Find the most violated cached labeling of each sample.
+
+        Parameters
+        ----------
+        w : ndarray, shape (size_psi,)
+            Current parameters.
+
+        Returns
+        -------
+        Y_hat : list
+            Most violated cached labeling of each sample.
+
+        psi_sum : ndarray, shape (size_psi,)
+            Sum of the psis of the labelings in Y_hat.
+
+        loss_sum : float
+            Sum of the losses of the labelings in Y_hat.
+        """
+        if np.any(self._n_cached == 0):
+            raise ValueError("Cache is empty for some samples.")
+        best = np.argmax(self._violations(w), axis=1)
+        samples = np.arange(len(self))
+        self._time += 1
+        self._last_used[samples, best] = self._time
+        psi_sum = np.sum(self._psis[samples, best], axis=0, dtype=np.float)
+        loss_sum = np.sum(self._losses[samples, best])
+        Y_hat = [self._y_hats[i][j] for i, j in zip(samples, best)]
+        return Y_hat, psi_sum, loss_sum
@@ -52,17 +52,20 @@ def compress_sym(sym_expanded, make_symmetric=True):
 
 ## global functions for easy parallelization
 def find_constraint(model, x, y, w, y_hat=None, relaxed=True,
-                    compute_difference=True):
+                    compute_difference=True, init=None):
     """Find most violated constraint, or, given y_hat,
     find slack and dpsi for this constraing.
 
     As for finding the most violated constraint, it is enough to compute
     psi(x, y_hat), not dpsi, we can optionally skip computing psi(x, y)
     using compute_differences=False
+
+    If given, init is used to warm-start loss-augmented inference.
     """
 
     if y_hat is None:
-        y_hat = model.loss_augmented_inference(x, y, w, relaxed=relaxed)
+        y_hat = loss_augmented_inference(model, x, y, w, relaxed=relaxed,
+                                         init=init)
     psi = model.psi
     if getattr(model, 'rescale_C', False):
         delta_psi = -psi(x, y_hat, y)
@@ -104,17 +107,29 @@ def inference(model, x, w):
     return model.inference(x, w)
 
 
-def loss_augmented_inference(model, x, y, w, relaxed=True):
-    return model.loss_augmented_inference(x, y, w, relaxed=relaxed)
+def latent(model, x, y, w):
+    return model.latent(x, y, w)
+
+
+def loss_augmented_inference(model, x, y, w, relaxed=True, init=None):
+    if init is None:
+        return model.loss_augmented_inference(x, y, w, relaxed=relaxed)
+    return model.loss_augmented_inference(x, y, w, relaxed=relaxed,
+                                          init=init)
 
 
 # easy debugging
-def objective_primal(model, w, X, Y, C, variant='n_slack', n_jobs=1):
+def objective_primal(model, w, X, Y, C, variant='n_slack', n_jobs=1,
+                     pool=None):
     objective = 0
-    constraints = Parallel(
-        n_jobs=n_jobs)(delayed(find_constraint)(
-            model, x, y, w)
-            for x, y in zip(X, Y))
+    if pool is not None:
+        # workers already hold X and Y
+        constraints = pool.map(find_constraint, w)
+    else:
+        constraints = Parallel(
+            n_jobs=n_jobs)(delayed(find_constraint)(
+                model, x, y, w)
+                for x, y in zip(X, Y))
     slacks = zip(*constraints)[2]
 
     if variant == 'n_slack':
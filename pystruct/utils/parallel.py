@@ -0,0 +1,361 @@
+import heapq
+import multiprocessing
+import os
+import Queue
+from time import time
+
+import numpy as np
+from sklearn.externals.joblib import cpu_count
+
+
+# model, data and shared arrays of the pool the current worker process
+# belongs to
+_worker_data = None
+
+
+def _shared_views(shared):
+    return dict((name, np.frombuffer(array, dtype=np.float))
+                for name, array in shared.items())
+
+
+def _init_worker(model, X, Y, shared):
+    global _worker_data
+    _worker_data = (model, X, Y, _shared_views(shared))
+
+
+def _run_chunk(args):
+    func, w, positions, indices, init, labels, use_labels, kwargs = args
+    model, X, Y, _ = _worker_data
+    if not use_labels:
+        Y = None
+    results, times = [], []
+    for i, y_init, y in zip(indices, init, labels):
+        start = time()
+        call_kwargs = kwargs
+        if y_init is not None:
+            call_kwargs = dict(kwargs, init=y_init)
+        if y is None and Y is not None:
+            y = Y[i]
+        if y is None:
+            results.append(func(model, X[i], w, **call_kwargs))
+        else:
+            results.append(func(model, X[i], y, w, **call_kwargs))
+        times.append(time() - start)
+    return os.getpid(), positions, results, times
+
+
+def _run_chunk_catch(args):
+    # exceptions are returned instead of raised, so that apply_async calls
+    # the callback
+    try:
+        return _run_chunk(args)
+    except Exception as e:
+        return e
+
+
+def _run_shared(args):
+    func, indices, init, kwargs = args
+    model, X, Y, shared = _worker_data
+    start = time()
+    result = func(model, X, Y, shared, indices, init, **kwargs)
+    return os.getpid(), result, time() - start
+
+
+def estimate_cost(model, x):
+    """Estimate the cost of inference on x from the size of the problem.
+
+    Uses the number of variables of the LP relaxation, which is also the
+    number of operations of a pass of message passing.  Models that are not
+    graph based get a cost of one.
+    """
+    try:
+        n_nodes = len(model._get_features(x))
+        n_edges = len(model._get_edges(x))
+    except AttributeError:
+        return 1.
+    n_states = model.n_states
+    return float(n_nodes * n_states + n_edges * n_states ** 2)
+
+
+class WorkerPool(object):
+    """Pool of worker processes that keep a copy of the training data.
+
+    The model, X and Y are handed to the workers once, when the pool is
+    created. With the fork start method used on unix, they are not even
+    pickled but shared copy-on-write with the parent process. Afterwards,
+    each call to ``map`` only sends the parameters ``w``, the sample indices
+    and, optionally, a labeling to warm-start inference for each sample.
+
+    Samples are grouped into chunks of about equal cost, which are sent
+    out largest first. The cost of a sample is the time its last inference
+    took, or, before it was first processed, an estimate from the size of
+    the graph, see ``estimate_cost``.
+
+    Parameters
+    ----------
+    model : StructuredModel
+        Model passed to the worker functions.
+
+    X : list
+        Input instances.
+
+    Y : list or None (default=None)
+        Labels. If None, worker functions are called without labels.
+
+    n_jobs : int (default=-1)
+        Number of worker processes. -1 means using all processors.
+
+    shared : dict or None (default=None)
+        Names and sizes of float arrays in shared memory. Workers and the
+        parent process read and write the same memory, without locking.
+        See ``map_shared``.
+
+    Attributes
+    ----------
+    costs_ : ndarray, shape (n_samples,)
+        Estimated cost of each sample.
+
+    times_ : ndarray, shape (n_samples,)
+        Time the last call of a worker function took for each sample, NaN if
+        a sample was not processed yet.
+
+    shared : dict of ndarray
+        The shared arrays, as seen from the parent process.
+    """
+    def __init__(self, model, X, Y=None, n_jobs=-1, shared=None):
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        self.n_jobs = n_jobs
+        self.X = X
+        self.Y = Y
+        self.costs_ = np.array([estimate_cost(model, x) for x in X])
+        self.times_ = np.empty(len(X))
+        self.times_.fill(np.nan)
+        self._busy = {}
+        self._wall_time = 0.
+        # the workers inherit the shared memory when they are forked
+        shared = dict((name, multiprocessing.RawArray('d', int(size)))
+                      for name, size in (shared or {}).items())
+        self.shared = _shared_views(shared)
+        self._pool = multiprocessing.Pool(n_jobs, _init_worker,
+                                          (model, X, Y, shared))
+
+    def _schedule(self, indices):
+        """Split positions in indices into chunks of roughly equal cost."""
+        costs = self.times_[indices]
+        unknown = np.isnan(costs)
+        if np.any(unknown):
+            # bring estimates to the scale of the measured times
+            estimates = self.costs_[indices]
+            scale = 1.
+            if not np.all(unknown):
+                scale = (np.sum(costs[~unknown])
+                         / max(np.sum(estimates[~unknown]), 1e-10))
+            costs[unknown] = estimates[unknown] * scale
+        # a few chunks per worker to even out errors in the costs
+        n_chunks = min(len(indices), 4 * self.n_jobs)
+        # greedily put the most expensive remaining sample into the
+        # cheapest chunk
+        heap = [(0., c) for c in xrange(n_chunks)]
+        chunks = [[] for c in xrange(n_chunks)]
+        for position in np.argsort(-costs, kind='mergesort'):
+            load, c = heapq.heappop(heap)
+            chunks[c].append(position)
+            heapq.heappush(heap, (load + costs[position], c))
+        loads = dict((c, load) for load, c in heap)
+        # send out the most expensive chunks first
+        return [np.array(chunks[c]) for c in
+                sorted(loads, key=loads.get, reverse=True)]
+
+    def map(self, func, w, indices=None, init=None, labels=None,
+            use_labels=True, **kwargs):
+        """Apply func to the samples given by indices.
+
+        Calls ``func(model, x, y, w, **kwargs)`` or, if the pool was created
+        without labels or use_labels is False, and no labels are given,
+        ``func(model, x, w, **kwargs)`` in the workers.
+
+        Parameters
+        ----------
+        func : callable
+            Module level function, for example ``find_constraint``.
+
+        w : ndarray
+            Parameters passed to func.
+
+        indices : array-like or None (default=None)
+            Samples to process. None means all samples.
+
+        init : list or None (default=None)
+            Labelings to warm-start inference with, one per index. Passed as
+            keyword argument ``init`` to func if not None.
+
+        labels : list or None (default=None)
+            Labels to pass to func instead of the ones the pool was created
+            with, one per index. Used for example for the latent variables
+            that complete the ground truth.
+
+        use_labels : bool (default=True)
+            Whether to pass the labels the pool was created with to func.
+            False for functions without labels, for example ``inference``.
+
+        Returns
+        -------
+        results : list
+            Result of func for each index, in order.
+        """
+        if indices is None:
+            indices = np.arange(len(self.X))
+        indices = np.asarray(indices)
+        if not len(indices):
+            return []
+        if init is None:
+            init = [None] * len(indices)
+        if labels is None:
+            labels = [None] * len(indices)
+        tasks = [(func, w, positions, indices[positions],
+                  [init[p] for p in positions],
+                  [labels[p] for p in positions], use_labels, kwargs)
+                 for positions in self._schedule(indices)]
+        start = time()
+        results = [None] * len(indices)
+        for pid, positions, chunk_results, times in \
+                self._pool.imap_unordered(_run_chunk, tasks):
+            for p, result in zip(positions, chunk_results):
+                results[p] = result
+            self.times_[indices[positions]] = times
+            self._busy[pid] = self._busy.get(pid, 0) + np.sum(times)
+        self._wall_time += time() - start
+        return results
+
+    def imap(self, func, get_w, indices=None, init=None, chunk_size=1,
+             **kwargs):
+        """Apply func to the samples given by indices, as workers get free.
+
+        Unlike ``map``, the parameters are not fixed for all samples. Each
+        worker has up to two chunks of samples to process, and a new chunk
+        is sent out with the parameters ``get_w()`` returns at that time,
+        whenever the caller is done with the results of a chunk. So results
+        can be computed with parameters that are a few chunks old.
+
+        Parameters
+        ----------
+        func : callable
+            Module level function, for example ``find_constraint``.
+
+        get_w : callable
+            Returns the parameters to send with the next chunk. The tasks
+            are pickled by a background thread of the pool, so get_w should
+            return a copy if the caller updates the parameters in place.
+
+        indices : array-like or None (default=None)
+            Samples to process, in order. None means all samples.
+
+        init : list or None (default=None)
+            Labelings to warm-start inference with, one per index. Passed as
+            keyword argument ``init`` to func if not None.
+
+        chunk_size : int (default=1)
+            Number of samples sent to a worker at a time.
+
+        Yields
+        ------
+        index : int
+            Sample index.
+
+        result : object
+            Result of func for the sample, in the order they arrive.
+        """
+        if indices is None:
+            indices = np.arange(len(self.X))
+        indices = np.asarray(indices)
+        if init is None:
+            init = [None] * len(indices)
+        chunks = iter([np.arange(start, min(start + chunk_size, len(indices)))
+                       for start in xrange(0, len(indices), chunk_size)])
+        done = Queue.Queue()
+
+        def submit():
+            positions = next(chunks, None)
+            if positions is None:
+                return 0
+            task = (func, get_w(), positions, indices[positions],
+                    [init[p] for p in positions], [None] * len(positions),
+                    True, kwargs)
+            self._pool.apply_async(_run_chunk_catch, (task,),
+                                   callback=done.put)
+            return 1
+
+        start = time()
+        n_pending = sum(submit() for i in xrange(2 * self.n_jobs))
+        while n_pending:
+            result = done.get()
+            n_pending -= 1
+            if isinstance(result, Exception):
+                raise result
+            pid, positions, chunk_results, times = result
+            self.times_[indices[positions]] = times
+            self._busy[pid] = self._busy.get(pid, 0) + np.sum(times)
+            for p, chunk_result in zip(positions, chunk_results):
+                yield indices[p], chunk_result
+            n_pending += submit()
+        self._wall_time += time() - start
+
+    def map_shared(self, func, indices=None, init=None, **kwargs):
+        """Apply func to chunks of samples, with access to shared memory.
+
+        Calls ``func(model, X, Y, shared, indices, init, **kwargs)`` in the
+        workers, where ``shared`` is the dict of shared arrays and
+        ``indices`` and ``init`` are a chunk of the samples and their
+        warm-start labelings. Chunks are formed as in ``map``. As the
+        workers run concurrently, func sees the changes the other workers
+        make to the shared arrays.
+
+        Parameters
+        ----------
+        func : callable
+            Module level function.
+
+        indices : array-like or None (default=None)
+            Samples to process. None means all samples.
+
+        init : list or None (default=None)
+            Labelings to warm-start inference with, one per index.
+
+        Returns
+        -------
+        results : list of tuple
+            Indices of each chunk and the result of func for it.
+        """
+        if indices is None:
+            indices = np.arange(len(self.X))
+        indices = np.asarray(indices)
+        if init is None:
+            init = [None] * len(indices)
+        tasks = [(func, indices[positions], [init[p] for p in positions],
+                  kwargs) for positions in self._schedule(indices)]
+        start = time()
+        results = self._pool.map(_run_shared, tasks, chunksize=1)
+        self._wall_time += time() - start
+        for pid, result, busy in results:
+            self._busy[pid] = self._busy.get(pid, 0) + busy
+        return [(task[1], result) for task, (_, result, _) in zip(tasks,
+                                                                   results)]
+
+    def utilization(self):
+        """Fraction of time each worker spent on work, since creation.
+
+        Returns
+        -------
+        utilization : ndarray, shape (n_jobs,)
+            Time spent in worker functions divided by the time spent in
+            ``map``, for each worker process, highest first.
+        """
+        busy = np.zeros(self.n_jobs)
+        busy[:len(self._busy)] = sorted(self._busy.values(), reverse=True)
+        return busy / max(self._wall_time, 1e-10)
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.close()
+        self._pool.join()
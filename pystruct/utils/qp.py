@@ -0,0 +1,340 @@
+import warnings
+
+import numpy as np
+from scipy.linalg import solve_triangular
+from sklearn.utils import ConvergenceWarning
+
+
+def _cholesky_update(factor, x, sign=1):
+    """Update the Cholesky factor R in place to that of R^T R + x x^T.
+
+    R is upper triangular. With sign=-1, R^T R - x x^T is factorized
+    instead. Returns False if that is not positive definite.
+    """
+    x = x.copy()
+    for k in xrange(len(x)):
+        diag = factor[k, k]
+        r2 = diag ** 2 + sign * x[k] ** 2
+        if r2 <= 0:
+            return False
+        r = np.sqrt(r2)
+        c, s = r / diag, x[k] / diag
+        factor[k, k] = r
+        factor[k, k + 1:] += sign * s * x[k + 1:]
+        factor[k, k + 1:] /= c
+        x[k + 1:] = c * x[k + 1:] - s * factor[k, k + 1:]
+    return True
+
+
+class _SupportSystem(object):
+    """KKT system of the QP restricted to the support.
+
+    In each group where the sum constraint is active, one variable of the
+    support, the pivot, is expressed through the others as ``C`` minus
+    their sum. This leaves an unconstrained, positive definite system over
+    the other support variables. Its Cholesky factor is updated when a
+    variable enters or leaves the support, when a pivot is replaced and
+    when a sum constraint becomes active, which costs O(n_support ** 2).
+    It is only recomputed when a sum constraint becomes inactive. The upper
+    triangular factor is stored, so that the updates work on rows.
+    """
+    def __init__(self, gram, groups, n_groups, ridge):
+        self.gram = gram
+        self.groups = groups
+        self.n_groups = n_groups
+        self.ridge = ridge
+
+    def _hessian(self, rows, cols):
+        # entries of P^T (gram + ridge * I) P, where column i of P is
+        # e_i - e_pivot(i)
+        gram = self.gram
+        pivot_rows = self.pivot[self.groups[rows]]
+        pivot_cols = self.pivot[self.groups[cols]]
+        tight_rows, tight_cols = pivot_rows >= 0, pivot_cols >= 0
+        hessian = gram[np.ix_(rows, cols)]
+        hessian += self.ridge * (rows[:, np.newaxis] == cols)
+        hessian += self.ridge * ((pivot_rows[:, np.newaxis] == pivot_cols)
+                                 & tight_rows[:, np.newaxis])
+        hessian[:, tight_cols] -= gram[np.ix_(rows, pivot_cols[tight_cols])]
+        hessian[tight_rows] -= gram[np.ix_(pivot_rows[tight_rows], cols)]
+        hessian[np.ix_(tight_rows, tight_cols)] += gram[np.ix_(
+            pivot_rows[tight_rows], pivot_cols[tight_cols])]
+        return hessian
+
+    def factorize(self, support, free):
+        """Choose the pivots and compute the Cholesky factor from scratch."""
+        active = np.where(support)[0]
+        tight = active[~free[self.groups[active]]]
+        tight_groups, first = np.unique(self.groups[tight],
+                                        return_index=True)
+        self.pivot = -np.ones(self.n_groups, dtype=np.int)
+        self.pivot[tight_groups] = tight[first]
+        self.order = active[self.pivot[self.groups[active]] != active]
+        self.factor = np.linalg.cholesky(
+            self._hessian(self.order, self.order)).T.copy()
+
+    def add(self, i, free):
+        """Add variable i to the support."""
+        g = self.groups[i]
+        if not free[g] and self.pivot[g] < 0:
+            self.pivot[g] = i
+            return
+        column = self._hessian(np.hstack([self.order, i]), np.array([i]))
+        column = column.ravel()
+        n = len(self.order)
+        row = np.zeros(n)
+        if n:
+            row = solve_triangular(self.factor, column[:n], trans='T')
+        # the Schur complement is at least the ridge
+        diag = max(column[n] - np.dot(row, row), self.ridge)
+        factor = np.zeros((n + 1, n + 1))
+        factor[:n, :n] = self.factor
+        factor[:n, n] = row
+        factor[n, n] = np.sqrt(diag)
+        self.factor = factor
+        self.order = np.hstack([self.order, i])
+
+    def _delete(self, k):
+        # deleting column k of the factor leaves one entry below the
+        # diagonal in each of the following columns, which Givens rotations
+        # of the rows remove
+        self.order = np.delete(self.order, k)
+        factor = np.delete(self.factor, k, axis=1)
+        for j in xrange(k, len(factor) - 1):
+            a, b = factor[j, j], factor[j + 1, j]
+            r = np.hypot(a, b)
+            if r == 0:
+                continue
+            upper = factor[j, j:].copy()
+            lower = factor[j + 1, j:]
+            factor[j, j:] = (a * upper + b * lower) / r
+            factor[j + 1, j:] = (a * lower - b * upper) / r
+        self.factor = factor[:-1]
+
+    def _make_pivot(self, g):
+        # express the first variable of group g through the others, for a
+        # group without pivot where the sum constraint is active
+        members = np.where(self.groups[self.order] == g)[0]
+        if not len(members):
+            return True
+        k = members[0]
+        i = self.order[k]
+        # substituting z_i = const - sum(z_j) for the other variables j of
+        # the group changes the hessian H to
+        # H - x v^T - v x^T + c v v^T, with x = H[:, i], c = H[i, i] and v
+        # the indicator of the group, which is one update and one downdate
+        column = np.dot(self.factor[:, k], self.factor)
+        c = column[k]
+        x = np.delete(column, k) / np.sqrt(c)
+        self._delete(k)
+        v = (self.groups[self.order] == g) * np.sqrt(c)
+        self.pivot[g] = i
+        _cholesky_update(self.factor, v - x)
+        return _cholesky_update(self.factor, x, sign=-1)
+
+    def remove(self, i):
+        """Remove variable i from the support.
+
+        Returns False if the factor could not be updated, in which case
+        factorize needs to be called.
+        """
+        g = self.groups[i]
+        if self.pivot[g] == i:
+            # i is zero, so the other variables sum to C
+            self.pivot[g] = -1
+            return self._make_pivot(g)
+        self._delete(np.where(self.order == i)[0][0])
+        return True
+
+    def tighten(self, g):
+        """Make the sum constraint of group g active.
+
+        Returns False if the factor could not be updated, in which case
+        factorize needs to be called.
+        """
+        return self._make_pivot(g)
+
+    def solve(self, losses, C):
+        """Optimum of the QP restricted to the support, ignoring alpha >= 0.
+        """
+        gram, groups, order = self.gram, self.groups, self.order
+        has_pivot = np.where(self.pivot >= 0)[0]
+        pivots = self.pivot[has_pivot]
+        # linear term after fixing the pivots to C and eliminating them
+        residual = losses[order] - C * np.sum(gram[np.ix_(order, pivots)],
+                                              axis=1)
+        residual_pivot = np.zeros(self.n_groups)
+        residual_pivot[has_pivot] = losses[pivots] - C * (np.sum(
+            gram[np.ix_(pivots, pivots)], axis=1) + self.ridge)
+        solution = np.zeros(len(order))
+        if len(order):
+            rhs = residual - residual_pivot[groups[order]]
+            solution = solve_triangular(
+                self.factor, solve_triangular(self.factor, rhs, trans='T'))
+        target = np.zeros(len(losses))
+        target[order] = solution
+        sums = np.bincount(groups[order], solution, minlength=self.n_groups)
+        target[pivots] = C - sums[has_pivot]
+        return target
+
+
+def active_set_qp(gram, losses, groups, C, alpha=None, equality=False,
+                  tol=1e-9, max_iter=None):
+    """Solve the dual QP of cutting plane structured SVMs.
+
+    Minimizes ``0.5 * alpha^T gram alpha - losses^T alpha`` subject to
+    ``alpha >= 0`` and ``sum(alpha[groups == g]) <= C`` for each group ``g``,
+    or ``== C`` if ``equality`` is True. The 1-slack QP has one group with
+    an equality constraint, the n-slack QP has one group per sample.
+
+    Uses a primal active set method: The QP is solved restricted to the
+    constraints with non-zero dual variable (the support), ignoring
+    positivity, by solving the KKT system. If that leaves the feasible set,
+    the step is shortened and the variables that hit zero are dropped
+    from the support. Otherwise, for each group the variable that violates the
+    optimality conditions most is added. The sum constraints are
+    eliminated from the KKT system, and the Cholesky factor of the
+    remaining system is updated as the support changes. It only involves
+    the support, so it stays small even for many constraints, and warm
+    starts from the previous solution need few iterations.
+
+    Parameters
+    ----------
+    gram : ndarray, shape (n_constraints, n_constraints)
+        Inner products of the psis of the constraints.
+
+    losses : ndarray, shape (n_constraints,)
+        Losses of the constraints.
+
+    groups : ndarray of int, shape (n_constraints,)
+        Group each constraint belongs to.
+
+    C : float
+        Bound on the sum of dual variables in each group.
+
+    alpha : ndarray, shape (n_constraints,) or None (default=None)
+        Starting point, for example the solution of the previous cutting
+        plane iteration. Is made feasible if it is not.
+
+    equality : bool (default=False)
+        Whether the sum over each group needs to be exactly C.
+
+    tol : float (default=1e-9)
+        Tolerance for the optimality conditions, relative to the largest
+        gradient entry.
+
+    max_iter : int or None (default=None)
+        Maximum number of iterations. Defaults to ten times the number of
+        constraints. A ConvergenceWarning is raised if it is reached.
+
+    Returns
+    -------
+    alpha : ndarray, shape (n_constraints,)
+        Dual variables.
+    """
+    losses = np.asarray(losses, dtype=np.float)
+    n_constraints = len(losses)
+    _, groups = np.unique(groups, return_inverse=True)
+    n_groups = np.max(groups) + 1
+    # a tiny ridge makes the linear systems non-singular
+    ridge = 1e-10 * max(np.max(np.diag(gram)), 1.)
+
+    if alpha is None:
+        alpha = np.zeros(n_constraints)
+    alpha = np.maximum(np.asarray(alpha, dtype=np.float), 0)
+    # project the starting point onto the feasible set
+    mass = np.bincount(groups, alpha, minlength=n_groups)
+    for g in np.where((mass > C) | (equality & (mass < C)))[0]:
+        if mass[g] > 0:
+            alpha[groups == g] *= C / mass[g]
+        else:
+            alpha[groups == g] = C / float(np.sum(groups == g))
+    # the unused part of C in each group
+    slack = np.zeros(n_groups)
+    if not equality:
+        slack = C - np.bincount(groups, alpha, minlength=n_groups)
+
+    support = alpha > 0
+    free = slack > 0  # groups where the sum constraint is not active
+    if max_iter is None:
+        max_iter = 10 * n_constraints
+    system = _SupportSystem(gram, groups, n_groups, ridge)
+    system.factorize(support, free)
+    for iteration in xrange(max_iter):
+        target = system.solve(losses, C)
+        target_slack = np.zeros(n_groups)
+        if not equality:
+            target_slack = C - np.bincount(groups, target,
+                                           minlength=n_groups)
+
+        blocking = support & (target < 0)
+        blocking_slack = free & (target_slack < 0)
+        if np.any(blocking) or np.any(blocking_slack):
+            # go as far as possible towards the target
+            steps = np.hstack([
+                alpha[blocking] / (alpha[blocking] - target[blocking]),
+                slack[blocking_slack] / (slack[blocking_slack]
+                                         - target_slack[blocking_slack])])
+            step = np.min(steps)
+            alpha += step * (target - alpha)
+            slack += step * (target_slack - slack)
+            # remove the variables that hit zero from the support, at least
+            # the one that limited the step
+            hit = np.hstack([alpha[blocking], slack[blocking_slack]]) <= (
+                1e-12 * C)
+            hit[np.argmin(steps)] = True
+            n_blocking = np.sum(blocking)
+            hit_alpha = np.where(blocking)[0][hit[:n_blocking]]
+            hit_slack = np.where(blocking_slack)[0][hit[n_blocking:]]
+            alpha[hit_alpha] = 0
+            support[hit_alpha] = False
+            slack[hit_slack] = 0
+            free[hit_slack] = False
+            updated = True
+            for i in hit_alpha:
+                updated = updated and system.remove(i)
+            for g in hit_slack:
+                updated = updated and system.tighten(g)
+            if not updated:
+                system.factorize(support, free)
+            continue
+
+        alpha, slack = target, target_slack
+        grad = np.dot(gram, alpha) - losses
+        # Lagrange multipliers of the sum constraints, the gradient is the
+        # same for all variables of a group in the support
+        multipliers = np.zeros(n_groups)
+        has_pivot = system.pivot >= 0
+        multipliers[has_pivot] = grad[system.pivot[has_pivot]]
+        # reduced gradient of the variables outside of the support
+        reduced = grad - multipliers[groups]
+        reduced[support] = np.inf
+        # find the most violating variable of each group
+        best = np.empty(n_groups)
+        best.fill(np.inf)
+        np.minimum.at(best, groups, reduced)
+        best_var = np.zeros(n_groups, dtype=np.int)
+        is_best = reduced == best[groups]
+        best_var[groups[is_best]] = np.where(is_best)[0]
+        # increasing the slack of a group has zero gradient
+        reduced_slack = np.where(free, np.inf, -multipliers)
+        if equality:
+            reduced_slack.fill(np.inf)
+        use_slack = reduced_slack < best
+        best = np.minimum(best, reduced_slack)
+
+        add = best < -tol * max(np.max(np.abs(grad)), 1.)
+        if not np.any(add):
+            break
+        free[add & use_slack] = True
+        new_support = best_var[add & ~use_slack]
+        support[new_support] = True
+        if np.any(add & use_slack):
+            system.factorize(support, free)
+        else:
+            for i in new_support:
+                system.add(i, free)
+    else:
+        warnings.warn("active_set_qp did not converge in %d iterations."
+                      % max_iter, ConvergenceWarning)
+    return alpha
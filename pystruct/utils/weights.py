@@ -0,0 +1,71 @@
+import numpy as np
+
+
+class LazyWeights(object):
+    """Weight vector with cheap scaling, sparse updates and averaging.
+
+    The weights are stored as ``w = scale * v`` and their weighted average
+    as ``w_avg = a * u + b * v``. Multiplying w by a constant and updating
+    the average only change the scalars, and adding a vector to w only
+    touches its non-zero entries. The vectors are rescaled when the scalars
+    get too small.
+
+    Parameters
+    ----------
+    w : ndarray, shape (n_features,)
+        Initial weights.
+
+    w_avg : ndarray, shape (n_features,) or None (default=None)
+        Initial average. If None, the average is not maintained.
+    """
+    def __init__(self, w, w_avg=None):
+        self.scale = 1.
+        self.v = np.array(w, dtype=np.float)
+        self.averaging = w_avg is not None
+        if self.averaging:
+            self.a, self.b = 1., 0.
+            self.u = np.array(w_avg, dtype=np.float)
+
+    @property
+    def w(self):
+        """Current weights."""
+        return self.scale * self.v
+
+    @property
+    def w_avg(self):
+        """Current average of the weights."""
+        return self.a * self.u + self.b * self.v
+
+    def _normalize(self):
+        if self.averaging:
+            self.u = self.w_avg
+            self.a, self.b = 1., 0.
+        self.v *= self.scale
+        self.scale = 1.
+
+    def shrink(self, factor):
+        """Multiply the weights by factor."""
+        if factor == 0:
+            self._normalize()
+            self.v.fill(0)
+        else:
+            self.scale *= factor
+            if abs(self.scale) < 1e-4:
+                self._normalize()
+
+    def add(self, x):
+        """Add x to the weights."""
+        nonzero = np.flatnonzero(x)
+        delta = x[nonzero] / self.scale
+        self.v[nonzero] += delta
+        if self.averaging:
+            # keep the average unchanged
+            self.u[nonzero] -= (self.b / self.a) * delta
+
+    def update_average(self, rho):
+        """Set the average to ``(1 - rho) * w_avg + rho * w``."""
+        self.a *= 1 - rho
+        self.b = (1 - rho) * self.b + rho * self.scale
+        if self.a < 1e-4:
+            # b / a gets large, which costs precision in add
+            self._normalize()